@@ -1,12 +1,22 @@
-import subprocess
 import os
+import io
 import json
+import math
 import logging
 from sqlalchemy import create_engine, text
 import numpy as np
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 
+try:
+    import pyarrow as pa  # Tùy chọn: chỉ cần cho export Arrow IPC
+except ImportError:
+    pa = None
+ARROW_AVAILABLE = pa is not None
+
+from stream_codec import load_encoded_stream, decode_seek_index, decode_timestamps
+from idealem_decoder import decompress_idealem, decompress_samples, iter_samples
+
 load_dotenv()
 DB_CONFIG = {
     'host': os.getenv('DB_HOST', 'localhost'),
@@ -21,9 +31,31 @@ def setup_database():
     engine = create_engine(db_url)
     return engine
 
+RECORD_COLUMNS = ("id, device_id, compression_metadata, encoded_stream, time_range, encoded_stream_bin, seek_index, "
+                  "timestamp_channel")
+
+def _record_from_row(row):
+    metadata = row[2]
+    encoded_stream = row[3]
+    time_range = row[4]
+    if isinstance(metadata, str):
+        metadata = json.loads(metadata)
+    # Bản ghi mới lưu container nhị phân, bản ghi cũ chỉ có JSONB
+    encoded_stream = load_encoded_stream(row[5] if row[5] is not None else encoded_stream)
+    return {
+        'id': row[0],
+        'device_id': row[1],
+        'metadata': metadata,
+        'encoded_stream': encoded_stream,
+        'seek_index': decode_seek_index(row[6]) if row[6] is not None else None,
+        # Bản ghi cũ không có kênh timestamp: nội suy tuyến tính trên time_range
+        'timestamps': decode_timestamps(row[7]) if row[7] is not None else None,
+        'time_range': time_range
+    }
+
 def get_latest_compression_by_device(engine, device_id):
-    query = """
-    SELECT id, device_id, compression_metadata, encoded_stream, time_range
+    query = f"""
+    SELECT {RECORD_COLUMNS}
     FROM compressed_data_optimized
     WHERE device_id = :device_id
     ORDER BY id DESC
@@ -34,119 +66,480 @@ def get_latest_compression_by_device(engine, device_id):
         row = result.fetchone()
         if not row:
             return None
-        metadata = row[2]
-        encoded_stream = row[3]
-        time_range = row[4]
-        if isinstance(metadata, str):
-            metadata = json.loads(metadata)
-        if isinstance(encoded_stream, str):
-            encoded_stream = json.loads(encoded_stream)
-        return {
-            'id': row[0],
-            'device_id': row[1],
-            'metadata': metadata,
-            'encoded_stream': encoded_stream,
-            'time_range': time_range
-        }
+        return _record_from_row(row)
 
-def decompress_idealem(encoded_stream, block_size, num_buffers, original_length):
-    buffers = []
-    data = []
-    i = 0
-    while i < len(encoded_stream):
-        code = encoded_stream[i]
-        if isinstance(code, (int, np.integer)) and code == 0xFE:
-            i += 1
-            block_size = encoded_stream[i]
-            buffers = []
-        elif isinstance(code, (int, np.integer)) and code == 0xFF:
-            i += 1
-            overwrite_idx = encoded_stream[i]
-            i += 1
-            block = encoded_stream[i]
-            if isinstance(block, np.ndarray):
-                block = block.tolist()
-            while len(buffers) <= overwrite_idx:
-                buffers.append([0]*block_size)
-            buffers[overwrite_idx] = block.copy() if isinstance(block, list) else [block]
-            if isinstance(block, list):
-                data.extend(block)
-            else:
-                data.append(block)
-        elif isinstance(code, (int, np.integer)) and code == 0xFD:
-            i += 1
-            block = encoded_stream[i]
-            if isinstance(block, np.ndarray):
-                block = block.tolist()
-            if len(buffers) < num_buffers:
-                buffers.append(block.copy() if isinstance(block, list) else [block])
-            else:
-                buffers[0] = block.copy() if isinstance(block, list) else [block]
-            if isinstance(block, list):
-                data.extend(block)
-            else:
-                data.append(block)
-        elif isinstance(code, (int, np.integer)) and code < num_buffers:
-            block = buffers[code]
-            if isinstance(block, list):
-                data.extend(block)
-            else:
-                data.append(block)
-        i += 1
-    return np.array(data[:original_length])
+def latest_compression_mode(engine, device_id):
+    """
+    Chế độ nén của bản ghi mới nhất (id lớn nhất) của device: 'segment', 'full' hoặc None
+    nếu device chưa có bản ghi. Device từng nén theo cả hai chế độ thì bản ghi mới nhất quyết
+    định cách đọc, để không trả về dữ liệu cũ của chế độ còn lại.
+    """
+    query = """
+    SELECT compression_metadata ? 'segment'
+    FROM compressed_data_optimized
+    WHERE device_id = :device_id
+    ORDER BY id DESC
+    LIMIT 1
+    """
+    with engine.connect() as conn:
+        row = conn.execute(text(query), {"device_id": device_id}).fetchone()
+    if row is None:
+        return None
+    return 'segment' if row[0] else 'full'
+
+def get_compression_segments(engine, device_id, start=None, end=None):
+    """
+    Các bản ghi segment (nén theo cửa sổ, xem loss_compress --segment) của device có
+    time_range giao với [start, end], theo thứ tự thời gian. Lọc time_range dùng chỉ mục GIST.
+    """
+    query = f"""
+    SELECT {RECORD_COLUMNS}
+    FROM compressed_data_optimized
+    WHERE device_id = :device_id
+      AND compression_metadata ? 'segment'
+      AND time_range && tsrange(CAST(:start AS timestamp), CAST(:end AS timestamp), '[]')
+    ORDER BY lower(time_range), id
+    """
+    with engine.connect() as conn:
+        rows = conn.execute(text(query), {"device_id": device_id, "start": start, "end": end}).fetchall()
+    return [_record_from_row(row) for row in rows]
 
-def generate_timestamps(start_time, end_time, n):
+def generate_timestamps(start_time, end_time, n, offset=0, count=None):
+    """Timestamp chia đều time_range cho n mẫu, chỉ lấy các mẫu [offset, offset + count)"""
     start = datetime.fromisoformat(start_time)
     end = datetime.fromisoformat(end_time)
+    if count is None:
+        count = n - offset
     if n == 1:
-        return [start.isoformat()]
+        return [start.isoformat()][offset:offset + count]
     delta = (end - start) / (n - 1)
-    return [(start + i * delta).isoformat() for i in range(n)]
+    return [(start + i * delta).isoformat() for i in range(offset, offset + count)]
+
+def parse_time_range(time_range):
+    """(start_time, end_time) dạng ISO từ time_range (tsrange object hoặc string), None nếu không đọc được"""
+    # Kiểm tra string trước: str cũng có phương thức lower/upper
+    if isinstance(time_range, str):
+        if time_range.startswith('[') and time_range.endswith(']'):
+            start_time, end_time = time_range[1:-1].split(',')
+            return start_time.strip(), end_time.strip()
+        return None
+    if hasattr(time_range, 'lower') and hasattr(time_range, 'upper'):
+        start_time = time_range.lower.isoformat() if time_range.lower else None
+        end_time = time_range.upper.isoformat() if time_range.upper else None
+        return start_time, end_time
+    return None
+
+def format_timestamps(timestamps):
+    """Mảng datetime64 của kênh timestamp về ISO string giống datetime.isoformat()"""
+    timestamps = np.asarray(timestamps, dtype='datetime64[us]')
+    # isoformat() chỉ in phần micro giây khi khác 0
+    unit = 'us' if np.any(timestamps.astype(np.int64) % 1_000_000) else 's'
+    return np.datetime_as_string(timestamps, unit=unit).tolist()
 
 def combine_value_and_time(values, timestamps):
     return [{"timestamp": t, "value": float(v)} for t, v in zip(timestamps, values)]
 
 def decompress_device_data(device_id: str):
     engine = setup_database()
+    mode = latest_compression_mode(engine, device_id)
+    if mode is None:
+        return None, "Không tìm thấy bản ghi nén phù hợp"
+    if mode == 'segment':
+        # Chế độ segment: nối dữ liệu của từng cửa sổ theo thứ tự thời gian
+        segments = get_compression_segments(engine, device_id)
+        data_with_time = []
+        for record in segments:
+            data, error = decode_record(record)
+            if error:
+                return None, error
+            data_with_time.extend(data)
+        return data_with_time, None
     record = get_latest_compression_by_device(engine, device_id)
     if not record:
         return None, "Không tìm thấy bản ghi nén phù hợp"
+    return decode_record(record)
+
+def decode_record(record, start=None, end=None):
+    """
+    Giải nén một bản ghi compressed_data_optimized, có thể giới hạn trong [start, end]
+
+    Không giới hạn thì giải cả stream; có giới hạn thì chỉ giải các block phủ khoảng
+    đó (bắt đầu từ điểm seek index gần nhất, bản ghi cũ không có seek index thì giải
+    từ đầu stream). Timestamp lấy từ kênh timestamp nếu bản ghi có, không thì chia
+    đều time_range.
+
+    Returns:
+        (data_with_time, error)
+    """
     meta = record['metadata']
     block_size = meta.get('block_size')
     num_buffers = meta.get('num_buffers')
     original_length = meta.get('original_length')
     encoded_stream = record['encoded_stream']
     time_range = record['time_range']
-    decompressed_values = decompress_idealem(encoded_stream, block_size, num_buffers, original_length)
     # Lấy start_time, end_time từ time_range
-    if hasattr(time_range, 'lower') and hasattr(time_range, 'upper'):
-        start_time = time_range.lower.isoformat() if time_range.lower else None
-        end_time = time_range.upper.isoformat() if time_range.upper else None
-    elif isinstance(time_range, str) and time_range.startswith('[') and time_range.endswith(']'):
-        start_time, end_time = time_range[1:-1].split(',')
-        start_time = start_time.strip()
-        end_time = end_time.strip()
-    else:
+    bounds = parse_time_range(time_range)
+    if not bounds:
         return None, f"Không xác định được time_range: {time_range}"
-    timestamps = generate_timestamps(start_time, end_time, len(decompressed_values))
-    data_with_time = combine_value_and_time(decompressed_values, timestamps)
+    start_time, end_time = bounds
+    channel = record.get('timestamps')
+    if start is None and end is None:
+        decompressed_values = decompress_idealem(encoded_stream, block_size, num_buffers, original_length)
+        if channel is not None:
+            timestamps = format_timestamps(channel[:len(decompressed_values)])
+        else:
+            timestamps = generate_timestamps(start_time, end_time, len(decompressed_values))
+        return combine_value_and_time(decompressed_values, timestamps), None
+    first, last = record_sample_range(record, start, end)
+    values = decompress_samples(encoded_stream, num_buffers, record['seek_index'], first, last, original_length)
+    if channel is not None:
+        timestamps = format_timestamps(channel[first:first + len(values)])
+    else:
+        timestamps = generate_timestamps(start_time, end_time, original_length, offset=first, count=len(values))
+    return combine_value_and_time(values, timestamps), None
+
+def record_sample_range(record, start=None, end=None):
+    """Khoảng chỉ số mẫu [first, last) của bản ghi nằm trong [start, end] (không cần giải nén)"""
+    if record.get('timestamps') is not None:
+        return channel_sample_range(record['timestamps'], start, end)
+    n = record['metadata'].get('original_length')
+    if start is None and end is None:
+        return 0, n
+    start_time, end_time = parse_time_range(record['time_range'])
+    return sample_range(start_time, end_time, n, start, end)
+
+def _naive_datetime(value):
+    """
+    datetime/ISO string về datetime không múi giờ để so với time_range (TIMESTAMP, giờ UTC);
+    giá trị có múi giờ được đổi sang UTC trước khi bỏ tzinfo
+    """
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value is not None and value.tzinfo:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def channel_sample_range(timestamps, start=None, end=None):
+    """
+    Khoảng chỉ số mẫu [first, last) có timestamp thật (kênh timestamp) nằm trong [start, end]
+
+    Args:
+        timestamps: Mảng datetime64 tăng dần của bản ghi
+        start, end: Giới hạn thời gian cần lấy (datetime hoặc ISO string, None = không giới hạn)
+    """
+    start = _naive_datetime(start)
+    end = _naive_datetime(end)
+    first = 0 if start is None else int(np.searchsorted(timestamps, np.datetime64(start, 'us'), side='left'))
+    last = len(timestamps) if end is None else int(np.searchsorted(timestamps, np.datetime64(end, 'us'), side='right'))
+    return first, max(last, first)
+
+def sample_range(start_time, end_time, n, start=None, end=None):
+    """
+    Khoảng chỉ số mẫu [first, last) có timestamp nằm trong [start, end]
+
+    Args:
+        start_time, end_time: time_range của bản ghi (ISO string)
+        n: Số mẫu (original_length)
+        start, end: Giới hạn thời gian cần lấy (datetime hoặc ISO string, None = không giới hạn)
+    """
+    lower = datetime.fromisoformat(start_time)
+    upper = datetime.fromisoformat(end_time)
+    start = _naive_datetime(start)
+    end = _naive_datetime(end)
+    if n <= 1 or upper <= lower:
+        inside = (start is None or start <= lower) and (end is None or lower <= end)
+        return (0, n) if inside else (0, 0)
+    delta = (upper - lower) / (n - 1)
+    first = 0 if start is None else math.ceil((start - lower) / delta)
+    last = n if end is None else math.floor((end - lower) / delta) + 1
+    first = min(max(first, 0), n)
+    return first, max(min(last, n), first)
+
+def select_records(engine, device_id, start=None, end=None):
+    """
+    Các bản ghi cần đọc để lấy dữ liệu của device trong [start, end]: các segment giao
+    khoảng này nếu bản ghi mới nhất là segment, ngược lại bản ghi mới nhất (nén toàn bộ)
+
+    Returns:
+        (records, error)
+    """
+    mode = latest_compression_mode(engine, device_id)
+    if mode is None:
+        return None, "Không tìm thấy bản ghi nén phù hợp"
+    if mode == 'segment':
+        # Có thể rỗng: không có segment nào trong khoảng
+        records = get_compression_segments(engine, device_id, start, end)
+    else:
+        records = [get_latest_compression_by_device(engine, device_id)]
+    # Kiểm tra trước để response dạng stream không phải báo lỗi giữa chừng
+    for record in records:
+        if record['metadata'].get('num_buffers') is None or record['metadata'].get('original_length') is None:
+            return None, f"Bản ghi nén {record['id']} thiếu num_buffers/original_length"
+        if parse_time_range(record['time_range']) is None:
+            return None, f"Không xác định được time_range: {record['time_range']}"
+    return records, None
+
+def decompress_range(device_id: str, start=None, end=None):
+    """
+    Giải nén dữ liệu của device trong khoảng thời gian [start, end]
+
+    Với chế độ segment chỉ các segment giao khoảng này được đọc; trong mỗi bản ghi chỉ
+    các block phủ khoảng này được giải.
+
+    Returns:
+        (data_with_time, error)
+    """
+    engine = setup_database()
+    segments, error = select_records(engine, device_id, start, end)
+    if error:
+        return None, error
+    data_with_time = []
+    for record in segments:
+        data, error = decode_record(record, start, end)
+        if error:
+            return None, error
+        data_with_time.extend(data)
     return data_with_time, None
 
-def save_data(device_id: str):
+def record_slices(records, start=None, end=None, offset=0, limit=None):
+    """
+    Generator (record, first, last): khoảng mẫu cần giải của từng bản ghi sau khi áp
+    [start, end] và offset/limit (tính trên toàn bộ các mẫu trong khoảng)
+    """
+    skip, remaining = max(offset, 0), limit
+    for record in records:
+        if remaining is not None and remaining <= 0:
+            return
+        first, last = record_sample_range(record, start, end)
+        if last - first <= skip:
+            skip -= max(last - first, 0)
+            continue
+        first += skip
+        skip = 0
+        if remaining is not None:
+            last = min(last, first + remaining)
+            remaining -= last - first
+        yield record, first, last
+
+def timestamp_array(record, first, count):
+    """
+    Timestamp (datetime64[us]) của các mẫu [first, first + count) của bản ghi
+
+    Bản ghi không có kênh timestamp được nội suy giống generate_timestamps.
+    """
+    channel = record.get('timestamps')
+    if channel is not None:
+        return channel[first:first + count]
+    start_time, end_time = parse_time_range(record['time_range'])
+    start = np.datetime64(datetime.fromisoformat(start_time), 'us')
+    n = record['metadata'].get('original_length')
+    if n <= 1:
+        return np.full(count, start)
+    # timedelta / int làm tròn về micro giây như generate_timestamps
+    delta = (datetime.fromisoformat(end_time) - datetime.fromisoformat(start_time)) / (n - 1)
+    steps = np.arange(first, first + count, dtype=np.int64) * (delta // timedelta(microseconds=1))
+    return start + steps.astype('timedelta64[us]')
+
+def iter_rows(records, start=None, end=None, offset=0, limit=None):
+    """
+    Generator (timestamps, values) theo từng block của các bản ghi, trong [start, end]
+
+    offset/limit tính trên toàn bộ các mẫu trong khoảng và được đổi thành vị trí mẫu
+    trong từng bản ghi trước khi giải nén, nên các mẫu bị bỏ qua không phải giải.
+
+    Args:
+        records: Bản ghi theo thứ tự thời gian (xem select_records)
+        start, end: Giới hạn thời gian (None = không giới hạn)
+        offset: Số mẫu đầu tiên bỏ qua
+        limit: Số mẫu tối đa (None = không giới hạn)
+
+    Yields:
+        (list ISO timestamp, mảng float64 giá trị) cùng độ dài
+    """
+    for record, first, last in record_slices(records, start, end, offset, limit):
+        meta = record['metadata']
+        channel = record.get('timestamps')
+        if channel is None:
+            start_time, end_time = parse_time_range(record['time_range'])
+        pos = first
+        for values in iter_samples(record['encoded_stream'], meta.get('num_buffers'), record['seek_index'],
+                                   first, last, meta.get('original_length')):
+            if channel is not None:
+                timestamps = format_timestamps(channel[pos:pos + len(values)])
+            else:
+                timestamps = generate_timestamps(start_time, end_time, meta.get('original_length'),
+                                                 offset=pos, count=len(values))
+            pos += len(values)
+            yield timestamps, values
+
+STREAM_MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+    'csv': 'text/csv'
+}
+STREAM_CHUNK_BYTES = 64 * 1024
+
+def serialize_rows(rows, fmt, device_id=None):
+    """
+    Serialize dần các (timestamps, values) của iter_rows thành các đoạn text
+
+    Args:
+        rows: Generator của iter_rows
+        fmt: 'ndjson' (mỗi dòng một object), 'json' (cùng dạng {"device_id", "data": [...]}
+             của response thường, ghi theo từng đoạn) hoặc 'csv' (header timestamp,value)
+        device_id: device_id ghi vào response 'json'
+
+    Yields:
+        str, mỗi đoạn khoảng STREAM_CHUNK_BYTES
+    """
+    if fmt not in STREAM_MEDIA_TYPES:
+        raise ValueError(f"Định dạng không hỗ trợ: {fmt}")
+    if fmt == 'json':
+        yield '{"device_id": ' + json.dumps(device_id) + ', "data": ['
+    elif fmt == 'csv':
+        yield 'timestamp,value\n'
+    parts, size, first = [], 0, True
+    for timestamps, values in rows:
+        # Giá trị gốc là NUMERIC nên luôn hữu hạn, repr(float) trùng với json.dumps
+        if fmt == 'csv':
+            text_chunk = ''.join(f'{t},{v!r}\n' for t, v in zip(timestamps, values.tolist()))
+        else:
+            sep = '\n' if fmt == 'ndjson' else ', '
+            text_chunk = sep.join(f'{{"timestamp": "{t}", "value": {v!r}}}'
+                                  for t, v in zip(timestamps, values.tolist()))
+            if fmt == 'ndjson':
+                text_chunk += '\n'
+            elif text_chunk and not first:
+                text_chunk = ', ' + text_chunk
+            first = first and not text_chunk
+        parts.append(text_chunk)
+        size += len(text_chunk)
+        if size >= STREAM_CHUNK_BYTES:
+            yield ''.join(parts)
+            parts, size = [], 0
+    if parts:
+        yield ''.join(parts)
+    if fmt == 'json':
+        yield ']}'
+
+def columnar_arrays(records, start=None, end=None, offset=0, limit=None):
+    """
+    Giải nén thành hai cột: timestamp (int64, epoch millisecond, giờ ghi trong bản ghi coi
+    như UTC) và giá trị (float64)
+
+    Mỗi bản ghi giải vào một mảng cấp phát trước (decompress_samples); chỉ khi có nhiều
+    segment mới phải nối các mảng.
+
+    Returns:
+        (timestamps_ms, values)
+    """
+    columns = []
+    for record, first, last in record_slices(records, start, end, offset, limit):
+        meta = record['metadata']
+        values = decompress_samples(record['encoded_stream'], meta.get('num_buffers'), record['seek_index'],
+                                    first, last, meta.get('original_length'))
+        timestamps = timestamp_array(record, first, len(values)).astype('datetime64[ms]').astype(np.int64)
+        columns.append((timestamps, values))
+    if len(columns) == 1:
+        return columns[0]
+    if not columns:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=float)
+    return (np.concatenate([c[0] for c in columns]), np.concatenate([c[1] for c in columns]))
+
+COLUMNAR_MEDIA_TYPES = {
+    'npy': 'application/x-npy',
+    'arrow': 'application/vnd.apache.arrow.stream'
+}
+COLUMNAR_CHUNK_BYTES = 1024 * 1024
+
+def _buffer_chunks(buffer):
+    """Cắt buffer (memoryview, không copy toàn bộ) thành các đoạn bytes COLUMNAR_CHUNK_BYTES"""
+    view = memoryview(buffer).cast('B')
+    for pos in range(0, len(view), COLUMNAR_CHUNK_BYTES):
+        yield bytes(view[pos:pos + COLUMNAR_CHUNK_BYTES])
+
+def npy_chunks(timestamps, values):
+    """
+    Hai mảng .npy nối liền (timestamp int64 ms rồi giá trị float64); phía client đọc bằng
+    np.load hai lần trên cùng một file object
+    """
+    for array in (timestamps, values):
+        array = np.ascontiguousarray(array)
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(header, np.lib.format.header_data_from_array_1_0(array))
+        yield header.getvalue()
+        yield from _buffer_chunks(array)
+
+def arrow_chunks(timestamps, values):
+    """Arrow IPC stream một record batch gồm cột timestamp (timestamp[ms]) và value (float64)"""
+    if pa is None:
+        raise RuntimeError("Chưa cài pyarrow, không xuất được Arrow IPC")
+    # pa.array trên mảng NumPy không null dùng chung bộ nhớ, không copy
+    batch = pa.record_batch([pa.array(timestamps, type=pa.timestamp('ms')), pa.array(values)],
+                            names=['timestamp', 'value'])
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    yield from _buffer_chunks(sink.getvalue())
+
+def export_device_columns(device_id: str, fmt='npy', start=None, end=None, offset=0, limit=None):
+    """
+    Dữ liệu giải nén của device dạng cột nhị phân (npy hoặc arrow) cho /admin/decompress
+
+    Returns:
+        (generator các đoạn bytes, error)
+    """
+    if fmt not in COLUMNAR_MEDIA_TYPES:
+        return None, f"Định dạng không hỗ trợ: {fmt}"
+    if fmt == 'arrow' and pa is None:
+        return None, "Chưa cài pyarrow, không xuất được Arrow IPC"
+    engine = setup_database()
+    records, error = select_records(engine, device_id, start, end)
+    if error:
+        return None, error
+    timestamps, values = columnar_arrays(records, start, end, offset, limit)
+    chunks = npy_chunks if fmt == 'npy' else arrow_chunks
+    return chunks(timestamps, values), None
+
+def stream_device_data(device_id: str, fmt='ndjson', start=None, end=None, offset=0, limit=None):
+    """
+    Giải nén và serialize dần dữ liệu của device (response dạng stream của /admin/decompress)
+
+    Bản ghi được chọn và kiểm tra trước, phần giải nén/serialize chạy theo từng block
+    khi response được gửi.
+
+    Returns:
+        (generator các đoạn str, error)
+    """
+    if fmt not in STREAM_MEDIA_TYPES:
+        return None, f"Định dạng không hỗ trợ: {fmt}"
+    engine = setup_database()
+    records, error = select_records(engine, device_id, start, end)
+    if error:
+        return None, error
+    return serialize_rows(iter_rows(records, start, end, offset, limit), fmt, device_id), None
+
+def save_data(jobs, device_id: str, segment=None):
+    """
+    Đưa việc nén dữ liệu của device vào hàng đợi job nén trong tiến trình
+    (compression_jobs.CompressionJobService), trả về ngay job_id để tra cứu qua /admin/jobs/{id}
+    """
+    if segment is not None:
+        from loss_compress import SEGMENT_WINDOWS  # Import khi cần, API khởi động không nạp scipy
+        if segment not in SEGMENT_WINDOWS:
+            return {
+                "success": False,
+                "message": f"segment phải là một trong {list(SEGMENT_WINDOWS)}"
+            }
     try:
-        result = subprocess.run([
-            "python3", "loss_compress.py", "--device-id", device_id
-        ], capture_output=True, text=True, check=True)
-        return {
-            "success": True,
-            "message": f"Đã chạy loss_compress.py cho device {device_id}",
-            "stdout": result.stdout,
-            "stderr": result.stderr
-        }
-    except subprocess.CalledProcessError as e:
+        job_id = jobs.submit(device_id, segment=segment)
+    except Exception as e:
         return {
             "success": False,
-            "message": f"Lỗi khi chạy loss_compress.py: {e}",
-            "stdout": e.stdout,
-            "stderr": e.stderr
+            "message": f"Không tạo được job nén: {e}"
         }
+    return {
+        "success": True,
+        "message": f"Đã tạo job nén cho device {device_id}",
+        "job_id": job_id
+    }
@@ -0,0 +1,17 @@
+"""
+Thêm cột encoded_stream_bin (bytea) cho container nhị phân của encoded_stream
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '0002_encoded_stream_binary'
+down_revision = '0001_init_schema_from_legacy_sql'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Bản ghi cũ vẫn giữ encoded_stream JSONB, bản ghi mới chỉ ghi encoded_stream_bin
+    op.execute('ALTER TABLE compressed_data_optimized ADD COLUMN IF NOT EXISTS encoded_stream_bin BYTEA')
+
+def downgrade():
+    op.execute('ALTER TABLE compressed_data_optimized DROP COLUMN IF EXISTS encoded_stream_bin')
@@ -0,0 +1,17 @@
+"""
+Thêm cột seek_index (bytea) để giải nén theo khoảng thời gian
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '0003_seek_index'
+down_revision = '0002_encoded_stream_binary'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Bản ghi cũ không có seek index được giải nén từ đầu stream
+    op.execute('ALTER TABLE compressed_data_optimized ADD COLUMN IF NOT EXISTS seek_index BYTEA')
+
+def downgrade():
+    op.execute('ALTER TABLE compressed_data_optimized DROP COLUMN IF EXISTS seek_index')
@@ -0,0 +1,17 @@
+"""
+Thêm cột timestamp_channel (bytea) lưu timestamp thật của từng mẫu
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '0004_timestamp_channel'
+down_revision = '0003_seek_index'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Bản ghi cũ không có kênh timestamp được nội suy tuyến tính trên time_range
+    op.execute('ALTER TABLE compressed_data_optimized ADD COLUMN IF NOT EXISTS timestamp_channel BYTEA')
+
+def downgrade():
+    op.execute('ALTER TABLE compressed_data_optimized DROP COLUMN IF EXISTS timestamp_channel')
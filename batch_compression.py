@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Nén IDEALEM cho nhiều device cùng lúc (lockstep).
+
+Mỗi device vẫn có LosslessCompressor riêng (buffer pool, sampling block size, seek
+index), nhưng ở mỗi bước các device đang có cùng block size được so khớp chung: block
+hiện tại của từng device và pool buffer (đã sắp xếp) của nó được xếp thành tensor 3
+chiều (device, buffer, n) rồi tính thống kê KS trong một lần gọi (ks_matching.find_in_pools).
+Quyết định hit/miss sau đó được đưa lại cho compressor của từng device qua
+encode_next(), nên encoded stream của mỗi device giống hệt khi nén riêng bằng
+LosslessCompressor.compress().
+
+Device có pool rỗng, buffer không đều (độ dài khác n, NaN/inf) hoặc tắt ks_vectorized
+thì compressor tự so khớp như cũ trong cùng bước.
+"""
+
+import time
+import logging
+import numpy as np
+from typing import Dict
+
+from ks_matching import find_in_pools
+from lossless_compression import LosslessCompressor
+
+logger = logging.getLogger(__name__)
+
+
+class BatchCompressor:
+    """Nén nhiều chuỗi (vd. nhiều device) cùng lúc, so khớp KS theo lô giữa các chuỗi"""
+
+    # Số phần tử tối đa của mảng trung gian (device x buffer x n x n) mỗi lần so khớp
+    MAX_BATCH_ELEMENTS = 8_000_000
+
+    def __init__(self, config=None):
+        """
+        Args:
+            config: Cấu hình chung cho compressor của mọi chuỗi (như LosslessCompressor)
+        """
+        self.config = config
+        self.stats = {'steps': 0, 'batched_blocks': 0, 'single_blocks': 0}
+
+    def compress(self, series: Dict) -> Dict:
+        """
+        Nén các chuỗi theo lockstep
+
+        Args:
+            series: Dict khóa (vd. device_id) -> mảng giá trị theo thứ tự thời gian
+
+        Returns:
+            Dict khóa -> kết quả như LosslessCompressor.compress()
+        """
+        self.stats = {'steps': 0, 'batched_blocks': 0, 'single_blocks': 0}
+        compressors = {}
+        data = {}
+        pos = {}
+        for key, values in series.items():
+            compressor = LosslessCompressor(self.config)
+            compressor.begin_stream()
+            data[key] = np.asarray(values, dtype=float)
+            compressors[key] = compressor
+            pos[key] = 0
+
+        try:
+            active = [key for key in compressors if len(data[key]) >= compressors[key].block_size]
+            while active:
+                self.stats['steps'] += 1
+                # Nhóm các chuỗi theo block size hiện tại
+                groups = {}
+                for key in active:
+                    groups.setdefault(compressors[key].block_size, []).append(key)
+                for n, keys in groups.items():
+                    blocks = {key: data[key][pos[key]:pos[key] + n] for key in keys}
+                    for key in keys:
+                        pos[key] += n
+                    self._encode_group(compressors, blocks)
+                active = [key for key in active if len(data[key]) - pos[key] >= compressors[key].block_size]
+
+            # Phần còn lại (ngắn hơn một block) được mã hóa như feed()/flush()
+            results = {key: compressor.finish_stream(data[key][pos[key]:])
+                       for key, compressor in compressors.items()}
+        finally:
+            for compressor in compressors.values():
+                compressor.close()
+        logger.info(f"[BATCH] {len(series)} chuỗi, {self.stats['steps']} bước, "
+                    f"{self.stats['batched_blocks']} block so khớp theo lô, {self.stats['single_blocks']} block so khớp riêng")
+        return results
+
+    def _encode_group(self, compressors: Dict, blocks: Dict):
+        """Mã hóa block hiện tại của các chuỗi có cùng block size n"""
+        threshold = compressors[next(iter(blocks))].config['similarity_threshold']
+        start = time.perf_counter()
+        batch_keys = [key for key, block in blocks.items() if compressors[key].buffers.batchable(block)]
+        matches = {}
+        if batch_keys:
+            found = find_in_pools([compressors[key].buffers for key in batch_keys],
+                                  np.stack([blocks[key] for key in batch_keys]), threshold, self.MAX_BATCH_ELEMENTS)
+            matches = dict(zip(batch_keys, found.tolist()))
+        # Thời gian so khớp chung chia đều cho các chuỗi của nhóm
+        shared = (time.perf_counter() - start) / len(blocks)
+        self.stats['batched_blocks'] += len(matches)
+        self.stats['single_blocks'] += len(blocks) - len(matches)
+
+        for key, block in blocks.items():
+            compressors[key].encode_next(block, matches.get(key), match_seconds=shared)
@@ -0,0 +1,600 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark thuật toán nén IDEALEM trên dữ liệu giả lập của templates/gentwo.py.
+
+Cách sử dụng:
+    python3 benchmark_compression.py matching [--days 7 30] [--seed 0]
+    python3 benchmark_compression.py sampling [--days 30] [--workers 1 4] [--executor process] [--recent-size 4000]
+    python3 benchmark_compression.py window [--samples 1000000] [--block-size 24]
+    python3 benchmark_compression.py format [--days 30] [--codecs auto float64 float32] [--block-encodings float varint]
+                                            [--post-stages none zlib lzma range]
+    python3 benchmark_compression.py decode [--samples 2000000 5000000] [--hit-ratio 0.85]
+    python3 benchmark_compression.py export [--days 30 365]
+    python3 benchmark_compression.py batch [--devices 32] [--days 14] [--sampling-interval 10]
+    python3 benchmark_compression.py policy [--days 30 90] [--num-buffers 16] [--policies first_slot fifo lru lfu aging]
+    python3 benchmark_compression.py probe [--days 30 90] [--orders index mru frequency]
+    python3 benchmark_compression.py prefilter [--days 30 90] [--points 0 2 5 9] [--reference]
+    python3 benchmark_compression.py kstest [--min-n 12] [--max-n 48] [--trials 20]
+
+Các benchmark:
+    matching: So sánh thời gian đường so khớp từng cặp (ks_vectorized=False) với engine
+              vector hóa, đồng thời kiểm tra encoded_stream, hit_ratio và các lần
+              đổi block size giống hệt nhau. Kiểm tra với vòng so khớp gốc (stats.ks_2samp
+              từng cặp, đóng băng) nằm trong tests/test_ks_matching.py.
+    sampling: Thời gian sampling block size so với encoding, hiệu quả memo/dùng lại
+              cặp KS, theo số worker đánh giá ứng viên.
+    window:   Cửa sổ sampling: list extend + cắt + np.array (cách cũ) so với RingBuffer,
+              đo thời gian và số byte cấp phát mới trên chuỗi ngẫu nhiên.
+    format:   Kích thước và thời gian encode/decode encoded_stream: JSON (như cột JSONB)
+              so với container nhị phân của stream_codec theo từng codec giá trị, với
+              block miss dạng float hoặc đóng gói varint (block_encoding), và
+              compression_ratio trước/sau tầng nén thứ cấp (so với float64 8 byte/mẫu).
+    decode:   decompress_idealem dùng chung (cấp phát trước + gán slice) so với cách
+              duyệt list cũ, trên stream tổng hợp nhiều triệu mẫu.
+    export:   Response của /admin/decompress: JSON timestamp ISO so với dạng cột nhị phân
+              (.npy, Arrow IPC nếu có pyarrow), đo kích thước payload, thời gian tạo phía
+              server và thời gian client đọc về mảng timestamp/giá trị.
+    batch:    Nhiều device (mỗi device một seed): nén từng device bằng LosslessCompressor
+              so với BatchCompressor (so khớp KS theo lô giữa các device), kiểm tra
+              encoded_stream và seek index của từng device giống hệt nhau.
+    policy:   Chính sách thay thế buffer (first_slot, fifo, lru, lfu, aging) trên dữ liệu
+              ngày thường/cuối tuần: hit ratio, số lần ghi đè, kích thước stream nhị phân
+              và compression_ratio, kiểm tra giải nén từ điểm seek trùng giải toàn bộ.
+    probe:    Thứ tự thử buffer khi so khớp (index, mru, frequency): số phép KS trung
+              bình mỗi block, hit ratio, kích thước stream và thời gian encoding.
+    prefilter: Bộ lọc cận dưới (min/max, phân vị) trước phép KS chính xác: số phép KS
+              tránh được theo số điểm sketch, kiểm tra stream giống hệt khi tắt lọc.
+    kstest:   Kernel KS cho hai mẫu cùng kích thước (ks_2samp_equal) so với stats.ks_2samp
+              trên mọi block size từ min_block_size tới max_block_size: statistic và
+              p-value phải trùng từng bit, đo thời gian mỗi cặp.
+"""
+
+import os
+import sys
+import json
+import base64
+import time
+import random
+import logging
+import argparse
+import warnings
+import io
+from datetime import datetime
+import numpy as np
+from scipy import stats
+
+from lossless_compression import LosslessCompressor
+from batch_compression import BatchCompressor
+from ring_buffer import RingBuffer
+from stream_codec import (encode_stream, decode_stream, is_packed_block, unpack_block,
+                          apply_post_stage, load_encoded_stream, encode_timestamps, decode_timestamps)
+from idealem_decoder import decompress_idealem, decompress_samples
+from replacement_policy import REPLACEMENT_POLICIES
+from ks_matching import BufferPool, znormalize, ks_2samp_equal, precompute_pvalue_tables
+from admin_action.save_data import (iter_rows, serialize_rows, columnar_arrays, npy_chunks, arrow_chunks,
+                                    ARROW_AVAILABLE)
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+
+def load_gentwo_series(num_days, seed=0):
+    """
+    Sinh chuỗi công suất ngày thường/cuối tuần bằng templates/gentwo.py
+
+    Args:
+        num_days: Số ngày dữ liệu (288 điểm/ngày)
+        seed: Seed cho bộ sinh ngẫu nhiên
+
+    Returns:
+        (values, timestamps): values làm tròn 2 chữ số như cột NUMERIC(10,2)
+    """
+    if TEMPLATES_DIR not in sys.path:
+        sys.path.insert(0, TEMPLATES_DIR)
+    import gentwo
+    gentwo.logger.setLevel(logging.WARNING)
+    random.seed(seed)
+    points = gentwo.generate_template_data(num_days=num_days, start_date=datetime(2024, 1, 1))
+    values = np.round(np.array([p['value'] for p in points], dtype=float), 2)
+    timestamps = [p['timestamp'] for p in points]
+    return values, timestamps
+
+
+def stream_tokens(encoded_stream):
+    """Chuyển encoded_stream về list thuần Python để so sánh (block đóng gói được giải ra)"""
+    return [unpack_block(x).tolist() if is_packed_block(x) else x.tolist() if isinstance(x, np.ndarray) else int(x)
+            for x in encoded_stream]
+
+
+def json_tokens(encoded_stream):
+    """encoded_stream dạng JSON như khi lưu cột JSONB (block đóng gói ghi base64)"""
+    return [base64.b64encode(x).decode('ascii') if isinstance(x, bytes)
+            else x.tolist() if isinstance(x, np.ndarray) else int(x) for x in encoded_stream]
+
+
+def blocksize_changes(encoded_stream):
+    """Danh sách block size mới theo thứ tự xuất hiện của BLOCKSIZE_CHANGE_MARKER"""
+    # Token số nguyên chỉ là marker, chỉ số buffer (< num_buffers) hoặc block size nên không nhầm được
+    tokens = stream_tokens(encoded_stream)
+    return [tokens[i + 1] for i in range(len(tokens) - 1)
+            if tokens[i] == LosslessCompressor.BLOCKSIZE_CHANGE_MARKER]
+
+
+def timed_compress(data, config=None):
+    """Nén data, trả về (kết quả, thời gian giây)"""
+    compressor = LosslessCompressor(config)
+    start = time.perf_counter()
+    result = compressor.compress(data)
+    return result, time.perf_counter() - start
+
+
+def bench_matching(args):
+    ok = True
+    for days in args.days:
+        data, _ = load_gentwo_series(days, args.seed)
+        ref, ref_time = timed_compress(data, {'ks_vectorized': False})
+        new, new_time = timed_compress(data)
+        same_stream = stream_tokens(ref['encoded_stream']) == stream_tokens(new['encoded_stream'])
+        same_hit = ref['hit_ratio'] == new['hit_ratio']
+        same_sizes = (blocksize_changes(ref['encoded_stream']) == blocksize_changes(new['encoded_stream'])
+                      and ref['block_size'] == new['block_size'])
+        ok = ok and same_stream and same_hit and same_sizes
+        print(f"[matching] days={days} samples={len(data)} "
+              f"reference={ref_time:.2f}s vectorized={new_time:.2f}s speedup={ref_time / max(new_time, 1e-9):.1f}x "
+              f"hit_ratio={new['hit_ratio']:.4f} stream={'OK' if same_stream else 'DIFF'} "
+              f"hit_ratio={'OK' if same_hit else 'DIFF'} block_size={'OK' if same_sizes else 'DIFF'}")
+    return ok
+
+
+def bench_sampling(args):
+    for days in args.days:
+        data, _ = load_gentwo_series(days, args.seed)
+        for workers in args.workers:
+            result, elapsed = timed_compress(data, {
+                'sampling_workers': workers,
+                'sampling_executor': args.executor,
+                'sampling_recent_size': args.recent_size
+            })
+            t = result['timings']
+            print(f"[sampling] days={days} samples={len(data)} executor={args.executor} workers={workers} "
+                  f"recent_size={args.recent_size} total={elapsed:.2f}s "
+                  f"sampling={t['sampling_seconds']:.2f}s encoding={t['encoding_seconds']:.2f}s "
+                  f"rounds={t['sampling_rounds']} candidates={t['candidates_evaluated']} memo_hits={t['memo_hits']} "
+                  f"computed_pairs={t['computed_pairs']} reused_pairs={t['reused_pairs']}")
+    return True
+
+
+def bench_window(args):
+    data = np.round(np.random.default_rng(args.seed).normal(200, 50, args.samples), 2)
+    size, interval, block_size = args.recent_size, args.interval, args.block_size
+
+    # Cách cũ: list Python extend rồi cắt lại mỗi block, np.array mỗi lần sampling
+    start = time.perf_counter()
+    recent, allocated, checksum = [], 0, 0.0
+    for k, i in enumerate(range(0, len(data), block_size), 1):
+        recent.extend(data[i:i + block_size].tolist())
+        allocated += block_size * sys.getsizeof(0.0)  # Đối tượng float của tolist()
+        if len(recent) > size:
+            recent = recent[-size:]
+            allocated += sys.getsizeof(recent)
+        if k % interval == 0:
+            window = np.array(recent)
+            allocated += window.nbytes
+            checksum += window[0]
+    legacy_time = time.perf_counter() - start
+
+    # RingBuffer: cấp phát một lần, view liên tục không copy
+    start = time.perf_counter()
+    ring = RingBuffer(size)
+    ring_allocated, ring_checksum = 2 * size * data.itemsize, 0.0  # Mảng 2 x capacity
+    for k, i in enumerate(range(0, len(data), block_size), 1):
+        ring.extend(data[i:i + block_size])
+        if k % interval == 0:
+            ring_checksum += ring.view()[0]
+    ring_time = time.perf_counter() - start
+
+    print(f"[window] samples={len(data)} block_size={block_size} recent_size={size} interval={interval} "
+          f"list={legacy_time:.3f}s ({allocated / 1e6:.1f} MB cấp phát) "
+          f"ring={ring_time:.3f}s ({ring_allocated / 1e6:.3f} MB cấp phát) "
+          f"same_windows={'OK' if checksum == ring_checksum else 'DIFF'}")
+    return checksum == ring_checksum
+
+
+def timed(func, *args, repeat=3, **kwargs):
+    """Chạy func nhiều lần, trả về (kết quả, thời gian tốt nhất giây)"""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def bench_format(args):
+    ok = True
+    for days in args.days:
+        data, timestamps = load_gentwo_series(days, args.seed)
+        channel, enc = timed(encode_timestamps, timestamps)
+        decoded, dec = timed(decode_timestamps, channel)
+        same = np.array_equal(decoded, np.array(timestamps, dtype='datetime64[us]'))
+        ok = ok and same
+        print(f"[format] days={days} timestamp_channel={len(channel)} bytes "
+              f"(JSON ISO {len(json.dumps([t.isoformat() for t in timestamps]))} bytes) "
+              f"encode={enc * 1e3:.1f}ms decode={dec * 1e3:.1f}ms roundtrip={'OK' if same else 'DIFF'}")
+        tokens = None
+        for block_encoding in args.block_encodings:
+            result = LosslessCompressor({'block_encoding': block_encoding}).compress(data)
+            if tokens is None:
+                tokens = stream_tokens(result['encoded_stream'])
+            # Các block_encoding phải cho cùng một stream sau khi giải block
+            same = stream_tokens(result['encoded_stream']) == tokens
+            ok = ok and same
+            blocks = [x for x in result['encoded_stream'] if not isinstance(x, (int, np.integer))]
+            block_bytes = sum(len(x) if isinstance(x, bytes) else len(json.dumps(x.tolist())) for x in blocks)
+            payload, json_enc = timed(json.dumps, json_tokens(result['encoded_stream']))
+            _, json_dec = timed(json.loads, payload)
+            json_size = len(payload.encode('utf-8'))
+            print(f"[format] days={days} samples={len(data)} block_encoding={block_encoding} "
+                  f"tokens={len(result['encoded_stream'])} raw_blocks={len(blocks)} ({block_bytes} bytes) "
+                  f"json={json_size} bytes encode={json_enc * 1e3:.1f}ms decode={json_dec * 1e3:.1f}ms "
+                  f"lossless={'OK' if same else 'DIFF'}")
+            for codec in args.codecs:
+                # Block đã đóng gói: 'auto' giữ nguyên varint, codec khác giải block về float
+                blob, enc = timed(encode_stream, result['encoded_stream'], value_codec=codec)
+                decoded, dec = timed(decode_stream, blob)
+                same = stream_tokens(decoded) == tokens
+                # float32 làm tròn giá trị nên không yêu cầu khớp tuyệt đối
+                ok = ok and (same or codec == 'float32')
+                print(f"[format]   codec={codec} binary={len(blob)} bytes ({json_size / len(blob):.1f}x nhỏ hơn JSON) "
+                      f"encode={enc * 1e3:.1f}ms decode={dec * 1e3:.1f}ms roundtrip={'OK' if same else 'DIFF'}")
+            container = encode_stream(result['encoded_stream'])
+            original_bytes = len(data) * 8
+            for stage in args.post_stages:
+                stored, enc = timed(apply_post_stage, container, stage)
+                decoded, dec = timed(load_encoded_stream, stored)
+                same = stream_tokens(decoded) == tokens
+                ok = ok and same
+                print(f"[format]   post_stage={stage} stored={len(stored)} bytes "
+                      f"ratio_before={original_bytes / len(container):.1f} ratio_after={original_bytes / len(stored):.1f} "
+                      f"encode={enc * 1e3:.1f}ms decode={dec * 1e3:.1f}ms roundtrip={'OK' if same else 'DIFF'}")
+    return ok
+
+
+def synthetic_stream(num_samples, block_size, num_buffers, hit_ratio, seed=0):
+    """
+    Sinh encoded_stream hợp lệ (hit/miss/ghi đè FIFO) cho num_samples giá trị mà không
+    cần chạy compressor, dùng để đo giải nén trên stream rất dài
+    """
+    rng = np.random.default_rng(seed)
+    values = np.round(rng.normal(200, 50, num_samples), 2)
+    stream, buffers = [], 0
+    for i in range(0, num_samples, block_size):
+        if buffers and rng.random() < hit_ratio:
+            stream.append(int(rng.integers(buffers)))
+            continue
+        if buffers < num_buffers:
+            buffers += 1
+        else:
+            stream.extend([LosslessCompressor.BUFFER_OVERWRITE_MARKER, 0])
+        stream.extend([0xFD, values[i:i + block_size].copy()])
+    return stream
+
+
+def reference_decompress(encoded_stream, block_size, num_buffers, original_length):
+    """Cách giải nén cũ: isinstance từng token, list.extend, copy block (nhánh 0xFF đã sửa)"""
+    buffers, data, overwrite_idx, i = [], [], None, 0
+    while i < len(encoded_stream):
+        code = encoded_stream[i]
+        if isinstance(code, (int, np.integer)) and code == 0xFE:
+            i += 1
+            buffers = []
+        elif isinstance(code, (int, np.integer)) and code == 0xFF:
+            i += 1
+            overwrite_idx = encoded_stream[i]
+        elif isinstance(code, (int, np.integer)) and code == 0xFD:
+            i += 1
+            block = encoded_stream[i]
+            if isinstance(block, np.ndarray):
+                block = block.tolist()
+            if overwrite_idx is not None:
+                buffers[overwrite_idx], overwrite_idx = block.copy(), None
+            elif len(buffers) < num_buffers:
+                buffers.append(block.copy())
+            else:
+                buffers[0] = block.copy()
+            data.extend(block)
+        elif isinstance(code, (int, np.integer)) and code < num_buffers:
+            data.extend(buffers[code])
+        i += 1
+    return np.array(data[:original_length])
+
+
+def bench_decode(args):
+    ok = True
+    for samples in args.samples:
+        stream = synthetic_stream(samples, args.block_size, args.num_buffers, args.hit_ratio, args.seed)
+        ref, ref_time = timed(reference_decompress, stream, args.block_size, args.num_buffers, samples, repeat=1)
+        new, new_time = timed(decompress_idealem, stream, args.block_size, args.num_buffers, samples)
+        same = np.array_equal(ref, new)
+        ok = ok and same
+        print(f"[decode] samples={samples} tokens={len(stream)} hit_ratio={args.hit_ratio} "
+              f"list={ref_time:.2f}s preallocated={new_time:.2f}s speedup={ref_time / max(new_time, 1e-9):.1f}x "
+              f"output={'OK' if same else 'DIFF'}")
+    return ok
+
+
+def parse_json_payload(body):
+    """Client đọc response JSON về hai mảng timestamp (epoch ms) và giá trị"""
+    data = json.loads(body)['data']
+    timestamps = np.array([row['timestamp'] for row in data], dtype='datetime64[ms]').astype(np.int64)
+    values = np.array([row['value'] for row in data], dtype=float)
+    return timestamps, values
+
+
+def parse_npy_payload(body):
+    """Client đọc cặp .npy về hai mảng timestamp (epoch ms) và giá trị"""
+    stream = io.BytesIO(body)
+    return np.load(stream), np.load(stream)
+
+
+def parse_arrow_payload(body):
+    """Client đọc Arrow IPC stream về hai mảng timestamp (epoch ms) và giá trị"""
+    import pyarrow as pa
+    table = pa.ipc.open_stream(body).read_all()
+    return (table.column('timestamp').to_numpy().astype('datetime64[ms]').astype(np.int64),
+            table.column('value').to_numpy())
+
+
+def bench_export(args):
+    ok = True
+    for days in args.days:
+        data, timestamps = load_gentwo_series(days, args.seed)
+        result = LosslessCompressor().compress(data)
+        # Bản ghi giống _record_from_row của admin_action.save_data, không qua database
+        record = {
+            'id': 0,
+            'metadata': {'num_buffers': result['num_buffers'], 'original_length': len(data)},
+            'encoded_stream': load_encoded_stream(encode_stream(result['encoded_stream'])),
+            'seek_index': result['seek_index'],
+            'timestamps': decode_timestamps(encode_timestamps(timestamps)),
+            'time_range': None
+        }
+        # IDEALEM là nén mất mát: mọi định dạng phải cho đúng đầu ra của decompress_idealem
+        values = decompress_idealem(record['encoded_stream'], result['block_size'], result['num_buffers'], len(data))
+        expected = (np.array(timestamps, dtype='datetime64[ms]').astype(np.int64), values)
+        payloads = {
+            'json': lambda: ''.join(serialize_rows(iter_rows([record]), 'json', 'bench')).encode('utf-8'),
+            'npy': lambda: b''.join(npy_chunks(*columnar_arrays([record])))
+        }
+        parsers = {'json': parse_json_payload, 'npy': parse_npy_payload}
+        if ARROW_AVAILABLE:
+            payloads['arrow'] = lambda: b''.join(arrow_chunks(*columnar_arrays([record])))
+            parsers['arrow'] = parse_arrow_payload
+        json_size = None
+        for fmt, build in payloads.items():
+            body, server = timed(build)
+            parsed, client = timed(parsers[fmt], body)
+            same = all(np.array_equal(a, b) for a, b in zip(parsed, expected))
+            ok = ok and same
+            json_size = json_size or len(body)
+            print(f"[export] days={days} samples={len(data)} format={fmt} payload={len(body)} bytes "
+                  f"({json_size / len(body):.1f}x nhỏ hơn JSON) server={server * 1e3:.1f}ms "
+                  f"client={client * 1e3:.1f}ms output={'OK' if same else 'DIFF'}")
+        if not ARROW_AVAILABLE:
+            print(f"[export] days={days} format=arrow bỏ qua (chưa cài pyarrow)")
+    return ok
+
+
+def bench_batch(args):
+    config = {'sampling_interval': args.sampling_interval}
+    series = {seed: load_gentwo_series(args.days, seed)[0] for seed in range(args.seed, args.seed + args.devices)}
+    start = time.perf_counter()
+    single = {key: LosslessCompressor(config).compress(data) for key, data in series.items()}
+    single_time = time.perf_counter() - start
+    batch = BatchCompressor(config)
+    start = time.perf_counter()
+    batched = batch.compress(series)
+    batch_time = time.perf_counter() - start
+    same = all(stream_tokens(single[key]['encoded_stream']) == stream_tokens(batched[key]['encoded_stream'])
+               and single[key]['seek_index'] == batched[key]['seek_index'] for key in series)
+
+    def encoding(results):
+        return sum(r['timings']['encoding_seconds'] for r in results.values())
+
+    print(f"[batch] devices={args.devices} days={args.days} sampling_interval={args.sampling_interval} "
+          f"single={single_time:.2f}s (encoding {encoding(single):.2f}s) "
+          f"batch={batch_time:.2f}s (encoding {encoding(batched):.2f}s) "
+          f"encoding speedup={encoding(single) / max(encoding(batched), 1e-9):.1f}x "
+          f"steps={batch.stats['steps']} batched_blocks={batch.stats['batched_blocks']} "
+          f"single_blocks={batch.stats['single_blocks']} stream={'OK' if same else 'DIFF'}")
+    return same
+
+
+def bench_policy(args):
+    ok = True
+    for days in args.days:
+        data, _ = load_gentwo_series(days, args.seed)
+        baseline = None
+        for policy in args.policies:
+            result, elapsed = timed_compress(data, {'replacement_policy': policy, 'num_buffers': args.num_buffers})
+            container = encode_stream(result['encoded_stream'])
+            baseline = baseline or len(container)
+            overwrites = sum(1 for token in result['encoded_stream']
+                             if isinstance(token, (int, np.integer)) and token == LosslessCompressor.BUFFER_OVERWRITE_MARKER)
+            # Decoder chỉ đọc chỉ số ghi đè trong stream: giải từ điểm seek phải trùng giải toàn bộ
+            values = decompress_idealem(container, result['block_size'], result['num_buffers'], len(data))
+            start, end = len(data) // 2, len(data) // 2 + 1000
+            part = decompress_samples(load_encoded_stream(container), result['num_buffers'], result['seek_index'],
+                                      start, end, len(data))
+            same = len(values) == len(data) and np.array_equal(part, values[start:end])
+            ok = ok and same
+            print(f"[policy] days={days} samples={len(data)} policy={policy} hit_ratio={result['hit_ratio']:.4f} "
+                  f"overwrites={overwrites} binary={len(container)} bytes ({baseline / len(container):.2f}x so với "
+                  f"{args.policies[0]}) ratio={len(data) * 8 / len(container):.1f} time={elapsed:.2f}s "
+                  f"seek={'OK' if same else 'DIFF'}")
+    return ok
+
+
+def bench_probe(args):
+    ok = True
+    for days in args.days:
+        data, _ = load_gentwo_series(days, args.seed)
+        for order in args.orders:
+            result, _ = timed_compress(data, {'probe_order': order, 'num_buffers': args.num_buffers})
+            timings = result['timings']
+            container = encode_stream(result['encoded_stream'])
+            # Thứ tự thử chỉ đổi buffer được chọn khi nhiều buffer cùng khớp: stream vẫn giải nén đủ độ dài
+            values = decompress_idealem(container, result['block_size'], result['num_buffers'], len(data))
+            same = len(values) == len(data)
+            ok = ok and same
+            print(f"[probe] days={days} samples={len(data)} order={order} avg_probes={timings['avg_probes']:.2f} "
+                  f"ks_tests={timings['ks_tests']} lookups={timings['lookups']} hit_ratio={result['hit_ratio']:.4f} "
+                  f"binary={len(container)} bytes encoding={timings['encoding_seconds']:.3f}s "
+                  f"decode={'OK' if same else 'DIFF'}")
+    return ok
+
+
+def bench_prefilter(args):
+    ok = True
+    for days in args.days:
+        data, _ = load_gentwo_series(days, args.seed)
+        tokens = None
+        for points in args.points:
+            config = {'ks_prefilter_points': points, 'ks_vectorized': not args.reference,
+                      'probe_order': args.probe_order}
+            result, _ = timed_compress(data, config)
+            timings = result['timings']
+            if tokens is None:
+                tokens = stream_tokens(result['encoded_stream'])
+            # Bộ lọc chỉ loại buffer chắc chắn không khớp: stream phải giống hệt khi tắt lọc
+            same = stream_tokens(result['encoded_stream']) == tokens
+            ok = ok and same
+            avoided = timings['prefilter_minmax'] + timings['prefilter_quantile']
+            print(f"[prefilter] days={days} samples={len(data)} points={points} ks_tests={timings['ks_tests']} "
+                  f"ks_exact={timings['ks_exact']} avoided={avoided} ({avoided / max(1, timings['ks_tests']):.0%}: "
+                  f"minmax={timings['prefilter_minmax']} quantile={timings['prefilter_quantile']}) "
+                  f"encoding={timings['encoding_seconds']:.3f}s stream={'OK' if same else 'DIFF'}")
+    return ok
+
+
+def ks_samples(n, rng):
+    """Các cặp mẫu cùng kích thước n: liên tục, có giá trị trùng, giống hệt, lệch hẳn nhau"""
+    a, b = rng.normal(size=n), rng.normal(size=n) * rng.uniform(0.5, 2) + rng.uniform(-1, 1)
+    yield a, b
+    yield np.round(a * 2) / 2, np.round(b * 2) / 2
+    yield a, a.copy()
+    yield a, a + 10
+    yield znormalize(rng.exponential(size=n)), znormalize(rng.normal(size=n))
+
+
+def bench_kstest(args):
+    defaults = LosslessCompressor().config
+    min_n = args.min_n or defaults['min_block_size']
+    max_n = args.max_n or defaults['max_block_size']
+    rng = np.random.default_rng(args.seed)
+    start = time.perf_counter()
+    precompute_pvalue_tables(min_n, max_n)
+    warm = time.perf_counter() - start
+    pairs = [pair for n in range(min_n, max_n + 1) for _ in range(args.trials) for pair in ks_samples(n, rng)]
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        start = time.perf_counter()
+        expected = [stats.ks_2samp(a, b) for a, b in pairs]
+        scipy_time = time.perf_counter() - start
+    start = time.perf_counter()
+    actual = [ks_2samp_equal(a, b) for a, b in pairs]
+    kernel_time = time.perf_counter() - start
+    mismatches = sum(1 for e, (statistic, pvalue) in zip(expected, actual)
+                     if statistic != e.statistic or pvalue != e.pvalue)
+    print(f"[kstest] n={min_n}..{max_n} pairs={len(pairs)} table_warmup={warm:.2f}s "
+          f"ks_2samp={scipy_time / len(pairs) * 1e6:.1f}us/cặp kernel={kernel_time / len(pairs) * 1e6:.1f}us/cặp "
+          f"speedup={scipy_time / max(kernel_time, 1e-9):.1f}x statistic/pvalue={'OK' if not mismatches else f'{mismatches} DIFF'}")
+    return mismatches == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark nén IDEALEM trên dữ liệu gentwo')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+    matching = subparsers.add_parser('matching', help='So khớp KS: tham chiếu vs vector hóa')
+    matching.add_argument('--days', type=int, nargs='+', default=[7], help='Số ngày dữ liệu cho mỗi lần chạy')
+    matching.add_argument('--seed', type=int, default=0, help='Seed sinh dữ liệu')
+    matching.set_defaults(func=bench_matching)
+    sampling = subparsers.add_parser('sampling', help='Thời gian sampling vs encoding')
+    sampling.add_argument('--days', type=int, nargs='+', default=[30], help='Số ngày dữ liệu cho mỗi lần chạy')
+    sampling.add_argument('--seed', type=int, default=0, help='Seed sinh dữ liệu')
+    sampling.add_argument('--workers', type=int, nargs='+', default=[1, 4], help='Các giá trị sampling_workers cần đo')
+    sampling.add_argument('--executor', choices=['thread', 'process'], default='thread', help='Kiểu worker')
+    sampling.add_argument('--recent-size', type=int, default=1000, help='sampling_recent_size (kích thước cửa sổ)')
+    sampling.set_defaults(func=bench_sampling)
+    window = subparsers.add_parser('window', help='Cửa sổ sampling: list vs RingBuffer')
+    window.add_argument('--samples', type=int, default=1_000_000, help='Độ dài chuỗi')
+    window.add_argument('--block-size', type=int, default=24, help='Kích thước block')
+    window.add_argument('--recent-size', type=int, default=1000, help='sampling_recent_size')
+    window.add_argument('--interval', type=int, default=10, help='sampling_interval')
+    window.add_argument('--seed', type=int, default=0, help='Seed sinh dữ liệu')
+    window.set_defaults(func=bench_window)
+    fmt = subparsers.add_parser('format', help='Kích thước encoded_stream: JSON vs nhị phân')
+    fmt.add_argument('--days', type=int, nargs='+', default=[30], help='Số ngày dữ liệu cho mỗi lần chạy')
+    fmt.add_argument('--seed', type=int, default=0, help='Seed sinh dữ liệu')
+    fmt.add_argument('--codecs', nargs='+', default=['auto', 'float64', 'float32'],
+                     choices=['auto', 'float64', 'float32', 'int16', 'int32'], help='Codec giá trị cần đo')
+    fmt.add_argument('--block-encodings', nargs='+', default=['float', 'varint'], choices=['float', 'varint'],
+                     help='block_encoding của compressor cần đo')
+    fmt.add_argument('--post-stages', nargs='+', default=['none', 'zlib', 'lzma', 'range'],
+                     choices=['none', 'zlib', 'lzma', 'range'], help='Tầng nén thứ cấp cần đo')
+    fmt.set_defaults(func=bench_format)
+    decode = subparsers.add_parser('decode', help='Giải nén: list cũ vs cấp phát trước')
+    decode.add_argument('--samples', type=int, nargs='+', default=[2_000_000, 5_000_000], help='Độ dài chuỗi')
+    decode.add_argument('--block-size', type=int, default=24, help='Kích thước block')
+    decode.add_argument('--num-buffers', type=int, default=16, help='Số buffer')
+    decode.add_argument('--hit-ratio', type=float, default=0.85, help='Tỷ lệ hit của stream tổng hợp')
+    decode.add_argument('--seed', type=int, default=0, help='Seed sinh dữ liệu')
+    decode.set_defaults(func=bench_decode)
+    export = subparsers.add_parser('export', help='Response giải nén: JSON vs dạng cột nhị phân')
+    export.add_argument('--days', type=int, nargs='+', default=[30, 365], help='Số ngày dữ liệu cho mỗi lần chạy')
+    export.add_argument('--seed', type=int, default=0, help='Seed sinh dữ liệu')
+    export.set_defaults(func=bench_export)
+    batch = subparsers.add_parser('batch', help='Nhiều device: nén từng device vs BatchCompressor')
+    batch.add_argument('--devices', type=int, default=32, help='Số device (mỗi device một seed)')
+    batch.add_argument('--days', type=int, default=14, help='Số ngày dữ liệu mỗi device')
+    batch.add_argument('--seed', type=int, default=0, help='Seed của device đầu tiên')
+    batch.add_argument('--sampling-interval', type=int, default=10, help='sampling_interval (lớn = gần như tắt sampling)')
+    batch.set_defaults(func=bench_batch)
+    policy = subparsers.add_parser('policy', help='Chính sách thay thế buffer: hit ratio và kích thước stream')
+    policy.add_argument('--days', type=int, nargs='+', default=[30, 90], help='Số ngày dữ liệu cho mỗi lần chạy')
+    policy.add_argument('--seed', type=int, default=0, help='Seed sinh dữ liệu')
+    policy.add_argument('--num-buffers', type=int, default=16, help='Số buffer')
+    policy.add_argument('--policies', nargs='+', default=list(REPLACEMENT_POLICIES), choices=list(REPLACEMENT_POLICIES),
+                        help='Các chính sách cần đo (chính sách đầu tiên làm mốc)')
+    policy.set_defaults(func=bench_policy)
+    probe = subparsers.add_parser('probe', help='Thứ tự thử buffer: số phép KS trung bình mỗi block')
+    probe.add_argument('--days', type=int, nargs='+', default=[30, 90], help='Số ngày dữ liệu cho mỗi lần chạy')
+    probe.add_argument('--seed', type=int, default=0, help='Seed sinh dữ liệu')
+    probe.add_argument('--num-buffers', type=int, default=16, help='Số buffer')
+    probe.add_argument('--orders', nargs='+', default=list(BufferPool.PROBE_ORDERS), choices=list(BufferPool.PROBE_ORDERS),
+                       help='Các thứ tự thử cần đo')
+    probe.set_defaults(func=bench_probe)
+    prefilter = subparsers.add_parser('prefilter', help='Bộ lọc cận dưới trước KS: số phép KS tránh được')
+    prefilter.add_argument('--days', type=int, nargs='+', default=[30, 90], help='Số ngày dữ liệu cho mỗi lần chạy')
+    prefilter.add_argument('--seed', type=int, default=0, help='Seed sinh dữ liệu')
+    prefilter.add_argument('--points', type=int, nargs='+', default=[0, 2, 5, 9],
+                           help='Các giá trị ks_prefilter_points (giá trị đầu làm mốc so sánh stream)')
+    prefilter.add_argument('--probe-order', choices=list(BufferPool.PROBE_ORDERS), default='index', help='probe_order')
+    prefilter.add_argument('--reference', action='store_true', help='Đo trên đường ks_2samp từng cặp (ks_vectorized=False)')
+    prefilter.set_defaults(func=bench_prefilter)
+    kstest = subparsers.add_parser('kstest', help='Kernel KS cùng kích thước so với stats.ks_2samp')
+    kstest.add_argument('--min-n', type=int, default=None, help='Block size nhỏ nhất (mặc định min_block_size)')
+    kstest.add_argument('--max-n', type=int, default=None, help='Block size lớn nhất (mặc định max_block_size)')
+    kstest.add_argument('--trials', type=int, default=20, help='Số lần sinh mẫu cho mỗi block size')
+    kstest.add_argument('--seed', type=int, default=0, help='Seed sinh dữ liệu')
+    kstest.set_defaults(func=bench_kstest)
+    args = parser.parse_args()
+
+    # Tắt log INFO/DEBUG của compressor để không ảnh hưởng thời gian đo
+    logging.disable(logging.INFO)
+    if not args.func(args):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dịch vụ nén chạy trong tiến trình API (thay cho việc gọi subprocess loss_compress.py).
+
+Mỗi yêu cầu nén trở thành một job trong worker pool: API trả job id ngay, trạng thái
+và chỉ số nén đọc qua /admin/jobs/{id}. Với pool 'thread', job dùng lại engine của ứng
+dụng; với pool 'process', mỗi tiến trình worker tạo một engine riêng một lần khi khởi
+động (engine không chuyển qua được ranh giới tiến trình). Pool 'process' tránh việc
+phần so khớp KS giữ GIL làm chậm các request khác, đổi lại tốn bộ nhớ cho mỗi worker.
+
+Job nén hàng loạt (submit_bulk) chạy loss_compress.run_bulk_compression trong một thread
+điều phối riêng; thread này tạo process pool cho các device và ghi tiến độ từng device
+vào job để /admin/jobs/{id} đọc được trong lúc chạy.
+"""
+
+import uuid
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import create_engine
+
+logger = logging.getLogger(__name__)
+
+MAX_FINISHED_JOBS = 1000  # Số job đã xong giữ lại để tra cứu, job cũ hơn bị bỏ
+
+_worker_engine = None  # Engine của tiến trình worker (pool 'process')
+
+
+def _init_process_worker(database_url):
+    """
+    Khởi tạo tiến trình worker: tạo engine, kiểm tra schema và bảng p-value KS một lần
+    cho mọi job của tiến trình
+    """
+    global _worker_engine
+    _worker_engine = create_engine(database_url, pool_pre_ping=True)
+    from loss_compress import ensure_optimized_schema
+    ensure_optimized_schema(_worker_engine)
+    from lossless_compression import LosslessCompressor
+    LosslessCompressor().warm_pvalue_tables()
+
+
+def run_bulk_compression_job(device_ids, parallel, retries, segment, options, db_url, progress):
+    """Nén hàng loạt device (chạy trong thread điều phối), trả về tổng hợp của run_bulk_compression"""
+    from loss_compress import run_bulk_compression
+    summary = run_bulk_compression(device_ids, parallel=parallel, retries=retries, segment=segment,
+                                   progress=progress, db_url=db_url, **(options or {}))
+    # Trạng thái từng device đã có trong progress của job
+    return {k: v for k, v in summary.items() if k != 'device_states'}
+
+
+def run_compression_job(device_id, segment=None, options=None, engine=None):
+    """
+    Nén dữ liệu của device (chạy trong worker)
+
+    Args:
+        device_id: ID thiết bị
+        segment: 'hour', 'day', 'week' hoặc None (nén toàn bộ thành một bản ghi)
+        options: Tham số thêm cho loss_compress.run_compression (stream_format, block_encoding, post_stage, replacement_policy)
+        engine: Engine dùng lại (đã qua ensure_optimized_schema), mặc định engine của tiến trình worker
+
+    Returns:
+        Dict chỉ số nén của các bản ghi vừa lưu
+    """
+    # Import khi chạy job đầu tiên để API khởi động không phải nạp pandas/scipy
+    from loss_compress import run_compression, get_compression_metrics
+    engine = engine or _worker_engine
+    result = run_compression(device_id=device_id, segment=segment, engine=engine, **(options or {}))
+    compression_ids = result if isinstance(result, list) else [result]
+    return {
+        'compression_ids': compression_ids,
+        'records': get_compression_metrics(engine, compression_ids)
+    }
+
+
+class CompressionJobService:
+    """Hàng đợi job nén trong tiến trình, chạy trên ThreadPoolExecutor hoặc ProcessPoolExecutor"""
+
+    def __init__(self, engine, workers: int = 1, executor: str = 'thread'):
+        """
+        Args:
+            engine: Engine của ứng dụng (pool 'thread' dùng lại, pool 'process' lấy URL)
+            workers: Số worker của pool
+            executor: 'thread' hoặc 'process'
+        """
+        if executor not in ('thread', 'process'):
+            raise ValueError(f"Executor không hợp lệ: {executor}")
+        self.engine = engine
+        self.workers = max(1, workers)
+        self.executor_kind = executor
+        self._executor = None
+        self._bulk_executor = None
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Tạo pool khi có job đầu tiên, không tạo tiến trình/thread lúc import
+        if self._executor is None:
+            if self.executor_kind == 'process':
+                url = self.engine.url.render_as_string(hide_password=False)
+                # 'spawn': fork tiến trình API nhiều thread có thể sao chép lock đang bị giữ
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                                     initializer=_init_process_worker, initargs=(url,))
+            else:
+                # Kiểm tra schema một lần cho cả pool, không phải mỗi job (ALTER TABLE giữ lock
+                # ACCESS EXCLUSIVE, các job chạy đồng thời sẽ xếp hàng chờ nhau)
+                from loss_compress import ensure_optimized_schema
+                ensure_optimized_schema(self.engine)
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='compression')
+        return self._executor
+
+    def submit(self, device_id, segment=None, **options) -> str:
+        """
+        Đưa một job nén vào hàng đợi
+
+        Returns:
+            job_id
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            'job_id': job_id,
+            'device_id': device_id,
+            'segment': segment,
+            'submitted_at': datetime.now(),
+            'finished_at': None
+        }
+        with self._lock:
+            if self.executor_kind == 'process':
+                future = self._get_executor().submit(run_compression_job, device_id, segment, options)
+            else:
+                future = self._get_executor().submit(run_compression_job, device_id, segment, options, self.engine)
+            job['future'] = future
+            self._jobs[job_id] = job
+            self._evict()
+        future.add_done_callback(lambda _: self._finish(job))
+        logger.info(f"[JOBS] Submitted compression job {job_id} for device_id={device_id}")
+        return job_id
+
+    def submit_bulk(self, device_ids=None, parallel: int = 1, retries: int = 1, segment=None, **options) -> str:
+        """
+        Đưa một job nén hàng loạt vào hàng đợi (mỗi lúc chạy một job hàng loạt)
+
+        Args:
+            device_ids: Danh sách device, None = mọi device có dữ liệu
+            parallel: Số tiến trình worker nén device
+            retries: Số lần thử lại mỗi device khi lỗi
+
+        Returns:
+            job_id
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            'job_id': job_id,
+            'kind': 'bulk',
+            'device_ids': device_ids,
+            'segment': segment,
+            'submitted_at': datetime.now(),
+            'finished_at': None,
+            'progress': {}
+        }
+
+        def progress(device_id, state):
+            # Gọi từ thread điều phối, get() đọc cùng dict từ thread của request
+            with self._lock:
+                job['progress'][device_id] = state
+
+        url = self.engine.url.render_as_string(hide_password=False)
+        with self._lock:
+            if self._bulk_executor is None:
+                self._bulk_executor = ThreadPoolExecutor(1, thread_name_prefix='bulk-compression')
+            future = self._bulk_executor.submit(run_bulk_compression_job, device_ids, parallel, retries,
+                                                segment, options, url, progress)
+            job['future'] = future
+            self._jobs[job_id] = job
+            self._evict()
+        future.add_done_callback(lambda _: self._finish(job))
+        logger.info(f"[JOBS] Submitted bulk compression job {job_id} (parallel={parallel})")
+        return job_id
+
+    def _finish(self, job):
+        with self._lock:
+            job['finished_at'] = datetime.now()
+        if job['future'].cancelled():
+            logger.info(f"[JOBS] Job {job['job_id']} cancelled")
+            return
+        error = job['future'].exception()
+        if error:
+            logger.error(f"[JOBS] Job {job['job_id']} failed: {error}")
+        else:
+            logger.info(f"[JOBS] Job {job['job_id']} completed")
+
+    def _evict(self):
+        """Bỏ các job đã xong cũ nhất khi vượt MAX_FINISHED_JOBS"""
+        finished = [job_id for job_id, job in self._jobs.items() if job['future'].done()]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        """
+        Trạng thái của job
+
+        Returns:
+            Dict (status: pending/running/succeeded/failed, result khi xong), None nếu không có job
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            # Copy dưới lock: progress/finished_at được ghi từ thread khác trong lúc job chạy
+            info = {k: v for k, v in job.items() if k != 'future'}
+            if 'progress' in info:
+                info['progress'] = dict(info['progress'])
+        future = job['future']
+        if not future.done():
+            info['status'] = 'running' if future.running() else 'pending'
+        elif future.cancelled():
+            info['status'] = 'cancelled'
+        elif future.exception() is not None:
+            info['status'] = 'failed'
+            info['error'] = str(future.exception())
+        else:
+            info['status'] = 'succeeded'
+            info['result'] = future.result()
+        if info['finished_at']:
+            info['duration_seconds'] = (info['finished_at'] - info['submitted_at']).total_seconds()
+        return info
+
+    def shutdown(self, wait: bool = False):
+        """Dừng pool (job đang chạy vẫn chạy xong nếu wait=True)"""
+        for name in ('_executor', '_bulk_executor'):
+            executor = getattr(self, name)
+            if executor is not None:
+                executor.shutdown(wait=wait, cancel_futures=not wait)
+                setattr(self, name, None)
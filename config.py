@@ -39,6 +39,10 @@ class Settings(BaseSettings):
     ADAFRUIT_IO_USERNAME: str = ""
     ADAFRUIT_IO_KEY: str = ""
 
+    # Worker pool của job nén trong tiến trình (compression_jobs.py): 'thread' hoặc 'process'
+    COMPRESSION_WORKERS: int = 1
+    COMPRESSION_EXECUTOR: str = "thread"
+
     class Config:
         env_file = ".env"
         env_file_encoding = 'utf-8'
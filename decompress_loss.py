@@ -15,6 +15,10 @@ import argparse
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
+from stream_codec import load_encoded_stream, decode_timestamps
+from idealem_decoder import decompress_idealem
+from admin_action.save_data import get_compression_segments, latest_compression_mode, decode_record, format_timestamps
+
 # Cấu hình logging
 logging.basicConfig(
     level=logging.DEBUG,
@@ -46,7 +50,7 @@ def setup_database():
 
 def get_latest_compression_by_device(engine, device_id):
     query = """
-    SELECT id, device_id, compression_metadata, encoded_stream, time_range
+    SELECT id, device_id, compression_metadata, encoded_stream, time_range, encoded_stream_bin, timestamp_channel
     FROM compressed_data_optimized
     WHERE device_id = :device_id
     ORDER BY id DESC
@@ -63,62 +67,17 @@ def get_latest_compression_by_device(engine, device_id):
         time_range = row[4]
         if isinstance(metadata, str):
             metadata = json.loads(metadata)
-        if isinstance(encoded_stream, str):
-            encoded_stream = json.loads(encoded_stream)
+        # Bản ghi mới lưu container nhị phân, bản ghi cũ chỉ có JSONB
+        encoded_stream = load_encoded_stream(row[5] if row[5] is not None else encoded_stream)
         return {
             'id': row[0],
             'device_id': row[1],
             'metadata': metadata,
             'encoded_stream': encoded_stream,
+            'timestamps': decode_timestamps(row[6]) if row[6] is not None else None,
             'time_range': time_range
         }
 
-def decompress_idealem(encoded_stream, block_size, num_buffers, original_length):
-    buffers = []
-    data = []
-    i = 0
-    while i < len(encoded_stream):
-        code = encoded_stream[i]
-        if isinstance(code, (int, np.integer)) and code == 0xFE:
-            i += 1
-            block_size = encoded_stream[i]
-            buffers = []
-        elif isinstance(code, (int, np.integer)) and code == 0xFF:
-            i += 1
-            overwrite_idx = encoded_stream[i]
-            i += 1
-            block = encoded_stream[i]
-            if isinstance(block, np.ndarray):
-                block = block.tolist()
-            while len(buffers) <= overwrite_idx:
-                buffers.append([0]*block_size)
-            buffers[overwrite_idx] = block.copy() if isinstance(block, list) else [block]
-            if isinstance(block, list):
-                data.extend(block)
-            else:
-                data.append(block)
-        elif isinstance(code, (int, np.integer)) and code == 0xFD:
-            i += 1
-            block = encoded_stream[i]
-            if isinstance(block, np.ndarray):
-                block = block.tolist()
-            if len(buffers) < num_buffers:
-                buffers.append(block.copy() if isinstance(block, list) else [block])
-            else:
-                buffers[0] = block.copy() if isinstance(block, list) else [block]
-            if isinstance(block, list):
-                data.extend(block)
-            else:
-                data.append(block)
-        elif isinstance(code, (int, np.integer)) and code < num_buffers:
-            block = buffers[code]
-            if isinstance(block, list):
-                data.extend(block)
-            else:
-                data.append(block)
-        i += 1
-    return np.array(data[:original_length])
-
 def generate_timestamps(start_time, end_time, n):
     start = datetime.fromisoformat(start_time)
     end = datetime.fromisoformat(end_time)
@@ -169,6 +128,22 @@ def main():
     args = parser.parse_args()
 
     engine = setup_database()
+    output_file = f"{args.device_id}.json"
+    if latest_compression_mode(engine, args.device_id) == 'segment':
+        # Bản ghi mới nhất là segment (loss_compress --segment): nối các cửa sổ theo thời gian
+        segments = get_compression_segments(engine, args.device_id)
+        data_with_time = []
+        for segment in segments:
+            data, error = decode_record(segment)
+            if error:
+                logger.error(error)
+                return
+            data_with_time.extend(data)
+        logger.info(f"Giải nén {len(segments)} segment")
+        save_decompressed_data(data_with_time, output_file)
+        logger.info(f"Giải nén hoàn tất! Đã lưu vào {output_file}")
+        return
+
     record = get_latest_compression_by_device(engine, args.device_id)
     if not record:
         logger.error("Không tìm thấy bản ghi nén phù hợp")
@@ -197,9 +172,12 @@ def main():
         logger.error(f"Không xác định được time_range: {time_range}")
         return
 
-    timestamps = generate_timestamps(start_time, end_time, len(decompressed_values))
+    if record['timestamps'] is not None:
+        # Timestamp thật lưu trong kênh timestamp của bản ghi
+        timestamps = format_timestamps(record['timestamps'][:len(decompressed_values)])
+    else:
+        timestamps = generate_timestamps(start_time, end_time, len(decompressed_values))
     data_with_time = combine_value_and_time(decompressed_values, timestamps)
-    output_file = f"{args.device_id}.json"
     save_decompressed_data(data_with_time, output_file)
     logger.info(f"Giải nén hoàn tất! Đã lưu vào {output_file}")
 
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Range coder thích nghi (carryless, kiểu Subbotin 32-bit) cho các ký hiệu byte.
+
+Dùng làm tầng nén thứ cấp cho mảng token của encoded_stream: chỉ số buffer lặp lại
+theo mẫu ngày thường/cuối tuần nên mô hình bậc 1 (ngữ cảnh = ký hiệu trước đó) với
+tần suất cập nhật thích nghi nén tốt hơn nhiều so với mã hóa cố định 1 byte/token.
+Tần suất của mỗi ngữ cảnh lưu trong cây Fenwick để tra cứu/cập nhật O(log 256).
+"""
+
+_MASK = 0xFFFFFFFF
+_TOP = 1 << 24
+_BOT = 1 << 16
+
+ALPHABET_SIZE = 256
+_INCREMENT = 24
+_MAX_TOTAL = _BOT  # Tổng tần suất phải <= BOT để range // total không về 0
+
+
+class _AdaptiveModel:
+    """Tần suất thích nghi của 256 ký hiệu trong một ngữ cảnh (cây Fenwick)"""
+
+    def __init__(self):
+        self.freq = [1] * ALPHABET_SIZE
+        self.total = ALPHABET_SIZE
+        self._build()
+
+    def _build(self):
+        tree = [0] * (ALPHABET_SIZE + 1)
+        for i, f in enumerate(self.freq, 1):
+            tree[i] += f
+            parent = i + (i & -i)
+            if parent <= ALPHABET_SIZE:
+                tree[parent] += tree[i]
+        self.tree = tree
+
+    def cumulative(self, symbol: int) -> int:
+        """Tổng tần suất của các ký hiệu < symbol"""
+        total = 0
+        tree = self.tree
+        while symbol > 0:
+            total += tree[symbol]
+            symbol -= symbol & -symbol
+        return total
+
+    def find(self, target: int):
+        """Ký hiệu s có cumulative(s) <= target < cumulative(s + 1), trả về (s, cumulative(s))"""
+        pos, cum = 0, 0
+        tree = self.tree
+        step = 1 << (ALPHABET_SIZE.bit_length() - 1)
+        while step:
+            nxt = pos + step
+            if nxt <= ALPHABET_SIZE and cum + tree[nxt] <= target:
+                pos = nxt
+                cum += tree[nxt]
+            step >>= 1
+        return pos, cum
+
+    def update(self, symbol: int):
+        """Tăng tần suất của symbol, chia đôi toàn bộ khi tổng vượt giới hạn"""
+        self.freq[symbol] += _INCREMENT
+        self.total += _INCREMENT
+        if self.total > _MAX_TOTAL:
+            self.freq = [(f + 1) // 2 for f in self.freq]
+            self.total = sum(self.freq)
+            self._build()
+            return
+        i = symbol + 1
+        tree = self.tree
+        while i <= ALPHABET_SIZE:
+            tree[i] += _INCREMENT
+            i += i & -i
+
+
+def range_encode(symbols) -> bytes:
+    """
+    Nén dãy byte bằng range coder thích nghi bậc 1
+
+    Args:
+        symbols: bytes/bytearray (hoặc iterable số nguyên 0..255)
+
+    Returns:
+        bytes đã nén (số ký hiệu không được lưu, cần truyền lại khi giải nén)
+    """
+    models = [None] * ALPHABET_SIZE  # Mô hình của mỗi ngữ cảnh tạo khi gặp lần đầu
+    out = bytearray()
+    low, rng = 0, _MASK
+    context = 0
+    for symbol in bytes(symbols):
+        model = models[context]
+        if model is None:
+            model = models[context] = _AdaptiveModel()
+        cum = model.cumulative(symbol)
+        r = rng // model.total
+        low = (low + cum * r) & _MASK
+        rng = r * model.freq[symbol]
+        while True:
+            if (low ^ ((low + rng) & _MASK)) >= _TOP:
+                if rng >= _BOT:
+                    break
+                rng = (-low) & (_BOT - 1)
+            out.append(low >> 24)
+            low = (low << 8) & _MASK
+            rng = (rng << 8) & _MASK
+        model.update(symbol)
+        context = symbol
+    for _ in range(4):
+        out.append(low >> 24)
+        low = (low << 8) & _MASK
+    return bytes(out)
+
+
+def range_decode(data, count: int) -> bytes:
+    """
+    Giải nén dữ liệu của range_encode
+
+    Args:
+        data: bytes đã nén
+        count: Số ký hiệu cần giải
+
+    Returns:
+        bytes gốc
+    """
+    data = bytes(data)
+    models = [None] * ALPHABET_SIZE  # Mô hình của mỗi ngữ cảnh tạo khi gặp lần đầu
+    out = bytearray()
+    pos = 4
+    code = int.from_bytes(data[:4].ljust(4, b'\0'), 'big')
+    low, rng = 0, _MASK
+    context = 0
+    for _ in range(count):
+        model = models[context]
+        if model is None:
+            model = models[context] = _AdaptiveModel()
+        r = rng // model.total
+        target = min(model.total - 1, ((code - low) & _MASK) // r)
+        symbol, cum = model.find(target)
+        low = (low + cum * r) & _MASK
+        rng = r * model.freq[symbol]
+        while True:
+            if (low ^ ((low + rng) & _MASK)) >= _TOP:
+                if rng >= _BOT:
+                    break
+                rng = (-low) & (_BOT - 1)
+            code = ((code << 8) | (data[pos] if pos < len(data) else 0)) & _MASK
+            pos += 1
+            low = (low << 8) & _MASK
+            rng = (rng << 8) & _MASK
+        model.update(symbol)
+        out.append(symbol)
+        context = symbol
+    return bytes(out)
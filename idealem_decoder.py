@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Giải nén encoded_stream của IDEALEM (dùng chung cho decompress_loss.py và API admin).
+
+Stream gồm các token:
+    idx                  : hit, phát lại block của buffer idx
+    0xFD, block          : miss, block thô được phát ra và đưa vào buffer
+    0xFF, idx, 0xFD, block : miss khi buffer đầy, block ghi đè buffer idx
+    0xFE, n              : đổi block size sang n, xóa toàn bộ buffer
+
+Giải nén làm hai bước: lượt đầu duyệt token, giữ tham chiếu tới block được phát ra
+(buffer chỉ trỏ tới block, không copy) và tính độ dài đầu ra; lượt sau cấp phát một
+mảng NumPy duy nhất rồi copy các block vào (np.concatenate ghi thẳng vào mảng đó,
+block cuối bị cắt theo original_length gán slice).
+
+Với seek index của compressor (mỗi điểm ghi vị trí token, vị trí mẫu và vị trí token
+của block trong từng buffer), decompress_samples chỉ giải các block phủ khoảng mẫu cần
+lấy: nạp buffer trực tiếp từ các block được trỏ tới rồi duyệt token từ điểm seek.
+iter_samples làm tương tự nhưng trả dần từng block (generator) để API có thể serialize
+và gửi kết quả theo luồng mà không giữ toàn bộ đầu ra trong bộ nhớ.
+"""
+
+import bisect
+from itertools import islice
+import numpy as np
+
+from stream_codec import (load_encoded_stream, is_packed_block, unpack_block,
+                          BLOCK_MARKER, BLOCKSIZE_CHANGE_MARKER, BUFFER_OVERWRITE_MARKER)
+
+
+def _as_block(block) -> np.ndarray:
+    """Block thô của stream (list, ndarray hoặc block đóng gói) dưới dạng mảng float64"""
+    if is_packed_block(block):
+        return unpack_block(block)
+    return np.asarray(block, dtype=float).ravel()
+
+
+def iter_emitted_blocks(encoded_stream, num_buffers, start_token=0, buffers=None):
+    """
+    Generator các block được phát ra theo thứ tự khi duyệt encoded_stream
+
+    Args:
+        encoded_stream: List token (hoặc bytes của container nhị phân)
+        num_buffers: Số buffer tối đa
+        start_token: Vị trí token bắt đầu (điểm seek), mặc định đầu stream
+        buffers: Nội dung buffer tại start_token (mặc định rỗng)
+
+    Yields:
+        Mảng float64 của từng block (các hit dùng chung mảng với block miss tương ứng)
+    """
+    if isinstance(encoded_stream, (bytes, bytearray, memoryview)):
+        # Container nhị phân (kể cả đã qua post stage zlib/lzma/range)
+        encoded_stream = load_encoded_stream(encoded_stream)
+    buffers = list(buffers) if buffers else []
+    overwrite_idx = None
+    tokens = islice(encoded_stream, start_token, None) if start_token else iter(encoded_stream)
+    for code in tokens:
+        if code < BLOCK_MARKER:
+            # Hit (token phổ biến nhất nên kiểm tra trước)
+            if code >= len(buffers) or code < 0:
+                raise ValueError(f"Chỉ số buffer không hợp lệ: {code}")
+            yield buffers[code]
+        elif code == BLOCK_MARKER:
+            block = _as_block(next(tokens))
+            if overwrite_idx is not None:
+                while len(buffers) <= overwrite_idx:
+                    buffers.append(block)
+                buffers[overwrite_idx] = block
+                overwrite_idx = None
+            elif len(buffers) < num_buffers:
+                buffers.append(block)
+            else:
+                buffers[0] = block
+            yield block
+        elif code == BUFFER_OVERWRITE_MARKER:
+            overwrite_idx = int(next(tokens))
+        elif code == BLOCKSIZE_CHANGE_MARKER:
+            next(tokens)  # Block size mới không cần cho giải nén, block tự mang độ dài
+            buffers = []
+            overwrite_idx = None
+        else:
+            raise ValueError(f"Token không hợp lệ: {code}")
+
+
+def emitted_blocks(encoded_stream, num_buffers, start_token=0, buffers=None, max_samples=None):
+    """
+    Duyệt encoded_stream, trả về các block được phát ra theo thứ tự
+
+    Args:
+        encoded_stream: List token (hoặc bytes của container nhị phân)
+        num_buffers: Số buffer tối đa
+        start_token: Vị trí token bắt đầu (điểm seek), mặc định đầu stream
+        buffers: Nội dung buffer tại start_token (mặc định rỗng)
+        max_samples: Dừng khi các block phát ra đủ số mẫu này
+
+    Returns:
+        List mảng float64 (các hit dùng chung mảng với block miss tương ứng)
+    """
+    blocks = iter_emitted_blocks(encoded_stream, num_buffers, start_token, buffers)
+    if max_samples is None:
+        return list(blocks)
+    pieces = []
+    emitted = 0
+    for block in blocks:
+        if emitted >= max_samples:
+            break
+        pieces.append(block)
+        emitted += len(block)
+    return pieces
+
+
+def _join_pieces(pieces, original_length=None) -> np.ndarray:
+    """Nối các block vào một mảng cấp phát trước, cắt về original_length"""
+    lengths = np.fromiter((len(p) for p in pieces), dtype=np.int64, count=len(pieces))
+    ends = np.cumsum(lengths)
+    total = int(ends[-1]) if len(ends) else 0
+    length = total if original_length is None else min(total, original_length)
+    out = np.empty(length, dtype=float)
+    if length == 0:
+        return out
+    # Các block nằm trọn trong đầu ra copy liền một lượt vào mảng đã cấp phát,
+    # block cuối (bị cắt bởi original_length) gán slice riêng
+    full = int(np.searchsorted(ends, length, side='right'))
+    filled = int(ends[full - 1]) if full else 0
+    if full:
+        np.concatenate(pieces[:full], out=out[:filled])
+    if filled < length:
+        out[filled:] = pieces[full][:length - filled]
+    return out
+
+
+def decompress_idealem(encoded_stream, block_size, num_buffers, original_length=None) -> np.ndarray:
+    """
+    Giải nén encoded_stream về chuỗi giá trị
+
+    Args:
+        encoded_stream: List token (hoặc bytes của container nhị phân)
+        block_size: Block size ban đầu (giữ cho tương thích, block tự mang độ dài)
+        num_buffers: Số buffer tối đa
+        original_length: Độ dài dữ liệu gốc (đầu ra bị cắt về độ dài này)
+
+    Returns:
+        Mảng float64 các giá trị đã giải nén
+    """
+    return _join_pieces(emitted_blocks(encoded_stream, num_buffers), original_length)
+
+
+def _seek(encoded_stream, seek_index, sample_start):
+    """(vị trí token, vị trí mẫu, nội dung buffer) của điểm seek gần nhất trước sample_start"""
+    if seek_index:
+        pos = bisect.bisect_right([entry['sample'] for entry in seek_index], sample_start) - 1
+        if pos >= 0:
+            entry = seek_index[pos]
+            buffers = [_as_block(encoded_stream[t]) for t in entry['buffers']]
+            return entry['token'], entry['sample'], buffers
+    return 0, 0, None
+
+
+def decompress_samples(encoded_stream, num_buffers, seek_index, sample_start, sample_end,
+                       original_length=None) -> np.ndarray:
+    """
+    Giải nén các mẫu [sample_start, sample_end) bắt đầu từ điểm seek gần nhất
+
+    Args:
+        encoded_stream: List token (hoặc bytes của container nhị phân)
+        num_buffers: Số buffer tối đa
+        seek_index: List điểm seek (rỗng/None thì giải từ đầu stream)
+        sample_start: Vị trí mẫu đầu tiên cần lấy
+        sample_end: Vị trí sau mẫu cuối cùng cần lấy
+        original_length: Độ dài dữ liệu gốc (block cuối phát ra có thể dài hơn phần còn lại)
+
+    Returns:
+        Mảng float64 các giá trị trong khoảng (ngắn hơn nếu stream kết thúc sớm)
+    """
+    if isinstance(encoded_stream, (bytes, bytearray, memoryview)):
+        encoded_stream = load_encoded_stream(encoded_stream)
+    sample_start = max(0, sample_start)
+    if original_length is not None:
+        sample_end = min(sample_end, original_length)
+    if sample_end <= sample_start:
+        return np.empty(0, dtype=float)
+    start_token, base, buffers = _seek(encoded_stream, seek_index, sample_start)
+    pieces = emitted_blocks(encoded_stream, num_buffers, start_token, buffers, max_samples=sample_end - base)
+    return _join_pieces(pieces, sample_end - base)[sample_start - base:]
+
+
+def iter_samples(encoded_stream, num_buffers, seek_index=None, sample_start=0, sample_end=None,
+                 original_length=None):
+    """
+    Generator các đoạn mẫu trong [sample_start, sample_end), mỗi đoạn là một block đã cắt
+
+    Args:
+        encoded_stream: List token (hoặc bytes của container nhị phân)
+        num_buffers: Số buffer tối đa
+        seek_index: List điểm seek (rỗng/None thì giải từ đầu stream)
+        sample_start: Vị trí mẫu đầu tiên cần lấy
+        sample_end: Vị trí sau mẫu cuối cùng cần lấy (None = hết stream)
+        original_length: Độ dài dữ liệu gốc (block cuối phát ra có thể dài hơn phần còn lại)
+
+    Yields:
+        Mảng float64 (view vào block, không copy) theo thứ tự mẫu
+    """
+    if isinstance(encoded_stream, (bytes, bytearray, memoryview)):
+        encoded_stream = load_encoded_stream(encoded_stream)
+    sample_start = max(0, sample_start)
+    if original_length is not None:
+        sample_end = original_length if sample_end is None else min(sample_end, original_length)
+    if sample_end is not None and sample_end <= sample_start:
+        return
+    start_token, pos, buffers = _seek(encoded_stream, seek_index, sample_start)
+    for block in iter_emitted_blocks(encoded_stream, num_buffers, start_token, buffers):
+        end = pos + len(block)
+        if end > sample_start:
+            lo = max(sample_start - pos, 0)
+            hi = len(block) if sample_end is None else min(sample_end - pos, len(block))
+            yield block[lo:hi]
+        pos = end
+        if sample_end is not None and pos >= sample_end:
+            return
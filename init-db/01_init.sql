@@ -61,6 +61,9 @@ CREATE TABLE IF NOT EXISTS compressed_data_optimized (
     device_id VARCHAR(255) NOT NULL REFERENCES devices(device_id) ON DELETE CASCADE,
     compression_metadata JSONB,
     encoded_stream JSONB,
+    encoded_stream_bin BYTEA,
+    seek_index BYTEA,
+    timestamp_channel BYTEA,
     time_range TSRANGE
 );
 
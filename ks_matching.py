@@ -0,0 +1,749 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Engine so khớp KS theo lô cho thuật toán nén IDEALEM.
+
+Thay vì gọi scipy.stats.ks_2samp cho từng cặp (block, buffer), các buffer được
+lưu sẵn ở dạng đã sắp xếp trong một mảng NumPy 2 chiều. Thống kê KS của một
+block so với toàn bộ buffer được tính trong một lần gọi vector hóa, sau đó
+p-value được tra từ bảng tính sẵn (chính xác như ks_2samp với method='auto').
+"""
+
+import math
+import functools
+import warnings
+import numpy as np
+from scipy import stats
+
+
+def znormalize(data: np.ndarray) -> np.ndarray:
+    """
+    Chuẩn hóa z-score giống hệt cách encode_block đang làm (std = 0 thì chia cho 1)
+
+    Args:
+        data: Dữ liệu cần chuẩn hóa
+
+    Returns:
+        Dữ liệu đã chuẩn hóa
+    """
+    return (data - np.mean(data)) / (np.std(data) if np.std(data) > 0 else 1)
+
+
+def znormalize_rows(data: np.ndarray) -> np.ndarray:
+    """
+    znormalize cho từng hàng của mảng 2 chiều (kết quả trùng từng bit với znormalize từng hàng)
+
+    Args:
+        data: Mảng (số block, n)
+
+    Returns:
+        Mảng đã chuẩn hóa theo hàng
+    """
+    std = np.std(data, axis=1, keepdims=True)
+    return (data - np.mean(data, axis=1, keepdims=True)) / np.where(std > 0, std, 1)
+
+
+@functools.lru_cache(maxsize=None)
+def ks_pvalue_table(n: int) -> np.ndarray:
+    """
+    Bảng p-value của ks_2samp cho hai mẫu cùng kích thước n.
+
+    Với hai mẫu cùng kích thước, p-value chỉ phụ thuộc vào h = D * n (số nguyên
+    0..n). Bảng được sinh bằng chính ks_2samp trên hai dãy 0..n-1 và h..h+n-1
+    (có D = h/n) nên kết quả trùng khớp từng bit với SciPy đang cài.
+
+    Args:
+        n: Kích thước mẫu
+
+    Returns:
+        Mảng p-value độ dài n + 1, đánh chỉ số theo h
+    """
+    base = np.arange(n, dtype=float)
+    with warnings.catch_warnings():
+        # ks_2samp tự chuyển sang asymp khi exact thất bại, chỉ cần giữ nguyên giá trị
+        warnings.simplefilter('ignore', RuntimeWarning)
+        table = np.array([stats.ks_2samp(base, base + h).pvalue for h in range(n + 1)])
+    table.setflags(write=False)
+    return table
+
+
+@functools.lru_cache(maxsize=None)
+def ks_reject_table(n: int, threshold: float) -> np.ndarray:
+    """
+    Bảng "mọi h' >= h đều bị loại" cho hai mẫu cùng kích thước n.
+
+    Dùng với cận dưới của h: nếu reject[h_lb] thì h thật (>= h_lb) chắc chắn cho
+    p-value <= threshold, không cần tính KS chính xác. Lấy max của phần đuôi bảng
+    nên vẫn đúng nếu p-value không giảm đơn điệu theo h (exact/asymp của ks_2samp).
+
+    Args:
+        n: Kích thước mẫu
+        threshold: Ngưỡng p-value
+
+    Returns:
+        Mảng bool độ dài n + 1, đánh chỉ số theo h
+    """
+    table = ks_pvalue_table(n)
+    reject = np.maximum.accumulate(table[::-1])[::-1] <= threshold
+    reject.setflags(write=False)
+    return reject
+
+
+def precompute_pvalue_tables(min_n: int, max_n: int):
+    """
+    Tính trước ks_pvalue_table cho mọi block size trong [min_n, max_n]
+
+    Dùng khi khởi động tiến trình worker để lần so khớp đầu tiên của mỗi block size
+    không phải trả chi phí sinh bảng (vài chục lần gọi ks_2samp cho mỗi n).
+    """
+    for n in range(max(1, min_n), max_n + 1):
+        ks_pvalue_table(n)
+
+
+# Kích thước lớn nhất ks_2samp (method='auto') còn dùng nhánh exact (MAX_AUTO_N của SciPy)
+KS_EXACT_MAX_N = 10000
+
+
+def ks_2samp_equal(data1, data2):
+    """
+    Thay thế stats.ks_2samp (two-sided, method='auto') cho hai mẫu cùng kích thước.
+
+    D được tính bằng một lượt quét trên hai mẫu đã trộn và sắp xếp: tại cuối mỗi nhóm
+    giá trị bằng nhau, đếm số phần tử của từng mẫu đã đi qua, h = D * n là hiệu lớn
+    nhất của hai số đếm. Như nhánh exact của ks_2samp, statistic trả về là h / n và
+    p-value tra ks_pvalue_table theo h. Mẫu khác kích thước, rỗng, có NaN/inf hoặc
+    lớn hơn KS_EXACT_MAX_N (ks_2samp chuyển sang asymp trên D không làm tròn) thì gọi
+    thẳng ks_2samp.
+
+    Args:
+        data1: Mẫu thứ nhất
+        data2: Mẫu thứ hai
+
+    Returns:
+        (statistic, pvalue)
+    """
+    a = np.asarray(data1, dtype=float).ravel()
+    b = np.asarray(data2, dtype=float).ravel()
+    n = len(a)
+    if n == 0 or n > KS_EXACT_MAX_N or len(b) != n or not (np.isfinite(a).all() and np.isfinite(b).all()):
+        result = stats.ks_2samp(a, b)
+        return result.statistic, result.pvalue
+    merged = np.concatenate([a, b])
+    order = np.argsort(merged, kind='mergesort')
+    values = merged[order]
+    # Cuối mỗi nhóm giá trị bằng nhau: số phần tử của a (và của b) <= giá trị đó
+    ends = np.flatnonzero(np.append(values[1:] != values[:-1], True))
+    count_a = np.cumsum(order < n)[ends]
+    count_b = ends + 1 - count_a
+    h = int(np.abs(count_a - count_b).max())
+    return np.float64(h * 1.0 / n), ks_pvalue_table(n)[h]
+
+
+# p-value của ks_2samp cho hai mẫu khác kích thước, theo khóa (n1, n2, h)
+_UNEQUAL_PVALUES = {}
+
+
+def ks_pvalue(a: np.ndarray, b: np.ndarray) -> float:
+    """
+    p-value ks_2samp (two-sided, method='auto') cho hai mẫu đã sắp xếp, kích thước bất kỳ.
+
+    p-value của ks_2samp chỉ phụ thuộc vào (n1, n2, h) với h = D * lcm(n1, n2).
+    h được tính chính xác bằng số nguyên; cùng kích thước thì tra ks_pvalue_table,
+    khác kích thước thì gọi ks_2samp một lần cho mỗi khóa rồi ghi nhớ.
+
+    Args:
+        a: Mẫu thứ nhất (đã sắp xếp)
+        b: Mẫu thứ hai (đã sắp xếp)
+
+    Returns:
+        p-value
+    """
+    if not (np.isfinite(a).all() and np.isfinite(b).all()):
+        return stats.ks_2samp(a, b).pvalue
+    n1, n2 = len(a), len(b)
+    g = math.gcd(n1, n2)
+    h = max(
+        np.abs(np.searchsorted(a, a, side='right') * (n2 // g) - np.searchsorted(b, a, side='right') * (n1 // g)).max(),
+        np.abs(np.searchsorted(a, b, side='right') * (n2 // g) - np.searchsorted(b, b, side='right') * (n1 // g)).max()
+    )
+    if n1 == n2:
+        return ks_pvalue_table(n1)[h]
+    key = (n1, n2, int(h))
+    if key not in _UNEQUAL_PVALUES:
+        _UNEQUAL_PVALUES[key] = stats.ks_2samp(a, b).pvalue
+    return _UNEQUAL_PVALUES[key]
+
+
+class KSMatcher:
+    """
+    Giữ các buffer đã sắp xếp trong một mảng 2 chiều và so khớp một block với
+    tất cả buffer trong một lần gọi.
+
+    Các buffer có độ dài khác kích thước chung (block cuối bị cắt ngắn) hoặc chứa
+    NaN/inf được giữ riêng và so sánh bằng ks_2samp như cũ.
+
+    Trước phép KS chính xác, mỗi buffer được lọc bằng cận dưới của h = D * n tính từ
+    sketch lưu sẵn khi put (min, max và vài phân vị của buffer, cùng số phần tử <= và <
+    tại các điểm đó) và từ min/max của block: tại mỗi điểm x, |F_block(x) - F_buffer(x)|
+    không vượt quá D. Buffer chỉ bị loại khi mọi h từ cận dưới trở lên đều cho p-value
+    <= threshold (ks_reject_table), nên quyết định khớp/không khớp không đổi.
+    Với đường vector hóa, KS chính xác của cả pool chỉ là một lần gọi NumPy nên bộ lọc
+    chỉ chạy khi n >= PREFILTER_MIN_N, dưới ngưỡng đó sketch_points không có tác dụng
+    (đo với pool 16 buffer: n = 12-32 lọc chậm hơn 10-90%, n = 36-48 hòa, n = 64 nhanh
+    hơn 1.4x, n = 96 nhanh hơn 2.5x); với buffer so bằng ks_2samp/ks_pvalue từng cặp,
+    bộ lọc luôn chạy. Mặc định tắt (sketch_points=0).
+    """
+
+    PREFILTER_MIN_N = 48
+
+    def __init__(self, capacity: int, vectorized: bool = True, sketch_points: int = 0):
+        """
+        Args:
+            capacity: Số buffer tối đa
+            vectorized: False để so sánh từng cặp bằng ks_2samp (đường tham chiếu)
+            sketch_points: Số điểm sketch của mỗi buffer (min, max và các phân vị giữa), 0 = tắt lọc;
+                đường vector hóa chỉ lọc khi n >= PREFILTER_MIN_N
+        """
+        self.capacity = capacity
+        self.vectorized = vectorized
+        self.sketch_points = sketch_points
+        self.reset_stats()
+        self.clear()
+
+    def reset_stats(self):
+        """Đặt lại bộ đếm phép KS chính xác và số buffer bị lọc ở từng tầng"""
+        self.stats = {'ks_exact': 0, 'prefilter_minmax': 0, 'prefilter_quantile': 0}
+
+    def clear(self):
+        """Xóa toàn bộ buffer"""
+        self.n = None
+        self.size = 0
+        self.sorted = None  # (capacity, n): giá trị đã sắp xếp của từng buffer
+        self.ranks = None   # (capacity, n): ECDF (đếm) của buffer tại chính các điểm của nó
+        self.regular = np.zeros(self.capacity, dtype=bool)
+        self.irregular = {}  # idx -> mảng đã sắp xếp, cho buffer không nằm trong mảng 2 chiều
+        self.sketched = np.zeros(self.capacity, dtype=bool)  # Buffer có sketch (độ dài n, hữu hạn)
+        self.sketch = None     # (capacity, k): giá trị tại các điểm sketch (cột 0, 1 là min, max)
+        self.sketch_le = None  # (capacity, k): số phần tử của buffer <= điểm sketch
+        self.sketch_lt = None  # (capacity, k): số phần tử của buffer < điểm sketch
+
+    def put(self, idx: int, values: np.ndarray):
+        """
+        Ghi (thêm mới hoặc ghi đè) buffer tại vị trí idx
+
+        Args:
+            idx: Vị trí buffer
+            values: Giá trị buffer (đã qua biến đổi dùng để so khớp, ví dụ z-normalize)
+        """
+        s = np.sort(np.asarray(values, dtype=float))
+        if self.n is None:
+            self.n = len(s)
+            self.sorted = np.zeros((self.capacity, self.n))
+            self.ranks = np.zeros((self.capacity, self.n), dtype=np.int64)
+            inner = np.linspace(0, self.n - 1, max(2, self.sketch_points)).round().astype(np.int64)[1:-1]
+            self._sketch_pos = np.concatenate([[0, self.n - 1], inner])
+            k = len(self._sketch_pos)
+            self.sketch = np.zeros((self.capacity, k))
+            self.sketch_le = np.zeros((self.capacity, k), dtype=np.int64)
+            self.sketch_lt = np.zeros((self.capacity, k), dtype=np.int64)
+        equal = len(s) == self.n and np.isfinite(s).all()
+        if equal:
+            # Mảng đã sắp xếp/ECDF dùng cho KS vector hóa và cho sketch của bộ lọc
+            self.sorted[idx] = s
+            self.ranks[idx] = np.searchsorted(s, s, side='right')
+            points = s[self._sketch_pos]
+            self.sketch[idx] = points
+            self.sketch_le[idx] = self.ranks[idx][self._sketch_pos]
+            self.sketch_lt[idx] = np.searchsorted(s, points, side='left')
+        self.sketched[idx] = equal and self.sketch_points > 0
+        if self.vectorized and equal:
+            self.regular[idx] = True
+            self.irregular.pop(idx, None)
+        else:
+            self.regular[idx] = False
+            self.irregular[idx] = s
+        self.size = max(self.size, idx + 1)
+
+    def pvalues(self, values: np.ndarray, candidates=None) -> np.ndarray:
+        """
+        Tính p-value KS của block so với tất cả buffer (hoặc các buffer trong candidates)
+
+        Args:
+            values: Block cần so khớp (cùng phép biến đổi với buffer)
+            candidates: Mảng chỉ số buffer cần tính (mặc định 0..size-1)
+
+        Returns:
+            Mảng p-value, phần tử i ứng với buffer candidates[i]
+        """
+        s = np.sort(np.asarray(values, dtype=float))
+        if candidates is None:
+            candidates = np.arange(self.size)
+        p = np.empty(len(candidates))
+        regular = self.regular[candidates]
+        pos = np.flatnonzero(regular)
+        if pos.size and len(s) == self.n and np.isfinite(s).all():
+            p[pos] = self._batch_pvalues(s, candidates[pos])
+            others = np.flatnonzero(~regular)
+        else:
+            others = range(len(candidates))
+        for i in others:
+            idx = int(candidates[i])
+            buf = self.irregular[idx] if idx in self.irregular else self.sorted[idx]
+            p[i] = ks_pvalue(s, buf) if self.vectorized else stats.ks_2samp(s, buf).pvalue
+        return p
+
+    def find(self, values: np.ndarray, threshold: float):
+        """
+        Tìm buffer đầu tiên (theo thứ tự chỉ số) có p-value > threshold
+
+        Args:
+            values: Block cần so khớp
+            threshold: Ngưỡng p-value
+
+        Returns:
+            Chỉ số buffer khớp, hoặc None nếu không có
+        """
+        if self.size == 0:
+            return None
+        hits = np.flatnonzero(self._matches(np.sort(np.asarray(values, dtype=float)), np.arange(self.size), threshold))
+        return int(hits[0]) if hits.size else None
+
+    def find_ordered(self, values: np.ndarray, threshold: float, order):
+        """
+        Thử các buffer theo thứ tự order, dừng ở nhóm có buffer khớp đầu tiên
+
+        Buffer được thử theo nhóm kích thước 1, 1, 2, 4, ... (mỗi nhóm một lần gọi vector
+        hóa): khi buffer đứng đầu thứ tự thường khớp, phần lớn block chỉ tốn một phép KS.
+
+        Args:
+            values: Block cần so khớp
+            threshold: Ngưỡng p-value
+            order: Thứ tự thử (list chỉ số buffer, gồm mọi buffer đang dùng)
+
+        Returns:
+            (chỉ số buffer khớp đầu tiên theo order hoặc None, số phép KS đã tính)
+        """
+        s = np.sort(np.asarray(values, dtype=float))
+        order = np.asarray(order, dtype=np.int64)
+        lo, step = 0, 1
+        while lo < len(order):
+            candidates = order[lo:lo + step]
+            hits = np.flatnonzero(self._matches(s, candidates, threshold))
+            lo += len(candidates)
+            if hits.size:
+                return int(candidates[hits[0]]), lo
+            step = max(1, lo)
+        return None, lo
+
+    def _matches(self, s: np.ndarray, candidates: np.ndarray, threshold: float) -> np.ndarray:
+        """
+        Quyết định khớp (p-value > threshold) của block đã sắp xếp s với từng buffer trong candidates
+
+        Buffer bị bộ lọc cận dưới loại thì không tính KS chính xác.
+        """
+        hits = np.zeros(len(candidates), dtype=bool)
+        equal = len(s) == self.n and np.isfinite(s).all()
+        live = np.arange(len(candidates))
+        batched = equal and self.regular[candidates].all()
+        if equal and self.sketch_points and (not batched or self.n >= self.PREFILTER_MIN_N):
+            live = live[~self._prefilter(s, candidates, threshold)]
+        self.stats['ks_exact'] += len(live)
+        if live.size:
+            rows = candidates[live]
+            if batched:
+                hits[live] = ks_pvalue_table(self.n)[self._batch_h(s, rows)] > threshold
+            else:
+                hits[live] = self.pvalues(s, rows) > threshold
+        return hits
+
+    def _prefilter(self, s: np.ndarray, candidates: np.ndarray, threshold: float) -> np.ndarray:
+        """
+        Các buffer trong candidates chắc chắn không khớp theo cận dưới của h (mảng bool)
+
+        Tầng 1 dùng min/max của block và của buffer, tầng 2 thêm các phân vị của sketch.
+        Cả hai tầng tính trong cùng một lần gọi searchsorted; stats ghi tầng đã loại buffer.
+        """
+        rejected = np.zeros(len(candidates), dtype=bool)
+        pos = np.flatnonzero(self.sketched[candidates])
+        if not pos.size:
+            return rejected
+        rows = candidates[pos]
+        reject = ks_reject_table(self.n, threshold)
+        points = self.sketch[rows]
+        # |F_block - F_buffer| tại điểm sketch và ngay bên trái điểm đó (tính bằng số phần tử)
+        gap = np.maximum(
+            np.abs(np.searchsorted(s, points, side='right') - self.sketch_le[rows]),
+            np.abs(np.searchsorted(s, points, side='left') - self.sketch_lt[rows])
+        )
+        bufs = self.sorted[rows]
+        # Dưới min của block F_block = 0, trên max của block F_block = 1
+        outside = np.maximum((bufs < s[0]).sum(axis=1), (bufs > s[-1]).sum(axis=1))
+        minmax = np.maximum(gap[:, :2].max(axis=1), outside)
+        by_minmax = reject[minmax]
+        by_quantile = ~by_minmax & reject[np.maximum(minmax, gap.max(axis=1))]
+        self.stats['prefilter_minmax'] += int(by_minmax.sum())
+        self.stats['prefilter_quantile'] += int(by_quantile.sum())
+        rejected[pos] = by_minmax | by_quantile
+        return rejected
+
+    def _batch_pvalues(self, s: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Thống kê KS dạng số nguyên h = D * n cho tất cả buffer trong rows, rồi tra bảng"""
+        return ks_pvalue_table(self.n)[self._batch_h(s, rows)]
+
+    def _batch_h(self, s: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """h = D * n của block đã sắp xếp s so với các buffer trong rows"""
+        bufs = self.sorted[rows]
+        # ECDF (đếm) của block và của buffer tại các điểm của block
+        block_at_block = np.searchsorted(s, s, side='right')
+        buf_at_block = (bufs[:, None, :] <= s[None, :, None]).sum(axis=2)
+        # ECDF (đếm) của block và của buffer tại các điểm của buffer
+        block_at_buf = np.searchsorted(s, bufs, side='right')
+        h = np.maximum(
+            np.abs(block_at_block - buf_at_block).max(axis=1),
+            np.abs(block_at_buf - self.ranks[rows]).max(axis=1)
+        )
+        return h
+
+
+def batch_find(blocks: np.ndarray, sorted_buffers: np.ndarray, buffer_ranks: np.ndarray,
+               valid: np.ndarray, threshold: float, probe_ranks=None) -> np.ndarray:
+    """
+    So khớp cùng lúc block hiện tại của nhiều stream với pool buffer của chính stream đó
+
+    Tương đương KSMatcher.find chạy riêng cho từng stream (các buffer đều có cùng độ
+    dài n, hữu hạn), nhưng toàn bộ thống kê KS được tính trong một lần gọi trên tensor
+    3 chiều (stream, buffer, n).
+
+    Args:
+        blocks: (D, n) block đã qua phép biến đổi so khớp (z-normalize)
+        sorted_buffers: (D, C, n) buffer đã sắp xếp của từng stream (KSMatcher.sorted)
+        buffer_ranks: (D, C, n) ECDF (đếm) của buffer tại chính các điểm của nó (KSMatcher.ranks)
+        valid: (D, C) True với các buffer đang dùng
+        threshold: Ngưỡng p-value
+        probe_ranks: (D, C) vị trí của buffer trong thứ tự thử (BufferPool.probe_ranks),
+            None = theo chỉ số
+
+    Returns:
+        Mảng (D,) chỉ số buffer khớp đầu tiên (theo thứ tự thử) của từng stream, -1 nếu không khớp
+    """
+    s = np.sort(blocks, axis=1)
+    n = s.shape[1]
+    # ECDF (đếm) của block tại các điểm của block và tại các điểm của buffer, và ngược lại
+    block_at_block = (s[:, None, :] <= s[:, :, None]).sum(axis=2)
+    buf_at_block = (sorted_buffers[:, :, None, :] <= s[:, None, :, None]).sum(axis=3)
+    block_at_buf = (s[:, None, None, :] <= sorted_buffers[:, :, :, None]).sum(axis=3)
+    h = np.maximum(
+        np.abs(block_at_block[:, None, :] - buf_at_block).max(axis=2),
+        np.abs(block_at_buf - buffer_ranks).max(axis=2)
+    )
+    hits = (ks_pvalue_table(n)[h] > threshold) & valid
+    if probe_ranks is None:
+        first = hits.argmax(axis=1)
+    else:
+        first = np.where(hits, probe_ranks, np.iinfo(np.int64).max).argmin(axis=1)
+    return np.where(hits.any(axis=1), first, -1)
+
+
+class BufferPool:
+    """
+    Pool buffer của IDEALEM.
+
+    Mỗi buffer được lưu cùng mean/std và dạng đã chuẩn hóa + sắp xếp (trong
+    KSMatcher). Các giá trị này chỉ được tính lại khi buffer được thêm mới hoặc
+    ghi đè, nên mỗi block mới chỉ tốn chi phí chuẩn hóa chính nó và phép so sánh.
+    Pool hỗ trợ len(), chỉ số và duyệt như list buffer cũ.
+
+    Thứ tự thử buffer (probe_order):
+        index     : so với mọi buffer trong một lần gọi, lấy buffer khớp có chỉ số nhỏ nhất
+        mru       : buffer vừa hit (hoặc vừa đưa vào) được thử trước
+        frequency : buffer nhiều hit nhất (kể từ khi đưa vào) được thử trước
+    Với mru/frequency, find dừng ở nhóm buffer có buffer khớp đầu tiên (KSMatcher.find_ordered).
+    Block vẫn được mã hóa bằng chỉ số buffer, thứ tự thử chỉ đổi buffer được chọn khi nhiều
+    buffer cùng khớp nên stream giải nén được như cũ.
+    """
+
+    PROBE_ORDERS = ('index', 'mru', 'frequency')
+
+    def __init__(self, capacity: int, normalize: bool = True, vectorized: bool = True,
+                 probe_order: str = 'index', sketch_points: int = 0):
+        """
+        Args:
+            capacity: Số buffer tối đa
+            normalize: True để so khớp trên dữ liệu z-normalize, False để so khớp trên dữ liệu thô
+            vectorized: Truyền cho KSMatcher
+            probe_order: Thứ tự thử buffer khi so khớp (xem PROBE_ORDERS)
+            sketch_points: Số điểm sketch của bộ lọc cận dưới, truyền cho KSMatcher (0 = tắt)
+        """
+        if probe_order not in self.PROBE_ORDERS:
+            raise ValueError(f"Thứ tự thử buffer không hợp lệ: {probe_order}")
+        self.capacity = capacity
+        self.normalize = normalize
+        self.probe_order = probe_order
+        self.matcher = KSMatcher(capacity, vectorized, sketch_points)
+        self.blocks = []
+        self.means = np.zeros(capacity)
+        self.stds = np.zeros(capacity)
+        self.order = []  # Thứ tự thử (mru/frequency)
+        self.hit_counts = np.zeros(capacity, dtype=np.int64)  # Số hit kể từ khi buffer được đưa vào
+        self.reset_stats()
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __getitem__(self, idx):
+        return self.blocks[idx]
+
+    def __iter__(self):
+        return iter(self.blocks)
+
+    def is_full(self) -> bool:
+        return len(self.blocks) >= self.capacity
+
+    def clear(self):
+        """Xóa toàn bộ buffer (dùng khi đổi block size)"""
+        self.blocks = []
+        self.matcher.clear()
+        self.order = []
+        self.hit_counts[:] = 0
+
+    def reset_stats(self):
+        """Đặt lại bộ đếm số lần so khớp, số buffer đã thử và số phép KS chính xác/bị lọc"""
+        self.stats = {'lookups': 0, 'ks_tests': 0}
+        self.matcher.reset_stats()
+
+    def counters(self) -> dict:
+        """Bộ đếm của pool và của KSMatcher (ks_tests = buffer đã thử, ks_exact = phép KS thật sự tính)"""
+        return {**self.stats, **self.matcher.stats}
+
+    def append(self, block: np.ndarray) -> int:
+        """Thêm buffer mới vào cuối pool, trả về chỉ số của nó"""
+        self.blocks.append(None)
+        idx = len(self.blocks) - 1
+        self.overwrite(idx, block)
+        return idx
+
+    def overwrite(self, idx: int, block: np.ndarray):
+        """Ghi đè buffer tại idx và cập nhật thống kê đã cache"""
+        block = np.array(block, copy=True)
+        self.blocks[idx] = block
+        mean, std = np.mean(block), np.std(block)
+        self.means[idx] = mean
+        self.stds[idx] = std
+        if self.normalize:
+            # Cùng phép tính với znormalize nhưng dùng lại mean/std vừa cache
+            self.matcher.put(idx, (block - mean) / (std if std > 0 else 1))
+        else:
+            self.matcher.put(idx, block)
+        if self.probe_order != 'index':
+            self.hit_counts[idx] = 0
+            if idx in self.order:
+                self.order.remove(idx)
+            if self.probe_order == 'mru':
+                self.order.insert(0, idx)
+            else:
+                # Buffer mới chưa có hit: đứng sau mọi buffer đã có hit
+                self.order.append(idx)
+                self._bubble_up(len(self.order) - 1)
+
+    def find(self, block: np.ndarray, threshold: float):
+        """
+        Tìm buffer khớp với block (p-value > threshold), đầu tiên theo thứ tự thử
+
+        Returns:
+            Chỉ số buffer khớp, hoặc None nếu không có
+        """
+        if not self.blocks:
+            self.record_lookup(None, 0)
+            return None
+        if self.probe_order == 'index':
+            idx, tests = self.matcher.find(self._transform(block), threshold), len(self.blocks)
+        else:
+            idx, tests = self.matcher.find_ordered(self._transform(block), threshold, self.order)
+        self.record_lookup(idx, tests)
+        return idx
+
+    def record_lookup(self, idx, ks_tests: int):
+        """
+        Ghi nhận kết quả một lần so khớp (cả khi so khớp làm bên ngoài, vd. batch_find)
+
+        Args:
+            idx: Buffer khớp hoặc None
+            ks_tests: Số phép KS đã tính cho block
+        """
+        self.stats['lookups'] += 1
+        self.stats['ks_tests'] += ks_tests
+        if idx is None or self.probe_order == 'index':
+            return
+        self.hit_counts[idx] += 1
+        pos = self.order.index(idx)
+        if self.probe_order == 'mru':
+            if pos:
+                del self.order[pos]
+                self.order.insert(0, idx)
+        else:
+            self._bubble_up(pos)
+
+    def _bubble_up(self, pos: int):
+        """Đưa order[pos] lên trước các buffer có ít hit hơn (giữ thứ tự hiện tại khi hòa)"""
+        order, counts = self.order, self.hit_counts
+        while pos and counts[order[pos - 1]] < counts[order[pos]]:
+            order[pos - 1], order[pos] = order[pos], order[pos - 1]
+            pos -= 1
+
+    def probe_ranks(self) -> np.ndarray:
+        """Vị trí trong thứ tự thử của từng buffer (mảng độ dài capacity, nhỏ = thử trước)"""
+        ranks = np.arange(self.capacity)
+        if self.probe_order != 'index':
+            ranks[self.order] = np.arange(len(self.order))
+        return ranks
+
+    def batchable(self, block: np.ndarray) -> bool:
+        """True nếu block so khớp được với pool bằng find_in_pools (buffer cùng độ dài, hữu hạn)"""
+        matcher = self.matcher
+        return (matcher.vectorized and matcher.size > 0 and len(block) == matcher.n
+                and matcher.regular[:matcher.size].all() and bool(np.isfinite(block).all()))
+
+    def _transform(self, block: np.ndarray) -> np.ndarray:
+        return znormalize(block) if self.normalize else block
+
+
+def find_in_pools(pools, blocks: np.ndarray, threshold: float, max_elements: int = 8_000_000) -> np.ndarray:
+    """
+    So khớp block hiện tại của nhiều pool (mỗi pool một block) bằng batch_find
+
+    Kết quả và bộ đếm (lookups, ks_tests, ks_exact) của từng pool giống như khi gọi
+    BufferPool.find riêng. Tensor chỉ gồm các cột buffer đang dùng (tới pool lớn nhất của
+    mỗi lần gọi), mỗi pool được tính số phép KS bằng số buffer đang dùng của nó.
+
+    Args:
+        pools: Các BufferPool cùng cấu hình (normalize, probe_order), batchable với block của mình
+        blocks: (D, n) block của từng pool theo thứ tự pools
+        threshold: Ngưỡng p-value
+        max_elements: Số phần tử tối đa của mảng trung gian (pool x buffer x n x n) mỗi lần gọi
+
+    Returns:
+        Mảng (D,) chỉ số buffer khớp của từng pool, -1 nếu không khớp
+    """
+    found = np.full(len(pools), -1, dtype=np.int64)
+    if not pools:
+        return found
+    n = blocks.shape[1]
+    step = max(1, max_elements // (pools[0].capacity * n * n))
+    for lo in range(0, len(pools), step):
+        chunk = pools[lo:lo + step]
+        sizes = np.array([pool.matcher.size for pool in chunk])
+        width = int(sizes.max())
+        values = blocks[lo:lo + step]
+        found[lo:lo + step] = batch_find(
+            znormalize_rows(values) if chunk[0].normalize else values,
+            np.stack([pool.matcher.sorted[:width] for pool in chunk]),
+            np.stack([pool.matcher.ranks[:width] for pool in chunk]),
+            np.arange(width)[None, :] < sizes[:, None],
+            threshold,
+            None if chunk[0].probe_order == 'index' else np.stack([pool.probe_ranks()[:width] for pool in chunk])
+        )
+        for pool, idx, size in zip(chunk, found[lo:lo + step].tolist(), sizes.tolist()):
+            # KS chính xác với mọi buffer đang dùng (không qua bộ lọc cận dưới, không dừng sớm)
+            pool.record_lookup(idx if idx >= 0 else None, size)
+            pool.matcher.stats['ks_exact'] += size
+    return found
+
+
+class PairwiseKS:
+    """
+    Ma trận quyết định KS (p-value > threshold) giữa mọi cặp block đầy đủ của
+    một cửa sổ dữ liệu, dùng cho simulate_compress.
+
+    Ma trận của lần gọi trước được giữ lại theo (n, threshold) cùng vị trí tuyệt
+    đối (origin) của cửa sổ. Nếu cửa sổ mới trượt một bội số của n trên cùng dòng
+    dữ liệu, phần chồng lấn được dùng lại và chỉ tính các cặp có block mới.
+    """
+
+    # Số phần tử tối đa của mảng trung gian (block x block x n) mỗi lần tính
+    MAX_CHUNK_ELEMENTS = 4_000_000
+
+    def __init__(self):
+        self._grids = {}  # (n, threshold) -> (origin, sorted_blocks, ranks, decisions)
+        self.stats = self.new_stats()
+
+    def clear(self):
+        self._grids = {}
+        self.stats = self.new_stats()
+
+    @staticmethod
+    def new_stats() -> dict:
+        """Bộ đếm số cặp KS tính mới/dùng lại (truyền vào decisions khi nhiều thread dùng chung)"""
+        return {'computed_pairs': 0, 'reused_pairs': 0}
+
+    def merge_stats(self, stats: dict):
+        """Cộng bộ đếm của một lần gọi (vd. trả về từ thread/tiến trình worker) vào self.stats"""
+        for key, value in stats.items():
+            self.stats[key] += value
+
+    def decisions(self, data: np.ndarray, n: int, threshold: float, origin=None, stats=None) -> np.ndarray:
+        """
+        Ma trận quyết định cho các block đầy đủ data[k*n:(k+1)*n]
+
+        Args:
+            data: Cửa sổ dữ liệu (giá trị thô, hữu hạn)
+            n: Kích thước block
+            threshold: Ngưỡng p-value
+            origin: Vị trí tuyệt đối của data[0] trong dòng dữ liệu; None để không dùng lại
+            stats: Bộ đếm cộng dồn số cặp (new_stats()), mặc định self.stats
+
+        Returns:
+            Mảng bool (B, B), phần tử [i, j] = block i và block j trao đổi được
+        """
+        stats = self.stats if stats is None else stats
+        count = len(data) // n
+        blocks = np.sort(np.asarray(data[:count * n], dtype=float).reshape(count, n), axis=1)
+        accept = ks_pvalue_table(n) > threshold
+
+        decisions = np.zeros((count, count), dtype=bool)
+        start = 0
+        cached = self._grids.get((n, threshold))
+        if origin is not None and cached is not None:
+            old_origin, old_blocks, old_decisions = cached
+            shift, rem = divmod(origin - old_origin, n)
+            overlap = len(old_blocks) - shift
+            if rem == 0 and shift >= 0 and overlap > 0:
+                overlap = min(overlap, count)
+                if np.array_equal(old_blocks[shift:shift + overlap], blocks[:overlap]):
+                    decisions[:overlap, :overlap] = old_decisions[shift:shift + overlap, shift:shift + overlap]
+                    start = overlap
+                    stats['reused_pairs'] += overlap * overlap
+        if start < count:
+            # Đổi giá trị sang hạng toàn cục rồi cộng offset theo block: các block nối lại
+            # thành một mảng tăng dần, đếm "số phần tử <= x" của mọi block chỉ cần searchsorted
+            _, levels = np.unique(blocks, return_inverse=True)
+            levels = levels.reshape(count, n)
+            width = int(levels.max()) + 1
+            offsets = np.arange(count) * width
+            flat = (levels + offsets[:, None]).ravel()
+            # Cặp (block mới, block đứng trước nó); ma trận đối xứng nên chỉ tính nửa dưới.
+            # Chia nhỏ theo hàng để giới hạn bộ nhớ trung gian.
+            step = max(1, self.MAX_CHUNK_ELEMENTS // max(1, count * n))
+            for lo in range(start, count, step):
+                hi = min(count, lo + step)
+                h = self._pair_h(flat, levels, offsets, n, lo, hi)
+                decisions[lo:hi, :hi] = accept[h]
+                decisions[:hi, lo:hi] = decisions[lo:hi, :hi].T
+            stats['computed_pairs'] += (count - start) * (count + start + 1) // 2
+        if origin is not None:
+            self._grids[(n, threshold)] = (origin, blocks, decisions)
+        return decisions
+
+    @staticmethod
+    def _pair_h(flat: np.ndarray, levels: np.ndarray, offsets: np.ndarray, n: int, lo: int, hi: int) -> np.ndarray:
+        """h = D * n cho mọi cặp (block x trong [lo, hi), block y trong [0, hi))"""
+        def count_le(values, rows):
+            # Số phần tử của block rows[...] <= values (values là hạng toàn cục)
+            return np.searchsorted(flat, values + offsets[rows], side='right') - rows * n
+
+        x = np.arange(lo, hi)[:, None, None]
+        y = np.arange(hi)[None, :, None]
+        a, b = levels[lo:hi][:, None, :], levels[:hi][None, :, :]
+        return np.maximum(
+            np.abs(count_le(a, x) - count_le(a, y)).max(axis=2),
+            np.abs(count_le(b, x) - count_le(b, y)).max(axis=2)
+        )
@@ -7,18 +7,20 @@ Sử dụng thuật toán nén lossless từ module lossless_compression.py.
 
 
 import json
+import base64
 import sys
 import os
 import logging
 from datetime import datetime, timedelta, date
 from sqlalchemy import create_engine, text, inspect
-import pandas as pd
 import argparse
-import matplotlib.pyplot as plt
 import numpy as np
 import psycopg2
 from dotenv import load_dotenv
 import traceback
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 
 # Thiết lập logging
 logging.basicConfig(
@@ -29,9 +31,8 @@ logger = logging.getLogger(__name__)
 
 # Import thuật toán nén lossless
 from lossless_compression import LosslessCompressor
-
-# Import từ module visualization_analyzer
-from visualization_analyzer import create_visualizations
+from replacement_policy import REPLACEMENT_POLICIES
+from stream_codec import encode_stream, apply_post_stage, encode_seek_index, encode_timestamps, FORMAT_NAME
 
 # Cấu hình database
 load_dotenv()
@@ -62,6 +63,9 @@ class MyEncoder(json.JSONEncoder):
             return bool(obj)
         elif isinstance(obj, bool):
             return bool(obj)
+        elif isinstance(obj, bytes):
+            # Block miss đã đóng gói (block_encoding='varint') ghi dạng base64
+            return base64.b64encode(obj).decode('ascii')
         return super().default(obj)
 
 def convert_date_keys_to_str(obj):
@@ -77,10 +81,14 @@ def convert_date_keys_to_str(obj):
     else:
         return obj
 
+def database_url():
+    """URL kết nối database từ DB_CONFIG"""
+    return f"postgresql://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}"
+
 def setup_optimized_database():
     """Thiết lập kết nối database và tạo bảng nếu chưa tồn tại"""
     # Tạo URL kết nối database
-    db_url = f"postgresql://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}"
+    db_url = database_url()
     
     try:
         engine = create_engine(db_url)
@@ -89,30 +97,45 @@ def setup_optimized_database():
         with engine.connect() as conn:
             conn.execute(text("SELECT 1"))
             
-        # Kiểm tra và tạo bảng nếu chưa tồn tại
-        inspector = inspect(engine)
-        if "compressed_data_optimized" not in inspector.get_table_names():
-            with engine.connect() as conn:
-                conn.execute(text("""
-                    CREATE TABLE compressed_data_optimized (
-                        id SERIAL PRIMARY KEY,
-                        device_id VARCHAR(255) NOT NULL,
-                        compression_metadata JSONB,
-                        encoded_stream JSONB,
-                        time_range TSRANGE,
-                        FOREIGN KEY (device_id) REFERENCES devices(device_id)
-                    );
-                    CREATE INDEX idx_compressed_data_optimized_device_id ON compressed_data_optimized(device_id);
-                    CREATE INDEX idx_compressed_data_optimized_time_range ON compressed_data_optimized USING GIST(time_range);
-                """))
-                conn.commit()
-                
+        ensure_optimized_schema(engine)
         return engine
         
     except Exception as e:
         logging.error(f"Database connection error: {str(e)}")
         raise
 
+def ensure_optimized_schema(engine):
+    """Tạo bảng compressed_data_optimized nếu chưa tồn tại, bổ sung các cột mới cho bảng cũ"""
+    inspector = inspect(engine)
+    if "compressed_data_optimized" not in inspector.get_table_names():
+        with engine.connect() as conn:
+            conn.execute(text("""
+                CREATE TABLE compressed_data_optimized (
+                    id SERIAL PRIMARY KEY,
+                    device_id VARCHAR(255) NOT NULL,
+                    compression_metadata JSONB,
+                    encoded_stream JSONB,
+                    encoded_stream_bin BYTEA,
+                    seek_index BYTEA,
+                    timestamp_channel BYTEA,
+                    time_range TSRANGE,
+                    FOREIGN KEY (device_id) REFERENCES devices(device_id)
+                );
+                CREATE INDEX idx_compressed_data_optimized_device_id ON compressed_data_optimized(device_id);
+                CREATE INDEX idx_compressed_data_optimized_time_range ON compressed_data_optimized USING GIST(time_range);
+            """))
+            conn.commit()
+    else:
+        # Bảng tạo trước khi có định dạng nhị phân: bổ sung cột, bản ghi JSONB cũ giữ nguyên.
+        # Chỉ ALTER khi thiếu cột: ALTER TABLE giữ lock ACCESS EXCLUSIVE kể cả khi cột đã có
+        existing = {column['name'] for column in inspector.get_columns("compressed_data_optimized")}
+        missing = [name for name in ('encoded_stream_bin', 'seek_index', 'timestamp_channel') if name not in existing]
+        if missing:
+            with engine.connect() as conn:
+                for name in missing:
+                    conn.execute(text(f"ALTER TABLE compressed_data_optimized ADD COLUMN IF NOT EXISTS {name} BYTEA"))
+                conn.commit()
+
 def ensure_device_exists(engine, device_id):
     """Đảm bảo device_id tồn tại trong bảng devices"""
     with engine.connect() as conn:
@@ -124,35 +147,120 @@ def ensure_device_exists(engine, device_id):
         if result == 0:
             raise ValueError(f"Device {device_id} not found in database")
 
-def fetch_original_data(engine, device_id=None):
+FETCH_CHUNK_SIZE = 50000  # Số dòng mỗi lần đọc từ server-side cursor
+
+def iter_original_chunks(engine, device_id=None, since=None, limit=None, chunk_size=FETCH_CHUNK_SIZE):
     """
-    Lấy toàn bộ dữ liệu gốc của device từ bảng original_samples
+    Đọc dần dữ liệu gốc từ original_samples qua server-side cursor (stream_results,
+    psycopg2 dùng named cursor), mỗi lần chunk_size dòng. Mẫu có value NULL (thiết bị
+    không đo được) bị bỏ qua: không có giá trị để nén, kênh timestamp giữ đúng khoảng trống
+
+    Args:
+        device_id: Chỉ lấy mẫu của device này
+        since: Chỉ lấy các mẫu có timestamp >= since
+        limit: Số mẫu tối đa (các mẫu sớm nhất, không tính mẫu NULL), None = không giới hạn
+        chunk_size: Số dòng mỗi đoạn
+
+    Yields:
+        (values float64, timestamps datetime64[us]) của từng đoạn, theo thứ tự thời gian
     """
     query = """
         SELECT value, timestamp 
         FROM original_samples 
-        WHERE 1=1
+        WHERE value IS NOT NULL
     """
     params = {}
     if device_id:
         query += " AND device_id = :device_id"
         params["device_id"] = device_id
+    if since is not None:
+        query += " AND timestamp >= :since"
+        params["since"] = since
     query += " ORDER BY timestamp ASC"
+    if limit is not None:
+        query += " LIMIT :limit"
+        params["limit"] = limit
     with engine.connect() as conn:
-        df = pd.read_sql(text(query), conn, params=params)
-    if df.empty:
+        result = conn.execution_options(stream_results=True, max_row_buffer=chunk_size).execute(text(query), params)
+        for rows in result.partitions(chunk_size):
+            values = np.fromiter((row[0] for row in rows), dtype=float, count=len(rows))
+            timestamps = np.array([row[1] for row in rows], dtype='datetime64[us]')
+            yield values, timestamps
+
+def fetch_original_data(engine, device_id=None, since=None, limit=None):
+    """
+    Lấy toàn bộ dữ liệu gốc của device từ bảng original_samples
+    (chỉ các mẫu có timestamp >= since nếu truyền vào, tối đa limit mẫu)
+
+    Returns:
+        (values float64, timestamps datetime64[us])
+    """
+    chunks = list(iter_original_chunks(engine, device_id=device_id, since=since, limit=limit))
+    if not chunks:
         raise ValueError("No data found")
-    timestamps = df['timestamp'].tolist()
-    data = df['value'].values
-    return data, timestamps
+    if len(chunks) == 1:
+        return chunks[0]
+    return np.concatenate([c[0] for c in chunks]), np.concatenate([c[1] for c in chunks])
 
-def save_optimized_compression_result(engine, device_id, compression_result, timestamps=None):
+def numeric_column_bytes(values, decimals: int = 2) -> int:
+    """
+    Tổng số byte các giá trị chiếm trong cột NUMERIC (như SUM(pg_column_size(value)) trên
+    original_samples), tính phía client
+
+    Giá trị NUMERIC lưu trong bảng gồm header varlena 1 byte, header numeric 2 byte và
+    2 byte cho mỗi chữ số cơ số 10000 (bỏ các nhóm 0 ở đầu và cuối).
+    """
+    scaled = np.abs(np.round(np.asarray(values, dtype=float) * 10 ** decimals)).astype(np.int64)
+    if len(scaled) == 0:
+        return 0
+    # Phần thập phân (decimals <= 4) chiếm một nhóm, phần nguyên chia các nhóm 4 chữ số
+    fraction = (scaled % 10 ** decimals) * 10 ** (4 - decimals)
+    integer = scaled // 10 ** decimals
+    groups = [fraction]
+    while True:
+        groups.append(integer % 10000)
+        integer = integer // 10000
+        if not integer.any():
+            break
+    nonzero = np.stack(groups[::-1], axis=1) != 0  # Nhóm cao nhất trước
+    width = nonzero.shape[1]
+    first = nonzero.argmax(axis=1)
+    last = width - 1 - nonzero[:, ::-1].argmax(axis=1)
+    ndigits = np.where(nonzero.any(axis=1), last - first + 1, 0)
+    return int(np.sum(3 + 2 * ndigits))
+
+def save_optimized_compression_result(engine, device_id, compression_result, timestamps=None, stream_format='binary',
+                                      post_stage='none', extra_metadata=None, original_bytes=None):
     """
     Lưu kết quả nén vào bảng compressed_data_optimized
+
+    Args:
+        stream_format: 'binary' ghi container nhị phân vào encoded_stream_bin (bytea),
+                       'json' ghi list JSONB vào encoded_stream như định dạng cũ
+        post_stage: Tầng nén thứ cấp sau IDEALEM ('none', 'zlib', 'lzma', 'range'),
+                    chỉ áp dụng cho định dạng binary
+        extra_metadata: Trường bổ sung cho compression_metadata (vd. cửa sổ segment)
+        original_bytes: Kích thước dữ liệu gốc trong original_samples (numeric_column_bytes),
+                        mặc định 8 byte/mẫu
+
+    compression_ratio tính phía client từ các kích thước đã biết nên việc lưu chỉ là một
+    câu INSERT ... RETURNING, không quét lại original_samples.
+
+    Timestamp thật của từng mẫu (khi có đủ original_length mẫu) được lưu vào
+    timestamp_channel để giải nén không phải nội suy tuyến tính trên time_range.
     """
-    if not timestamps:
-        timestamps = [datetime.now()]
-    time_range = f"[{min(timestamps)}, {max(timestamps)}]"
+    if post_stage != 'none' and stream_format != 'binary':
+        raise ValueError("post_stage chỉ dùng được với stream_format='binary'")
+    timestamp_channel = None
+    has_timestamps = timestamps is not None and len(timestamps) > 0
+    if has_timestamps and len(timestamps) == compression_result.get('original_length'):
+        timestamp_channel = encode_timestamps(timestamps)
+    if has_timestamps:
+        timestamps = np.asarray(timestamps, dtype='datetime64[us]')
+        time_range = f"[{timestamps.min()}, {timestamps.max()}]"
+    else:
+        now = datetime.now()
+        time_range = f"[{now}, {now}]"
 
     # Chỉ lấy các trường thực sự có trong kết quả nén mới
     compression_metadata = {
@@ -160,115 +268,292 @@ def save_optimized_compression_result(engine, device_id, compression_result, tim
         'compression_ratio': compression_result.get('compression_ratio'),
         'block_size': compression_result.get('block_size'),
         'num_buffers': compression_result.get('num_buffers'),
-        'original_length': compression_result.get('original_length')
+        'block_encoding': compression_result.get('block_encoding', 'float'),
+        'original_length': compression_result.get('original_length'),
+        'stream_format': FORMAT_NAME if stream_format == 'binary' else 'json',
+        'post_stage': post_stage,
+        'seek_interval': compression_result.get('seek_interval'),
+        'replacement_policy': compression_result.get('replacement_policy', 'first_slot'),
+        'aging_interval': compression_result.get('aging_interval'),
+        'timestamp_bytes': len(timestamp_channel) if timestamp_channel else None
     }
+    if extra_metadata:
+        compression_metadata.update(extra_metadata)
+
+    if stream_format == 'binary':
+        container = encode_stream(compression_result['encoded_stream'])
+        encoded_json, encoded_bin = None, apply_post_stage(container, post_stage)
+        # Kích thước trước/sau tầng nén thứ cấp để tính compression_ratio cả hai phía
+        compression_metadata['stream_bytes'] = len(container)
+        compression_metadata['stored_bytes'] = len(encoded_bin)
+    else:
+        encoded_json, encoded_bin = json.dumps(compression_result['encoded_stream'], cls=MyEncoder), None
+        compression_metadata['stored_bytes'] = len(encoded_json.encode('utf-8'))
+
+    if original_bytes is None:
+        original_bytes = 8 * (compression_result.get('original_length') or 0)
+    stored_bytes = compression_metadata['stored_bytes']
+    compression_ratio = original_bytes / stored_bytes if stored_bytes > 0 else 0
+    compression_metadata['original_bytes'] = original_bytes
+    compression_metadata['compression_ratio'] = compression_ratio
+    if stream_format == 'binary':
+        compression_metadata['compression_ratio_before_post_stage'] = original_bytes / compression_metadata['stream_bytes']
+        compression_metadata['compression_ratio_after_post_stage'] = compression_ratio
 
+    seek_index = compression_result.get('seek_index')
     data = {
         "device_id": device_id,
         "compression_metadata": json.dumps(compression_metadata, cls=MyEncoder),
-        "encoded_stream": json.dumps(compression_result['encoded_stream'], cls=MyEncoder),
+        "encoded_stream": encoded_json,
+        "encoded_stream_bin": encoded_bin,
+        "seek_index": encode_seek_index(seek_index, compression_result['num_buffers']) if seek_index else None,
+        "timestamp_channel": timestamp_channel,
         "time_range": time_range
     }
 
     with engine.connect() as conn:
-        result = conn.execute(
+        compression_id = conn.execute(
             text("""
                 INSERT INTO compressed_data_optimized 
-                (device_id, compression_metadata, encoded_stream, time_range)
+                (device_id, compression_metadata, encoded_stream, encoded_stream_bin, seek_index, timestamp_channel, time_range)
                 VALUES 
-                (:device_id, :compression_metadata, :encoded_stream, :time_range)
+                (:device_id, :compression_metadata, :encoded_stream, :encoded_stream_bin, :seek_index,
+                 :timestamp_channel, :time_range)
                 RETURNING id
             """),
             data
-        )
-        compression_id = result.scalar()
+        ).scalar()
         conn.commit()
+    logger.info(f"Saved compression_id={compression_id} compression_ratio={compression_ratio:.4f} for device_id={device_id}")
 
-    # --- TÍNH COMPRESSION RATIO THỰC TẾ VÀ UPDATE THEO DEVICE_ID ---
-    with engine.connect() as conn:
-        # Lấy kích thước dữ liệu gốc (tổng số byte)
-        original_size = conn.execute(
-            text("""
-                SELECT SUM(pg_column_size(value)) 
-                FROM original_samples 
-                WHERE device_id = :device_id
-            """),
-            {"device_id": device_id}
-        ).scalar() or 0
+    return compression_id
 
-        # Lấy kích thước dữ liệu nén (tổng số byte của encoded_stream)
-        compressed_size = conn.execute(
+def get_device_post_stage(engine, device_id):
+    """Post stage đã dùng cho lần nén gần nhất của device (thiết lập theo từng device)"""
+    if not device_id:
+        return 'none'
+    with engine.connect() as conn:
+        stage = conn.execute(
             text("""
-                SELECT pg_column_size(encoded_stream)
+                SELECT compression_metadata->>'post_stage'
                 FROM compressed_data_optimized
                 WHERE device_id = :device_id
                 ORDER BY id DESC LIMIT 1
             """),
             {"device_id": device_id}
-        ).scalar() or 0
+        ).scalar()
+    return stage or 'none'
 
-        # Tính compression ratio
-        compression_ratio = (original_size / compressed_size) if compressed_size > 0 else 0
+# Độ dài cửa sổ của chế độ nén theo segment
+SEGMENT_WINDOWS = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1)
+}
 
-        # Lấy metadata hiện tại
-        compression_metadata = conn.execute(
+def segment_window_starts(timestamps, segment):
+    """
+    Thời điểm bắt đầu cửa sổ segment của từng timestamp (giờ tròn, nửa đêm, thứ Hai)
+
+    Returns:
+        Mảng datetime64[us]
+    """
+    ts = np.array(timestamps, dtype='datetime64[us]')
+    if segment == 'hour':
+        return ts.astype('datetime64[h]').astype('datetime64[us]')
+    days = ts.astype('datetime64[D]')
+    if segment == 'week':
+        # 1970-01-01 là thứ Năm: (ngày + 3) % 7 = 0 ứng với thứ Hai
+        days = days - (days.astype(np.int64) + 3) % 7
+    return days.astype('datetime64[us]')
+
+def get_compressed_segments(engine, device_id, segment):
+    """Tập thời điểm bắt đầu các cửa sổ segment đã nén của device"""
+    with engine.connect() as conn:
+        rows = conn.execute(
             text("""
-                SELECT compression_metadata
+                SELECT compression_metadata->>'segment_start'
                 FROM compressed_data_optimized
                 WHERE device_id = :device_id
-                ORDER BY id DESC LIMIT 1
+                  AND compression_metadata->>'segment' = :segment
             """),
-            {"device_id": device_id}
-        ).scalar()
+            {"device_id": device_id, "segment": segment}
+        ).fetchall()
+    return {datetime.fromisoformat(row[0]) for row in rows if row[0]}
+
+def database_now(engine):
+    """
+    Giờ hiện tại theo đồng hồ của PostgreSQL (LOCALTIMESTAMP, không múi giờ), cùng hệ giờ
+    với cột timestamp TIMESTAMP của original_data; không dùng giờ máy chạy ứng dụng vì
+    múi giờ hai máy có thể khác nhau
+    """
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT LOCALTIMESTAMP")).scalar()
+
+def run_segmented_compression(engine, device_id, segment, compressor_config=None, stream_format='binary',
+                              post_stage='none', limit=None):
+    """
+    Nén dữ liệu của device theo từng cửa sổ cố định (giờ/ngày/tuần), mỗi cửa sổ một bản ghi
+    compressed_data_optimized với time_range của cửa sổ đó.
 
-        # Update compression_ratio vào metadata (JSON)
-        if isinstance(compression_metadata, str):
-            meta = json.loads(compression_metadata)
-        else:
-            meta = compression_metadata
-        meta['compression_ratio'] = compression_ratio
+    Chỉ nén các cửa sổ đã kết thúc và chưa có bản ghi, nên chạy lại không nén lại lịch sử.
+    Khi số mẫu đọc được chạm limit, cửa sổ cuối có thể bị cắt giữa chừng nên không được
+    lưu ở lần chạy này (lần chạy sau đọc lại từ đầu cửa sổ đó).
 
-        conn.execute(
+    Args:
+        limit: Số mẫu tối đa đọc trong một lần chạy, None = toàn bộ
+
+    Returns:
+        List compression_id của các segment mới
+    """
+    if segment not in SEGMENT_WINDOWS:
+        raise ValueError(f"Segment không hợp lệ: {segment}")
+    window = SEGMENT_WINDOWS[segment]
+    done = get_compressed_segments(engine, device_id, segment)
+    # Chỉ đọc dữ liệu sau cửa sổ đã nén cuối cùng
+    since = max(done) + window if done else None
+    try:
+        data, timestamps = fetch_original_data(engine, device_id=device_id, since=since, limit=limit)
+    except ValueError:
+        logger.info(f"No new samples to compress for device_id={device_id}")
+        return []
+    starts = segment_window_starts(timestamps, segment)
+    boundaries = np.flatnonzero(starts[1:] != starts[:-1]) + 1
+    windows = list(zip(np.concatenate(([0], boundaries)), np.concatenate((boundaries, [len(data)]))))
+    if limit is not None and len(data) >= limit:
+        # Dữ liệu bị cắt bởi limit: cửa sổ cuối chưa chắc đủ mẫu, để lần chạy sau nén
+        truncated = windows.pop()
+        logger.info(f"Sample limit {limit} reached, leaving segment {starts[truncated[0]]} for the next run")
+        if not windows:
+            logger.warning(f"A single {segment} segment has more than {limit} samples, "
+                           f"nothing compressed for device_id={device_id}; raise or remove the limit")
+    # Cửa sổ kết thúc sau giờ hiện tại của database là cửa sổ còn đang mở
+    now = database_now(engine)
+    compressor = LosslessCompressor(compressor_config)
+    compression_ids = []
+    for lo, hi in windows:
+        window_start = starts[lo].astype(datetime)
+        window_end = window_start + window
+        if window_start in done:
+            continue
+        if window_end > now:
+            logger.info(f"Skip open segment {window_start} - {window_end}")
+            continue
+        compression_result = compressor.compress(data[lo:hi])
+        compression_ids.append(save_optimized_compression_result(
+            engine,
+            device_id,
+            compression_result,
+            timestamps[lo:hi],
+            stream_format=stream_format,
+            post_stage=post_stage,
+            original_bytes=numeric_column_bytes(data[lo:hi]),
+            extra_metadata={
+                'segment': segment,
+                'segment_start': window_start.isoformat(),
+                'segment_end': window_end.isoformat()
+            }
+        ))
+        logger.info(f"Compressed segment {window_start} - {window_end}: {hi - lo} samples")
+    return compression_ids
+
+def get_compression_metrics(engine, compression_ids):
+    """Các chỉ số nén (trong compression_metadata) của các bản ghi vừa lưu"""
+    if not compression_ids:
+        return []
+    with engine.connect() as conn:
+        rows = conn.execute(
             text("""
-                UPDATE compressed_data_optimized
-                SET compression_metadata = :new_meta
-                WHERE id = (
-                    SELECT id FROM compressed_data_optimized
-                    WHERE device_id = :device_id
-                    ORDER BY id DESC LIMIT 1
-                )
+                SELECT id, compression_metadata
+                FROM compressed_data_optimized
+                WHERE id = ANY(:ids)
+                ORDER BY id
             """),
-            {"new_meta": json.dumps(meta), "device_id": device_id}
-        )
-        conn.commit()
-        logger.info(f"Updated compression_ratio={compression_ratio:.4f} for device_id={device_id}")
+            {"ids": list(compression_ids)}
+        ).fetchall()
+    keys = ('original_length', 'hit_ratio', 'compression_ratio', 'block_size', 'num_buffers',
+            'original_bytes', 'stored_bytes', 'post_stage', 'segment_start', 'segment_end')
+    metrics = []
+    for compression_id, meta in rows:
+        if isinstance(meta, str):
+            meta = json.loads(meta)
+        metrics.append({'compression_id': compression_id, **{k: meta.get(k) for k in keys if k in meta}})
+    return metrics
 
-    return compression_id
-
-def run_compression(device_id=None, limit=200000, output_file=None, 
+def run_compression(device_id=None, limit=None, output_file=None, 
                    visualize=False, output_dir=None, visualize_max_points=5000, 
-                   visualize_sampling='adaptive', visualize_chunks=0):
+                   visualize_sampling='adaptive', visualize_chunks=0, stream_format='binary',
+                   block_encoding='float', post_stage=None, segment=None, engine=None,
+                   replacement_policy='first_slot'):
+    """
+    Nén dữ liệu của device và lưu vào compressed_data_optimized
+
+    Dữ liệu gốc được đọc dần qua server-side cursor và đưa thẳng vào compressor theo
+    từng đoạn (LosslessCompressor.compress_chunks), không dựng DataFrame/list toàn chuỗi.
+
+    Args:
+        limit: Số mẫu tối đa (các mẫu sớm nhất), None = toàn bộ
+        replacement_policy: Chính sách thay thế buffer (xem replacement_policy.py)
+        engine: Engine dùng lại (vd. của ứng dụng, xem compression_jobs.py), mặc định tạo
+                mới từ DB_CONFIG; engine truyền vào phải đã qua ensure_optimized_schema
+
+    Returns:
+        compression_id, hoặc list compression_id của các segment mới khi có segment
+    """
     try:
-        engine = setup_optimized_database()
+        if engine is None:
+            engine = setup_optimized_database()
         if device_id:
             ensure_device_exists(engine, device_id)
-        data, timestamps = fetch_original_data(engine, device_id=device_id)
-        print("Data length:", len(data))
-        logger.info(f"Data length: {len(data)}")
-        if len(data) == 0:
-            raise ValueError("No data to compress")
-        compressor = LosslessCompressor()
+        if segment:
+            if not device_id:
+                raise ValueError("Segmented compression requires a device_id")
+            if post_stage is None:
+                post_stage = get_device_post_stage(engine, device_id) if stream_format == 'binary' else 'none'
+            compression_ids = run_segmented_compression(
+                engine, device_id, segment, {'block_encoding': block_encoding, 'replacement_policy': replacement_policy},
+                stream_format=stream_format, post_stage=post_stage, limit=limit
+            )
+            logger.info(f"Segmented compression completed. {len(compression_ids)} new segments")
+            return compression_ids
+        timestamp_chunks, value_chunks = [], []
+        original_bytes = 0
+
+        def values():
+            # Giữ timestamp (8 byte/mẫu) cho kênh timestamp, giá trị chỉ giữ khi cần vẽ biểu đồ
+            nonlocal original_bytes
+            for chunk_values, chunk_timestamps in iter_original_chunks(engine, device_id=device_id, limit=limit):
+                original_bytes += numeric_column_bytes(chunk_values)
+                timestamp_chunks.append(chunk_timestamps)
+                if visualize:
+                    value_chunks.append(chunk_values)
+                yield chunk_values
+
+        compressor = LosslessCompressor({'block_encoding': block_encoding, 'replacement_policy': replacement_policy})
         print("Block size:", compressor.block_size)
         logger.info(f"Block size: {compressor.block_size}")
-        compression_result = compressor.compress(data)
+        compression_result = compressor.compress_chunks(values())
+        print("Data length:", compression_result['original_length'])
+        logger.info(f"Data length: {compression_result['original_length']}")
+        if compression_result['original_length'] == 0:
+            raise ValueError("No data to compress")
+        timestamps = np.concatenate(timestamp_chunks)
+        data = np.concatenate(value_chunks) if visualize else None
+        if post_stage is None:
+            post_stage = get_device_post_stage(engine, device_id) if stream_format == 'binary' else 'none'
         compression_id = save_optimized_compression_result(
             engine, 
             device_id, 
             compression_result,
-            timestamps
+            timestamps,
+            stream_format=stream_format,
+            post_stage=post_stage,
+            original_bytes=original_bytes
         )
         logger.info(f"Compression completed. Compression ID: {compression_id}")
         if visualize:
+            # Import khi cần: matplotlib chỉ dùng cho biểu đồ, không cần cho việc nén
+            from visualization_analyzer import create_visualizations
             if not output_dir:
                 output_dir = f"visualization_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
             create_visualizations(
@@ -288,10 +573,131 @@ def run_compression(device_id=None, limit=200000, output_file=None,
         logger.error(traceback.format_exc())
         raise
 
+def list_devices_with_samples(engine):
+    """Các device có dữ liệu trong original_samples"""
+    with engine.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT d.device_id
+            FROM devices d
+            WHERE EXISTS (SELECT 1 FROM original_samples s WHERE s.device_id = d.device_id)
+            ORDER BY d.device_id
+        """)).fetchall()
+    return [row[0] for row in rows]
+
+_bulk_engine = None  # Engine của tiến trình worker nén hàng loạt
+
+def _init_bulk_worker(db_url):
+    """Khởi tạo tiến trình worker: một engine và bảng p-value KS cho mọi device mà tiến trình xử lý"""
+    global _bulk_engine
+    logging.getLogger().setLevel(logging.WARNING)
+    _bulk_engine = create_engine(db_url, pool_pre_ping=True)
+    LosslessCompressor().warm_pvalue_tables()
+
+def _bulk_compress_device(device_id, segment=None, options=None):
+    """Nén một device trong tiến trình worker, trả về chỉ số để tổng hợp"""
+    start = time.perf_counter()
+    result = run_compression(device_id=device_id, segment=segment, engine=_bulk_engine, **(options or {}))
+    compression_ids = result if isinstance(result, list) else [result]
+    records = get_compression_metrics(_bulk_engine, compression_ids)
+    return {
+        'compression_ids': compression_ids,
+        'samples': sum(r.get('original_length') or 0 for r in records),
+        'stored_bytes': sum(r.get('stored_bytes') or 0 for r in records),
+        'original_bytes': sum(r.get('original_bytes') or 0 for r in records),
+        'seconds': time.perf_counter() - start
+    }
+
+def run_bulk_compression(device_ids=None, parallel=1, retries=1, segment=None, queue_size=None,
+                         progress=None, db_url=None, **options):
+    """
+    Nén nhiều device song song trên ProcessPoolExecutor
+
+    Mỗi device là một task; số task đã đưa vào pool nhưng chưa xong giới hạn ở
+    queue_size (mặc định 2 * parallel) để không giữ hàng nghìn future cùng lúc. Device lỗi
+    được đưa lại vào hàng đợi tối đa retries lần. Worker được tạo bằng 'spawn' thay vì fork
+    vì hàm này còn chạy trong thread của tiến trình API (fork khi các thread khác đang giữ
+    lock, vd. của logging hay pool kết nối, có thể làm worker treo).
+
+    Args:
+        device_ids: Danh sách device, mặc định mọi device có dữ liệu
+        parallel: Số tiến trình worker
+        retries: Số lần thử lại mỗi device khi lỗi
+        segment: Nén theo cửa sổ (xem --segment)
+        queue_size: Số task tối đa đang chờ/chạy trong pool
+        progress: Callback progress(device_id, state) mỗi khi trạng thái device thay đổi
+        db_url: URL database cho worker (mặc định theo DB_CONFIG)
+        options: Tham số thêm cho run_compression (stream_format, block_encoding, post_stage, replacement_policy)
+
+    Returns:
+        Dict tổng hợp: số device thành công/lỗi, throughput (mẫu/giây), compression ratio tổng
+        và trạng thái từng device
+    """
+    if segment is not None and segment not in SEGMENT_WINDOWS:
+        raise ValueError(f"Segment không hợp lệ: {segment}")
+    db_url = db_url or database_url()
+    engine = create_engine(db_url)
+    ensure_optimized_schema(engine)
+    if device_ids is None:
+        device_ids = list_devices_with_samples(engine)
+    engine.dispose()
+    parallel = max(1, parallel)
+    queue_size = max(parallel, queue_size or 2 * parallel)
+    states = {device_id: {'status': 'pending', 'attempts': 0} for device_id in device_ids}
+
+    def update(device_id, **changes):
+        states[device_id].update(changes)
+        if progress:
+            progress(device_id, dict(states[device_id]))
+
+    pending = list(reversed(device_ids))  # pop() lấy theo thứ tự ban đầu
+    start = time.perf_counter()
+    with ProcessPoolExecutor(parallel, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_bulk_worker, initargs=(db_url,)) as executor:
+        running = {}
+        while pending or running:
+            while pending and len(running) < queue_size:
+                device_id = pending.pop()
+                running[executor.submit(_bulk_compress_device, device_id, segment, options)] = device_id
+                update(device_id, status='running', attempts=states[device_id]['attempts'] + 1)
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                device_id = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    if states[device_id]['attempts'] <= retries:
+                        logger.warning(f"[BULK] {device_id} failed (attempt {states[device_id]['attempts']}): {e}, retrying")
+                        update(device_id, status='retrying', error=str(e))
+                        pending.append(device_id)
+                    else:
+                        logger.error(f"[BULK] {device_id} failed after {states[device_id]['attempts']} attempts: {e}")
+                        update(device_id, status='failed', error=str(e))
+                    continue
+                update(device_id, status='succeeded', error=None, **result)
+                finished = sum(1 for state in states.values() if state['status'] in ('succeeded', 'failed'))
+                logger.info(f"[BULK] [{finished}/{len(states)}] {device_id}: {result['samples']} samples "
+                            f"in {result['seconds']:.2f}s")
+    elapsed = time.perf_counter() - start
+    succeeded = [state for state in states.values() if state['status'] == 'succeeded']
+    samples = sum(state['samples'] for state in succeeded)
+    stored_bytes = sum(state['stored_bytes'] for state in succeeded)
+    original_bytes = sum(state['original_bytes'] for state in succeeded)
+    return {
+        'devices': len(states),
+        'succeeded': len(succeeded),
+        'failed': len(states) - len(succeeded),
+        'samples': samples,
+        'seconds': elapsed,
+        'samples_per_second': samples / elapsed if elapsed > 0 else 0,
+        'compression_ratio': original_bytes / stored_bytes if stored_bytes else None,
+        'device_states': states
+    }
+
 def main():
     parser = argparse.ArgumentParser(description='Lossless compression of sensor data')
     parser.add_argument('--device-id', type=str, help='Device ID to compress')
-    parser.add_argument('--limit', type=int, default=200000, help='Maximum number of samples')
+    parser.add_argument('--limit', type=int, default=None,
+                      help='Maximum number of samples (earliest first); segment mode leaves a cut-off last window for the next run')
     parser.add_argument('--output', type=str, help='Output file for compression results')
     parser.add_argument('--visualize', action='store_true', help='Create visualizations')
     parser.add_argument('--output-dir', type=str, help='Directory for visualizations')
@@ -299,7 +705,43 @@ def main():
     parser.add_argument('--sampling', type=str, default='adaptive', choices=['adaptive', 'uniform'],
                       help='Sampling method for visualization')
     parser.add_argument('--chunks', type=int, default=0, help='Number of chunks for visualization')
+    parser.add_argument('--stream-format', type=str, default='binary', choices=['binary', 'json'],
+                      help='Storage format of encoded_stream (binary bytea or legacy JSONB)')
+    parser.add_argument('--block-encoding', type=str, default='float', choices=['float', 'varint'],
+                      help='Encoding of raw miss blocks (varint: delta-encoded value*100, lossless at 2 decimals)')
+    parser.add_argument('--replacement-policy', type=str, default='first_slot', choices=list(REPLACEMENT_POLICIES),
+                      help='Buffer overwritten on a miss with a full pool (first_slot keeps the original streams)')
+    parser.add_argument('--post-stage', type=str, default=None, choices=['none', 'zlib', 'lzma', 'range'],
+                      help='Secondary compression of the binary stream (default: the device\'s previous choice)')
+    parser.add_argument('--segment', type=str, default=None, choices=list(SEGMENT_WINDOWS),
+                      help='Compress fixed windows into separate rows, skipping windows already compressed')
+    parser.add_argument('--all-devices', action='store_true',
+                      help='Compress every device with samples (ignores --device-id)')
+    parser.add_argument('--parallel', type=int, default=1, help='Worker processes for --all-devices')
+    parser.add_argument('--retries', type=int, default=1, help='Retries per failed device for --all-devices')
     args = parser.parse_args()
+    if args.all_devices:
+        summary = run_bulk_compression(
+            parallel=args.parallel,
+            retries=args.retries,
+            segment=args.segment,
+            stream_format=args.stream_format,
+            block_encoding=args.block_encoding,
+            replacement_policy=args.replacement_policy,
+            post_stage=args.post_stage,
+            limit=args.limit
+        )
+        ratio = summary['compression_ratio']
+        print(f"Devices: {summary['succeeded']}/{summary['devices']} succeeded, {summary['failed']} failed")
+        print(f"Samples: {summary['samples']} in {summary['seconds']:.1f}s "
+              f"({summary['samples_per_second']:.0f} samples/s)")
+        print(f"Aggregate compression ratio: {ratio:.2f}" if ratio else "Aggregate compression ratio: n/a")
+        for device_id, state in summary['device_states'].items():
+            if state['status'] == 'failed':
+                print(f"  FAILED {device_id}: {state.get('error')}")
+        if summary['failed']:
+            sys.exit(1)
+        return
     run_compression(
         device_id=args.device_id,
         limit=args.limit,
@@ -308,7 +750,12 @@ def main():
         output_dir=args.output_dir,
         visualize_max_points=args.max_points,
         visualize_sampling=args.sampling,
-        visualize_chunks=args.chunks
+        visualize_chunks=args.chunks,
+        stream_format=args.stream_format,
+        block_encoding=args.block_encoding,
+        replacement_policy=args.replacement_policy,
+        post_stage=args.post_stage,
+        segment=args.segment
     )
 
 if __name__ == "__main__":
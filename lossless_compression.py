@@ -3,12 +3,19 @@
 
 import logging
 import numpy as np
-from scipy import stats
 from typing import List, Dict, Union, Tuple
 import time
 import json
 import os
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory
 from dotenv import load_dotenv
+from ks_matching import BufferPool, PairwiseKS, ks_pvalue, ks_2samp_equal, precompute_pvalue_tables
+from ring_buffer import RingBuffer
+from replacement_policy import ReplacementPolicy
+from stream_codec import pack_block
 
 # Cấu hình logging
 logging.basicConfig(
@@ -19,6 +26,39 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# Trạng thái trong tiến trình worker khi sampling bằng process pool
+_worker_compressor = None
+_worker_segment = None
+
+
+def _init_sampling_worker(config):
+    """Khởi tạo compressor riêng cho mỗi tiến trình worker (giữ cache PairwiseKS của worker)"""
+    global _worker_compressor
+    _worker_compressor = LosslessCompressor(config)
+
+
+def _simulate_in_worker(segment_name, length, block_size, origin):
+    """
+    Chạy simulate_compress trên cửa sổ nằm trong shared memory, không cần pickle dữ liệu
+
+    Returns:
+        ((compression_ratio, hit_count), bộ đếm PairwiseKS của lần gọi này) để tiến trình
+        chính cộng vào thống kê của nó
+    """
+    global _worker_segment
+    if _worker_segment is None or _worker_segment.name != segment_name:
+        if _worker_segment is not None:
+            _worker_segment.close()
+        _worker_segment = shared_memory.SharedMemory(name=segment_name)
+    data = np.ndarray((length,), dtype=float, buffer=_worker_segment.buf)
+    config = _worker_compressor.config
+    ks_stats = PairwiseKS.new_stats()
+    result = _worker_compressor.simulate_compress(
+        data, block_size, config['num_buffers'], config['similarity_threshold'], origin, ks_stats
+    )
+    return result, ks_stats
+
+
 class LosslessCompressor:
     BUFFER_OVERWRITE_MARKER = 0xFF
     BLOCKSIZE_CHANGE_MARKER = 0xFE
@@ -42,14 +82,34 @@ class LosslessCompressor:
             'sampling_trials': 2,       # Số vòng sampling
             'denial_window': 2,         # Không đổi block size nếu n mới nằm trong ±2 của n hiện tại
             'sampling_recent_size': 1000, # Số lượng giá trị gần nhất để sampling
-            'sampling_interval': 10     # Số block giữa 2 lần sampling, mặc định 10 cho dữ liệu nhỏ
+            'sampling_interval': 10,    # Số block giữa 2 lần sampling, mặc định 10 cho dữ liệu nhỏ
+            'ks_vectorized': True,      # So khớp KS theo lô (False: gọi ks_2samp từng cặp như cũ)
+            'sampling_workers': 1,      # Số worker đánh giá song song các block size ứng viên (1 = tuần tự)
+            'sampling_executor': 'thread',  # 'thread' hoặc 'process' (process pool + shared memory)
+            'sampling_parallel_min_size': 2000,  # Cửa sổ nhỏ hơn thì chạy tuần tự (chi phí điều phối lớn hơn lợi ích)
+            'sampling_cache_size': 256,  # Số kết quả (cửa sổ dữ liệu, n) được ghi nhớ khi sampling
+            'block_encoding': 'float',  # 'float' hoặc 'varint' (block miss thành số nguyên delta varint, xem stream_codec)
+            'block_decimals': 2,        # Số chữ số thập phân giữ lại khi block_encoding='varint' (NUMERIC(10,2))
+            'seek_interval': 64,        # Ghi một điểm seek index mỗi seek_interval block (0 = tắt)
+            # Buffer bị ghi đè khi pool đầy: first_slot, fifo, lru, lfu, aging (xem replacement_policy.py).
+            # first_slot giữ làm mặc định để tương thích stream: cùng dữ liệu cho stream giống hệt bản cũ
+            'replacement_policy': 'first_slot',
+            'aging_interval': 32,       # Số block giữa hai lần chia đôi số hit (replacement_policy='aging')
+            'probe_order': 'index',     # Thứ tự thử buffer khi so khớp: index, mru, frequency (xem BufferPool)
+            # Số điểm sketch (min, max, phân vị) của bộ lọc cận dưới trước KS (0 = tắt). Đường vector hóa
+            # chỉ lọc khi block size >= KSMatcher.PREFILTER_MIN_N (48), nên với block size mặc định
+            # (12-48) bộ lọc không có tác dụng; chỉ bật cho block size lớn hoặc ks_vectorized=False
+            'ks_prefilter_points': 0
         }
         
         if config:
             self.config.update(config)
         
         self.block_size = self.config['block_size']
-        self.buffers = []
+        self.buffers = BufferPool(self.config['num_buffers'], vectorized=self.config['ks_vectorized'],
+                                  probe_order=self.config['probe_order'],
+                                  sketch_points=self.config['ks_prefilter_points'])
+        self.replacement = self._new_replacement_policy()
         self.encoded_stream = []
         
         # Thêm các biến mới cho việc theo dõi và tạo biểu đồ
@@ -76,12 +136,57 @@ class LosslessCompressor:
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logging.DEBUG)
         
-        self.recent_data = []  # Lưu dữ liệu gần nhất để sampling block size
+        # Cache cho multistage sampling
+        self.pairwise_ks = PairwiseKS()  # Quyết định KS giữa các block, dùng lại giữa các lần sampling
+        self.sampling_memo = OrderedDict()  # (cửa sổ, n, ...) -> (compression_ratio, hit_count)
+        self._sampling_pool = None  # ProcessPoolExecutor, tạo khi cần
+        self._sampling_segment = None  # SharedMemory chứa cửa sổ sampling cho process pool
+        
+        self._reset_stream()
+        
+    def _reset_stream(self):
+        """Đưa trạng thái nén dòng (feed/flush) về đầu một stream mới"""
+        self.block_size = self.config['block_size']
+        self.buffers.clear()
+        self.buffers.reset_stats()
+        self.replacement.clear()
+        self.encoded_stream = []  # Token chưa được feed()/flush() trả về
+        self.recent_data = RingBuffer(self.config['sampling_recent_size'])  # Dữ liệu gần nhất để sampling block size
+        self.pairwise_ks.clear()
+        self.timings = self._new_timings()
+        self._pending = np.empty(0)  # Phần dữ liệu chưa đủ một block
+        self.stream_blocks = 0
+        self.stream_hits = 0
+        self.stream_length = 0
+        self.seek_index = []  # Điểm seek: vị trí token, vị trí mẫu, block_size, token của block trong từng buffer
+        self._slot_tokens = []  # Vị trí token của block đang nằm trong từng buffer
+        self._tokens_taken = 0  # Số token đã trả về qua feed()/flush()
+        self._samples_encoded = 0  # Số mẫu đã mã hóa thành block
+        
+    def _new_replacement_policy(self) -> ReplacementPolicy:
+        """Chính sách thay thế buffer theo cấu hình (mỗi pool, kể cả pool mô phỏng, có một trạng thái riêng)"""
+        return ReplacementPolicy(self.config['num_buffers'], self.config['replacement_policy'],
+                                 self.config['aging_interval'])
+
+    def warm_pvalue_tables(self):
+        """Tính trước bảng p-value KS cho mọi block size từ min_block_size tới max_block_size"""
+        precompute_pvalue_tables(min(self.config['min_block_size'], self.block_size),
+                                 max(self.config['max_block_size'], self.block_size))
+
+    def _new_timings(self):
+        """Bộ đếm thời gian/hiệu quả cache của sampling và encoding"""
+        return {
+            'sampling_seconds': 0.0,
+            'encoding_seconds': 0.0,
+            'sampling_rounds': 0,
+            'candidates_evaluated': 0,
+            'memo_hits': 0
+        }
         
     def reset(self):
         """Reset compressor về trạng thái ban đầu"""
         self.block_size = self.config['block_size']
-        self.buffers = []
+        self.buffers.clear()
         self.encoded_stream = []
         
         # Reset các biến theo dõi
@@ -93,6 +198,8 @@ class LosslessCompressor:
         self.similarity_scores = []
         self.cer_values = []
         
+        self.sampling_memo.clear()
+        self._reset_stream()
         
     def detect_trend(self, data: np.ndarray) -> str:
         """Phát hiện xu hướng trong dữ liệu: chỉ trả về 'up', 'down', 'stable'"""
@@ -154,7 +261,7 @@ class LosslessCompressor:
             return 0.0
             
         # Tính KS test
-        ks_stat, p_value = stats.ks_2samp(data1, data2)
+        ks_stat, p_value = ks_2samp_equal(data1, data2)
         ks_score = 1.0 - ks_stat if p_value > 0.05 else 0.0  # Sử dụng p-value 0.05 làm ngưỡng
         
         # Tính correlation
@@ -191,7 +298,7 @@ class LosslessCompressor:
             return False
             
         # Kiểm tra KS test
-        _, p_value = stats.ks_2samp(data1, data2)
+        _, p_value = ks_2samp_equal(data1, data2)
         if p_value < 0.05:  # Ngưỡng p-value cho KS test
             return False
             
@@ -441,70 +548,229 @@ class LosslessCompressor:
         # Chuẩn hóa về mean/scale trước khi so sánh
         block1_norm = (block1 - np.mean(block1)) / (np.std(block1) if np.std(block1) > 0 else 1)
         block2_norm = (block2 - np.mean(block2)) / (np.std(block2) if np.std(block2) > 0 else 1)
-        stat, p_value = stats.ks_2samp(block1_norm, block2_norm)
+        # Kernel cùng kích thước: cùng statistic/p-value với stats.ks_2samp, không qua đường tổng quát của SciPy
+        stat, p_value = ks_2samp_equal(block1_norm, block2_norm)
         # self.logger.info(f"[DEBUG] KS test (normalized): p_value={p_value:.4f}, block_norm={block1_norm.tolist()}, buf_norm={block2_norm.tolist()}")
         return p_value > self.config['similarity_threshold']
 
-    def encode_block(self, block):
-        miss_debug_info = []
-        for idx, buf in enumerate(self.buffers):
-            block_norm = (block - np.mean(block)) / (np.std(block) if np.std(block) > 0 else 1)
-            buf_norm = (buf - np.mean(buf)) / (np.std(buf) if np.std(buf) > 0 else 1)
-            stat, p_value = stats.ks_2samp(block_norm, buf_norm)
-            miss_debug_info.append(f"idx={idx}, p_value={p_value:.4f}")
-            if self.ks_exchangeable(block, buf):
-                self.encoded_stream.append(idx)
-                # self.logger.debug(f"[HIT][ENCODE_BLOCK] Sử dụng buffer idx={idx}, block={block.tolist()}")
-                return
+    def encode_block(self, block, idx=None, matched=False) -> bool:
+        """
+        Mã hóa một block vào encoded_stream (một lần so khớp duy nhất cho mỗi block)
+
+        Args:
+            block: Block dữ liệu cần mã hóa
+            idx: Buffer khớp đã tìm sẵn (None = miss), chỉ dùng khi matched=True
+            matched: True nếu việc so khớp đã làm bên ngoài (BatchCompressor so khớp theo lô)
+
+        Returns:
+            True nếu block khớp với một buffer (hit), False nếu miss
+        """
+        # So khớp block với toàn bộ buffer trong một lần gọi vector hóa
+        if not matched:
+            idx = self.buffers.find(block, self.config['similarity_threshold'])
+        if idx is not None:
+            self.encoded_stream.append(idx)
+            self.replacement.on_hit(idx)
+            # self.logger.debug(f"[HIT][ENCODE_BLOCK] Sử dụng buffer idx={idx}, block={block.tolist()}")
+            return True
+        # Vị trí token của block thô trong toàn stream (sau marker 0xFD), dùng cho seek index
+        block_token = self._tokens_taken + len(self.encoded_stream) + 1
         if len(self.buffers) < self.config['num_buffers']:
-            self.buffers.append(block.copy())
+            self.replacement.on_insert(self.buffers.append(block))
+            self._slot_tokens.append(block_token)
             # self.logger.debug(f"[MISS][ENCODE_BLOCK] Thêm buffer idx={len(self.buffers)-1}, block={block.tolist()}, buffers={self.buffers}")
         else:
             self.encoded_stream.append(self.BUFFER_OVERWRITE_MARKER)
-            overwrite_idx = 0  # FIFO: luôn ghi đè buffer đầu tiên
+            overwrite_idx = self.replacement.victim()  # Chỉ số ghi vào stream, decoder không cần chạy lại chính sách
             self.encoded_stream.append(overwrite_idx)
             # self.logger.debug(f"[MISS][ENCODE_BLOCK] Ghi đè buffer idx={overwrite_idx}, block={block.tolist()}, buffers={self.buffers}")
-            self.buffers[overwrite_idx] = block.copy()
+            self.buffers.overwrite(overwrite_idx, block)
+            self.replacement.on_insert(overwrite_idx)
+            self._slot_tokens[overwrite_idx] = block_token + 2
         self.encoded_stream.append(0xFD)
         self.encoded_stream.append(block.copy())
         # self.logger.debug(f"[MISS][ENCODE_BLOCK] Ghi block gốc vào stream, block={block.tolist()}")
+        return False
 
     def change_block_size(self, new_size):
         self.encoded_stream.append(self.BLOCKSIZE_CHANGE_MARKER)
         self.encoded_stream.append(new_size)
         self.logger.info(f"[BLOCKSIZE_CHANGE] Đổi block_size sang {new_size}, flush buffer")
         self.block_size = new_size
-        self.buffers = []
+        self.buffers.clear()
+        self.replacement.clear()
+        self._slot_tokens = []
+
+    def simulate_compress(self, data, block_size, num_buffers, similarity_threshold, origin=None, ks_stats=None):
+        """
+        Mô phỏng nén data với block_size cho trước (dùng khi sampling block size)
+
+        Args:
+            data: Cửa sổ dữ liệu
+            block_size: Kích thước block thử nghiệm
+            num_buffers: Số buffer
+            similarity_threshold: Ngưỡng p-value
+            origin: Vị trí tuyệt đối của data[0] trong dòng dữ liệu, để dùng lại quyết
+                KS của phần chồng lấn với lần sampling trước (None: không dùng lại)
+            ks_stats: Bộ đếm số cặp KS của lần gọi (PairwiseKS.new_stats()), mặc định
+                pairwise_ks.stats
+
+        Returns:
+            (compression_ratio, hit_count)
+        """
+        data = np.asarray(data, dtype=float)
+        if not self.config['ks_vectorized'] or not np.isfinite(data).all():
+            return self._simulate_compress_pool(data, block_size, num_buffers, similarity_threshold)
+        full_blocks = len(data) // block_size
+        decisions = self.pairwise_ks.decisions(data, block_size, similarity_threshold, origin, ks_stats).tolist()
+        buffers = []  # Chỉ số block (trong cửa sổ) đang nằm ở từng buffer
+        policy = self._new_replacement_policy()
+        stream_len = 0
+        hit_count = 0
+        for k in range(full_blocks):
+            row = decisions[k]
+            idx = next((i for i, b in enumerate(buffers) if row[b]), None)
+            if idx is not None:
+                stream_len += 1
+                hit_count += 1
+                policy.on_hit(idx)
+                continue
+            if len(buffers) < num_buffers:
+                buffers.append(k)
+                policy.on_insert(len(buffers) - 1)
+            else:
+                stream_len += 2  # BUFFER_OVERWRITE_MARKER + chỉ số
+                idx = policy.victim()
+                buffers[idx] = k
+                policy.on_insert(idx)
+            stream_len += 1
+        # Block cuối bị cắt ngắn (nếu có) so khớp trực tiếp với các buffer
+        tail = np.sort(data[full_blocks * block_size:])
+        if len(tail):
+            if any(ks_pvalue(tail, np.sort(data[b * block_size:(b + 1) * block_size])) > similarity_threshold
+                   for b in buffers):
+                hit_count += 1
+            elif len(buffers) >= num_buffers:
+                stream_len += 2
+            stream_len += 1
+        compression_ratio = len(data) / max(1, stream_len)
+        return compression_ratio, hit_count
 
-    def simulate_compress(self, data, block_size, num_buffers, similarity_threshold):
-        buffers = []
+    def _simulate_compress_pool(self, data, block_size, num_buffers, similarity_threshold):
+        """simulate_compress theo từng block với BufferPool (đường tham chiếu)"""
+        buffers = BufferPool(num_buffers, normalize=False, vectorized=self.config['ks_vectorized'],
+                             sketch_points=self.config['ks_prefilter_points'])  # So khớp trên dữ liệu thô
+        policy = self._new_replacement_policy()
         encoded_stream = []
         hit_count = 0
         for i in range(0, len(data), block_size):
             block = data[i:i+block_size]
-            matched = False
-            for idx, buf in enumerate(buffers):
-                stat, p_value = stats.ks_2samp(block, buf)
-                if p_value > similarity_threshold:
-                    encoded_stream.append(idx)
-                    hit_count += 1
-                    matched = True
-                    break
-            if not matched:
-                if len(buffers) < num_buffers:
-                    buffers.append(block.copy())
+            idx = buffers.find(block, similarity_threshold)
+            if idx is not None:
+                encoded_stream.append(idx)
+                hit_count += 1
+                policy.on_hit(idx)
+            else:
+                if not buffers.is_full():
+                    policy.on_insert(buffers.append(block))
                 else:
                     encoded_stream.append(self.BUFFER_OVERWRITE_MARKER)
-                    overwrite_idx = 0
+                    overwrite_idx = policy.victim()
                     encoded_stream.append(overwrite_idx)
-                    buffers[overwrite_idx] = block.copy()
+                    buffers.overwrite(overwrite_idx, block)
+                    policy.on_insert(overwrite_idx)
                 encoded_stream.append(block.copy())
         compression_ratio = len(data) / max(1, len(encoded_stream))
         return compression_ratio, hit_count
 
-    def multistage_blocksize_sampling(self, data):
-        import random
-        import numpy as np
+    def _evaluate_candidates(self, data, n_candidates, origin=None):
+        """
+        Đánh giá các block size ứng viên trên cùng cửa sổ data.
+        Kết quả được ghi nhớ theo (cửa sổ, n); các ứng viên chưa có được tính song song
+        nếu sampling_workers > 1.
+
+        Returns:
+            List (n, hit_ratio, compression_ratio) theo thứ tự n_candidates
+        """
+        num_buffers = self.config['num_buffers']
+        threshold = self.config['similarity_threshold']
+        digest = hashlib.blake2b(np.ascontiguousarray(data, dtype=float).data, digest_size=16).digest()
+        keys = {n: (digest, len(data), n, num_buffers, threshold) for n in n_candidates}
+        pending = [n for n in n_candidates if keys[n] not in self.sampling_memo]
+        self.timings['memo_hits'] += len(n_candidates) - len(pending)
+        self.timings['candidates_evaluated'] += len(pending)
+
+        def run(n):
+            # Bộ đếm riêng cho từng ứng viên: các thread không cùng cộng vào pairwise_ks.stats
+            ks_stats = PairwiseKS.new_stats()
+            return self.simulate_compress(data, n, num_buffers, threshold, origin, ks_stats), ks_stats
+
+        workers = self.config.get('sampling_workers', 1)
+        parallel = (workers > 1 and len(pending) > 1
+                    and len(data) >= self.config.get('sampling_parallel_min_size', 2000))
+        if parallel and self.config.get('sampling_executor', 'thread') == 'process':
+            computed = self._evaluate_in_processes(data, pending, origin)
+        elif parallel:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                computed = list(executor.map(run, pending))
+        else:
+            computed = [run(n) for n in pending]
+        for n, (value, ks_stats) in zip(pending, computed):
+            self.sampling_memo[keys[n]] = value
+            self.pairwise_ks.merge_stats(ks_stats)
+        while len(self.sampling_memo) > self.config.get('sampling_cache_size', 256):
+            self.sampling_memo.popitem(last=False)
+
+        results = []
+        for n in n_candidates:
+            self.sampling_memo.move_to_end(keys[n])
+            ratio, hit = self.sampling_memo[keys[n]]
+            num_blocks = len(data) // n if n > 0 else 1
+            hit_ratio = hit / num_blocks if num_blocks > 0 else 0.0
+            results.append((n, hit_ratio, ratio))
+        return results
+
+    def _evaluate_in_processes(self, data, n_candidates, origin=None):
+        """
+        Đánh giá các ứng viên trên process pool. Cửa sổ được ghi một lần vào shared
+        memory cho mỗi vòng sampling, mỗi task chỉ gửi tên segment, độ dài và n.
+
+        Returns:
+            List ((compression_ratio, hit_count), bộ đếm PairwiseKS) theo thứ tự n_candidates
+        """
+        size = len(data) * np.dtype(float).itemsize
+        if self._sampling_segment is None or self._sampling_segment.size < size:
+            self._release_sampling_segment()
+            capacity = max(len(data), self.config['sampling_recent_size']) * np.dtype(float).itemsize
+            self._sampling_segment = shared_memory.SharedMemory(create=True, size=capacity)
+        if self._sampling_pool is None:
+            self._sampling_pool = ProcessPoolExecutor(
+                max_workers=self.config['sampling_workers'],
+                initializer=_init_sampling_worker,
+                initargs=(self.config,)
+            )
+        window = np.ndarray((len(data),), dtype=float, buffer=self._sampling_segment.buf)
+        window[:] = data
+        futures = [
+            self._sampling_pool.submit(_simulate_in_worker, self._sampling_segment.name, len(data), n, origin)
+            for n in n_candidates
+        ]
+        return [future.result() for future in futures]
+
+    def _release_sampling_segment(self):
+        if self._sampling_segment is not None:
+            self._sampling_segment.close()
+            self._sampling_segment.unlink()
+            self._sampling_segment = None
+
+    def close(self):
+        """Giải phóng process pool và shared memory dùng cho sampling song song"""
+        if self._sampling_pool is not None:
+            self._sampling_pool.shutdown()
+            self._sampling_pool = None
+        self._release_sampling_segment()
+
+    def multistage_blocksize_sampling(self, data, origin=None):
         min_n = self.config['min_block_size']
         max_n = self.config['max_block_size']
         window = self.config.get('sampling_window', 5)
@@ -514,12 +780,7 @@ class LosslessCompressor:
         best_score = -1
         n_candidates = list(range(min_n, max_n+1, max(1, (max_n-min_n)//window)))
         for t in range(trials):
-            results = []
-            for n in n_candidates:
-                ratio, hit = self.simulate_compress(data, n, self.config['num_buffers'], self.config['similarity_threshold'])
-                num_blocks = len(data) // n if n > 0 else 1
-                hit_ratio = hit / num_blocks if num_blocks > 0 else 0.0
-                results.append((n, hit_ratio, ratio))
+            results = self._evaluate_candidates(data, n_candidates, origin)
             n_arr = np.array([x[0] for x in results])
             h_arr = np.array([x[1] for x in results])
             r_arr = np.array([x[2] for x in results])
@@ -535,49 +796,223 @@ class LosslessCompressor:
             self.logger.info(f"[BLOCKSIZE_SAMPLING] Không đổi block size (n đề xuất={int(best_n)}, denial window ±{denial_window})")
             return self.block_size
 
+    def _process_block(self, block, idx=None, matched=False):
+        """Mã hóa một block và chạy sampling block size theo chu kỳ (idx/matched: xem encode_block)"""
+        seek_interval = self.config['seek_interval']
+        if seek_interval and self.stream_blocks % seek_interval == 0:
+            # Trạng thái đủ để giải nén bắt đầu từ block này mà không cần các token trước
+            self.seek_index.append({
+                'token': self._tokens_taken + len(self.encoded_stream),
+                'sample': self._samples_encoded,
+                'block_size': self.block_size,
+                'buffers': list(self._slot_tokens)
+            })
+        self.recent_data.extend(block)
+        self._samples_encoded += len(block)
+        self.stream_blocks += 1
+        # Cùng một quyết định so khớp cho cả thống kê hit và token trong stream
+        if self.encode_block(block, idx, matched):
+            self.stream_hits += 1
+        # Sampling block size linh hoạt: từ block thứ 3 trở đi, lặp lại mỗi interval block
+        interval = self.config.get('sampling_interval', 10)
+        if self.stream_blocks >= 3 and self.stream_blocks % interval == 0:
+            sample_data = self.recent_data.view()  # View liên tục, không copy
+            sampling_start = time.perf_counter()
+            n_opt = self.multistage_blocksize_sampling(sample_data, origin=self.recent_data.total - len(sample_data))
+            self.timings['sampling_seconds'] += time.perf_counter() - sampling_start
+            self.timings['sampling_rounds'] += 1
+            if n_opt != self.block_size:
+                self.logger.info(f"[BLOCKSIZE_CHANGE] Đổi block size từ {self.block_size} -> {n_opt} tại block {self.stream_blocks}")
+                self.change_block_size(n_opt)
+
+    def _take_tokens(self) -> List:
+        """Lấy các token đã sinh ra kể từ lần trả về trước (đóng gói block miss nếu cấu hình)"""
+        tokens = self.encoded_stream
+        self.encoded_stream = []
+        self._tokens_taken += len(tokens)
+        if self.config['block_encoding'] == 'varint':
+            decimals = self.config['block_decimals']
+            for i, token in enumerate(tokens):
+                if isinstance(token, np.ndarray):
+                    # Block không biểu diễn đúng được với block_decimals thì giữ dạng float
+                    packed = pack_block(token, decimals)
+                    if packed is not None:
+                        tokens[i] = packed
+        return tokens
+
+    def feed(self, values) -> List:
+        """
+        Nén tiếp các giá trị mới theo kiểu dòng (streaming).
+
+        Compressor chỉ giữ buffer pool, cửa sổ sampling kích thước cố định và phần dữ
+        liệu chưa đủ một block, nên có thể nén liên tục khi mẫu mới tới. Nối các token
+        trả về từ feed()/flush() theo thứ tự được một encoded_stream giải nén được bằng
+        decompress_idealem.
+
+        Args:
+            values: Các giá trị mới (list hoặc mảng NumPy)
+
+        Returns:
+            Các token mới của encoded_stream
+        """
+        start = time.perf_counter()
+        sampling_before = self.timings['sampling_seconds']
+        values = np.asarray(values, dtype=float)
+        self.stream_length += len(values)
+        data = np.concatenate([self._pending, values]) if len(self._pending) else values
+        pos = 0
+        while len(data) - pos >= self.block_size:
+            block = data[pos:pos + self.block_size]
+            pos += len(block)
+            self._process_block(block)
+        self._pending = data[pos:].copy()
+        self.timings['encoding_seconds'] += (time.perf_counter() - start
+                                             - (self.timings['sampling_seconds'] - sampling_before))
+        return self._take_tokens()
+
+    def flush(self) -> List:
+        """
+        Mã hóa phần dữ liệu còn lại (block cuối ngắn hơn block_size) và kết thúc stream.
+        Lần feed() tiếp theo bắt đầu một stream mới.
+
+        Returns:
+            Các token còn lại của encoded_stream
+        """
+        try:
+            if len(self._pending):
+                block, self._pending = self._pending, np.empty(0)
+                start = time.perf_counter()
+                sampling_before = self.timings['sampling_seconds']
+                self._process_block(block)
+                self.timings['encoding_seconds'] += (time.perf_counter() - start
+                                                     - (self.timings['sampling_seconds'] - sampling_before))
+        finally:
+            # Process pool/shared memory của sampling chỉ sống trong một stream
+            self.close()
+        return self._take_tokens()
+
+    def begin_stream(self):
+        """
+        Bắt đầu một stream mới mà block do bên ngoài cắt sẵn (vd. BatchCompressor): gọi
+        encode_next() cho từng block theo block_size hiện tại rồi finish_stream().
+        """
+        self._reset_stream()
+
+    def encode_next(self, block, match=None, match_seconds: float = 0.0) -> bool:
+        """
+        Mã hóa block tiếp theo của stream (độ dài bằng block_size hiện tại) và chạy
+        sampling block size theo chu kỳ như feed()
+
+        Args:
+            block: Block dữ liệu tiếp theo
+            match: Kết quả so khớp đã làm bên ngoài (vd. ks_matching.find_in_pools với
+                self.buffers): chỉ số buffer khớp, -1 nếu miss; None để compressor tự so khớp
+            match_seconds: Thời gian so khớp bên ngoài, tính vào encoding_seconds
+
+        Returns:
+            True nếu block khớp với một buffer (hit), False nếu miss
+        """
+        start = time.perf_counter()
+        sampling_before = self.timings['sampling_seconds']
+        block = np.asarray(block, dtype=float)
+        self.stream_length += len(block)
+        hits_before = self.stream_hits
+        if match is None:
+            self._process_block(block)
+        else:
+            self._process_block(block, match if match >= 0 else None, matched=True)
+        self.timings['encoding_seconds'] += (match_seconds + time.perf_counter() - start
+                                             - (self.timings['sampling_seconds'] - sampling_before))
+        return self.stream_hits > hits_before
+
+    def finish_stream(self, tail=None) -> Dict:
+        """
+        Kết thúc stream bắt đầu bằng begin_stream(): phần còn lại ngắn hơn một block được
+        mã hóa như flush()
+
+        Args:
+            tail: Các giá trị còn lại (ít hơn block_size), có thể rỗng
+
+        Returns:
+            Dictionary kết quả như compress()
+        """
+        if tail is not None and len(tail):
+            tail = np.asarray(tail, dtype=float)
+            self.stream_length += len(tail)
+            self._pending = tail.copy()
+        encoded_stream = self._take_tokens()
+        encoded_stream.extend(self.flush())
+        return self._stream_result(encoded_stream)
+
+    def stream_summary(self) -> Dict:
+        """
+        Thông tin của stream hiện tại (dùng làm compression_metadata)
+
+        Returns:
+            Dictionary block_size, num_buffers, block_encoding, original_length, hit_ratio,
+            replacement_policy (và aging_interval nếu có), timings
+        """
+        self.timings.update(self.pairwise_ks.stats)
+        # Số phép KS trung bình mỗi block (probe_order mru/frequency dừng sớm khi khớp) và số
+        # phép KS chính xác tránh được nhờ bộ lọc cận dưới
+        self.timings.update(self.buffers.counters())
+        lookups = self.buffers.stats['lookups']
+        self.timings['avg_probes'] = self.buffers.stats['ks_tests'] / lookups if lookups else 0.0
+        return {
+            'block_size': self.block_size,
+            'num_buffers': self.config['num_buffers'],
+            'block_encoding': self.config['block_encoding'],
+            'original_length': self.stream_length,
+            'hit_ratio': self.stream_hits / self.stream_blocks if self.stream_blocks > 0 else 0.0,
+            **self.replacement.describe(),
+            'timings': dict(self.timings)
+        }
+
     def compress(self, data: np.ndarray, timestamps=None) -> Dict:
         # print("Dữ liệu gốc:", data[:self.block_size].tolist())
-        self.encoded_stream = []
-        self.buffers = []
-        hit_count = 0
-        total_blocks = 0
-        self.recent_data = []  # Reset recent_data mỗi lần nén mới
-        interval = self.config.get('sampling_interval', 10)
-        for i in range(0, len(data), self.block_size):
-            block = data[i:i+self.block_size]
-            self.recent_data.extend(block.tolist())
-            if len(self.recent_data) > self.config['sampling_recent_size']:
-                self.recent_data = self.recent_data[-self.config['sampling_recent_size']:]
-            matched = False
-            for idx, buf in enumerate(self.buffers):
-                block_norm = (block - np.mean(block)) / (np.std(block) if np.std(block) > 0 else 1)
-                buf_norm = (buf - np.mean(buf)) / (np.std(buf) if np.std(buf) > 0 else 1)
-                stat, p_value = stats.ks_2samp(block_norm, buf_norm)
-                if p_value > self.config['similarity_threshold']:
-                    hit_count += 1
-                    matched = True
-                    break
-            total_blocks += 1
-            self.encode_block(block)
-            # Sampling block size linh hoạt: từ block thứ 3 trở đi, lặp lại mỗi interval block
-            if total_blocks >= 3 and total_blocks % interval == 0:
-                # Nếu tổng số block nhỏ, sampling trên toàn bộ recent_data
-                if total_blocks < 100:
-                    sample_data = np.array(self.recent_data)
-                else:
-                    sample_data = np.array(self.recent_data[-self.config['sampling_recent_size']:])
-                n_opt = self.multistage_blocksize_sampling(sample_data)
-                if n_opt != self.block_size:
-                    self.logger.info(f"[BLOCKSIZE_CHANGE] Đổi block size từ {self.block_size} -> {n_opt} tại block {total_blocks}")
-                    self.change_block_size(n_opt)
-        hit_ratio = hit_count / total_blocks if total_blocks > 0 else 0.0
+        return self.compress_chunks([data])
+
+    def compress_chunks(self, chunks) -> Dict:
+        """
+        Nén dữ liệu tới theo từng đoạn (vd. đọc dần từ server-side cursor) mà không cần
+        nối toàn bộ chuỗi trước; kết quả giống compress() trên chuỗi đã nối.
+
+        Args:
+            chunks: Iterable các mảng giá trị theo thứ tự thời gian
+
+        Returns:
+            Dictionary kết quả như compress()
+        """
+        self._reset_stream()
+        encoded_stream = []
+        try:
+            for chunk in chunks:
+                encoded_stream.extend(self.feed(chunk))
+            encoded_stream.extend(self.flush())
+        finally:
+            self.close()
+        return self._stream_result(encoded_stream)
+
+    def _stream_result(self, encoded_stream) -> Dict:
+        """Kết quả nén (như compress()) của stream vừa kết thúc bằng flush()"""
+        self.encoded_stream = encoded_stream
+        summary = self.stream_summary()
         compression_ratio = 0  # Đặt compression_ratio = 0, sẽ tính sau khi lưu vào DB
-        self.logger.info(f"[SUMMARY] Tổng số block: {total_blocks}, Hit: {hit_count}, Hit ratio: {hit_ratio:.4f}")
+        self.logger.info(f"[SUMMARY] Tổng số block: {self.stream_blocks}, Hit: {self.stream_hits}, Hit ratio: {summary['hit_ratio']:.4f}")
+        self.logger.info(f"[TIMING] sampling={self.timings['sampling_seconds']:.3f}s ({self.timings['sampling_rounds']} lần, "
+                         f"{self.timings['candidates_evaluated']} ứng viên, {self.timings['memo_hits']} memo hit), "
+                         f"encoding={self.timings['encoding_seconds']:.3f}s, {self.timings['avg_probes']:.2f} phép KS/block")
         return {
             'encoded_stream': self.encoded_stream,
-            'block_size': self.block_size,
-            'num_buffers': self.config['num_buffers'],
-            'original_length': len(data),
-            'hit_ratio': hit_ratio,
-            'compression_ratio': compression_ratio
+            'block_size': summary['block_size'],
+            'num_buffers': summary['num_buffers'],
+            'block_encoding': summary['block_encoding'],
+            'original_length': summary['original_length'],
+            'hit_ratio': summary['hit_ratio'],
+            'compression_ratio': compression_ratio,
+            'seek_index': self.seek_index,
+            'seek_interval': self.config['seek_interval'],
+            'replacement_policy': summary['replacement_policy'],
+            'aging_interval': summary.get('aging_interval'),
+            'timings': summary['timings']
         } 
\ No newline at end of file
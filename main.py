@@ -10,7 +10,7 @@ from database import engine, get_db, init_db
 import os
 from sqlalchemy import text
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 import jwt
 from config import settings
 from fastapi.security import OAuth2PasswordBearer
@@ -26,7 +26,10 @@ from user_action.control_device import control_device
 # Import các module từ admin_action
 from admin_action.add_device import add_device as admin_add_device
 from admin_action.delete_device import delete_device as admin_delete_device
-from admin_action.save_data import save_data as admin_save_data, decompress_device_data
+from admin_action.save_data import (save_data as admin_save_data, decompress_device_data, decompress_range,
+                                    stream_device_data, STREAM_MEDIA_TYPES,
+                                    export_device_columns, COLUMNAR_MEDIA_TYPES, ARROW_AVAILABLE)
+from compression_jobs import CompressionJobService
 
 # Cấu hình logging
 logging.basicConfig(level=logging.INFO)
@@ -89,6 +92,9 @@ except ImportError:
     has_device_adder = False
     logger.warning("Could not import device adder module. Device adding features will be limited.")
 
+# Job nén chạy trong tiến trình, dùng lại engine của ứng dụng (pool tạo khi có job đầu tiên)
+compression_jobs = CompressionJobService(engine, settings.COMPRESSION_WORKERS, settings.COMPRESSION_EXECUTOR)
+
 # Sự kiện khởi động ứng dụng
 @app.on_event("startup")
 async def startup_event():
@@ -105,6 +111,7 @@ async def shutdown_event():
     Sự kiện khi ứng dụng đang dừng
     """
     logger.info("Ứng dụng đang dừng...")
+    compression_jobs.shutdown(wait=False)
 
 class UserCreate(BaseModel):
     username: str
@@ -136,9 +143,22 @@ class AdminDeleteDeviceRequest(BaseModel):
 
 class AdminSaveDataRequest(BaseModel):
     device_id: str
+    segment: Optional[str] = None  # 'hour', 'day' hoặc 'week': nén theo cửa sổ, mỗi cửa sổ một bản ghi
+
+class AdminBulkSaveDataRequest(BaseModel):
+    device_ids: Optional[List[str]] = None  # None: mọi device có dữ liệu
+    parallel: int = Field(1, ge=1, le=32)  # Số tiến trình nén song song
+    retries: int = Field(1, ge=0, le=5)  # Số lần thử lại mỗi device khi lỗi
+    segment: Optional[str] = None
 
 class AdminDecompressRequest(BaseModel):
     device_id: str
+    start_time: Optional[datetime] = None  # Chỉ giải nén khoảng thời gian [start_time, end_time]
+    end_time: Optional[datetime] = None
+    # Response dạng stream (giải nén và serialize theo từng block): 'ndjson', 'json' hoặc 'csv'
+    format: Optional[str] = None
+    offset: int = Field(0, ge=0)  # Bỏ qua offset mẫu đầu tiên (dùng với format hoặc Accept dạng cột)
+    limit: Optional[int] = Field(None, ge=0)  # Số mẫu tối đa (dùng với format hoặc Accept dạng cột)
 
 @app.post("/register/", response_model=dict)
 def register(user: UserCreate, db: Session = Depends(get_db)):
@@ -516,19 +536,77 @@ def admin_save_data_endpoint(
     current_user: models.User = Depends(require_admin)
 ):
     logger.info(f"[ADMIN] User {current_user.username} (id={current_user.id}) SAVE_DATA device_id={req.device_id}")
-    result = admin_save_data(req.device_id)
+    result = admin_save_data(compression_jobs, req.device_id, segment=req.segment)
     if not result["success"]:
         logger.error(f"[ADMIN][SAVE_DATA FAIL] {result['message']}")
         raise HTTPException(status_code=400, detail=result["message"])
-    logger.info(f"[ADMIN][SAVE_DATA OK] {result['message']}")
+    logger.info(f"[ADMIN][SAVE_DATA OK] {result['message']} job_id={result['job_id']}")
     return result
 
+@app.post("/admin/save-data/bulk")
+def admin_bulk_save_data_endpoint(
+    req: AdminBulkSaveDataRequest,
+    current_user: models.User = Depends(require_admin)
+):
+    logger.info(f"[ADMIN] User {current_user.username} (id={current_user.id}) BULK SAVE_DATA "
+                f"devices={req.device_ids or 'all'} parallel={req.parallel}")
+    if req.segment is not None:
+        from loss_compress import SEGMENT_WINDOWS  # Import khi cần, API khởi động không nạp scipy
+        if req.segment not in SEGMENT_WINDOWS:
+            raise HTTPException(status_code=422, detail=f"segment phải là một trong {list(SEGMENT_WINDOWS)}")
+    job_id = compression_jobs.submit_bulk(req.device_ids, parallel=req.parallel, retries=req.retries,
+                                          segment=req.segment)
+    return {"success": True, "message": "Đã tạo job nén hàng loạt", "job_id": job_id}
+
+@app.get("/admin/jobs/{job_id}")
+def admin_job_status_endpoint(
+    job_id: str,
+    current_user: models.User = Depends(require_admin)
+):
+    job = compression_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Không tìm thấy job {job_id}")
+    return job
+
+def columnar_format_from_accept(accept: Optional[str]) -> Optional[str]:
+    """Định dạng cột nhị phân ('npy'/'arrow') được yêu cầu trong header Accept, None nếu không có"""
+    if not accept:
+        return None
+    requested = [part.split(';')[0].strip().lower() for part in accept.split(',')]
+    for fmt, media_type in COLUMNAR_MEDIA_TYPES.items():
+        if media_type in requested:
+            return fmt
+    return None
+
 @app.post("/admin/decompress")
 def admin_decompress_endpoint(
     req: AdminDecompressRequest,
+    request: Request,
     current_user: models.User = Depends(require_admin)
 ):
-    data, error = decompress_device_data(req.device_id)
+    # Accept: application/x-npy (hai mảng .npy: timestamp epoch ms, giá trị) hoặc
+    # application/vnd.apache.arrow.stream (cần pyarrow) trả về dạng cột nhị phân
+    columnar = columnar_format_from_accept(request.headers.get('accept'))
+    if columnar:
+        if columnar == 'arrow' and not ARROW_AVAILABLE:
+            raise HTTPException(status_code=406, detail="Server chưa cài pyarrow, dùng application/x-npy")
+        chunks, error = export_device_columns(req.device_id, columnar, req.start_time, req.end_time,
+                                              req.offset, req.limit)
+        if error:
+            raise HTTPException(status_code=404, detail=error)
+        return StreamingResponse(chunks, media_type=COLUMNAR_MEDIA_TYPES[columnar])
+    if req.format or req.offset or req.limit is not None:
+        fmt = req.format or 'json'
+        if fmt not in STREAM_MEDIA_TYPES:
+            raise HTTPException(status_code=400, detail=f"format phải là một trong {list(STREAM_MEDIA_TYPES)}")
+        chunks, error = stream_device_data(req.device_id, fmt, req.start_time, req.end_time, req.offset, req.limit)
+        if error:
+            raise HTTPException(status_code=404, detail=error)
+        return StreamingResponse(chunks, media_type=STREAM_MEDIA_TYPES[fmt])
+    if req.start_time or req.end_time:
+        data, error = decompress_range(req.device_id, req.start_time, req.end_time)
+    else:
+        data, error = decompress_device_data(req.device_id)
     if error:
         raise HTTPException(status_code=404, detail=error)
     return {"device_id": req.device_id, "data": data} 
@@ -5,7 +5,7 @@ Models cho các bảng dữ liệu trong hệ thống.
 Các lớp này định nghĩa cấu trúc dữ liệu cho SQLAlchemy ORM.
 """
 
-from sqlalchemy import Column, Integer, String, ForeignKey, Float, DateTime, Boolean, Text, Numeric, UniqueConstraint, CheckConstraint, ForeignKeyConstraint
+from sqlalchemy import Column, Integer, String, ForeignKey, Float, DateTime, Boolean, Text, Numeric, LargeBinary, UniqueConstraint, CheckConstraint, ForeignKeyConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import JSONB, TSRANGE
@@ -105,7 +105,10 @@ class CompressedDataOptimized(Base):
     Bảng chứa dữ liệu nén theo cấu trúc tối ưu mới.
     Mỗi bản ghi chứa đầy đủ thông tin về quá trình nén, bao gồm:
     - compression_metadata: Metadata của quá trình nén (tỷ lệ nén, hit ratio, v.v.)
-    - encoded_stream: Chuỗi mã hóa chứa thông tin về cách sử dụng các template
+    - encoded_stream: Chuỗi mã hóa chứa thông tin về cách sử dụng các template (JSONB, bản ghi cũ)
+    - encoded_stream_bin: Chuỗi mã hóa dạng container nhị phân (stream_codec.py)
+    - seek_index: Điểm seek để giải nén một khoảng thời gian mà không giải cả stream
+    - timestamp_channel: Timestamp thật của từng mẫu (delta-of-delta + run-length)
     - time_range: Phạm vi thời gian của dữ liệu được nén
     """
     __tablename__ = "compressed_data_optimized"
@@ -114,6 +117,9 @@ class CompressedDataOptimized(Base):
     device_id = Column(String, ForeignKey("devices.device_id"))
     compression_metadata = Column(JSONB, comment="Lưu thông tin nén (compression_ratio, hit_ratio, etc)")
     encoded_stream = Column(JSONB, comment="Lưu chuỗi mã hóa")
+    encoded_stream_bin = Column(LargeBinary, comment="Lưu chuỗi mã hóa dạng nhị phân")
+    seek_index = Column(LargeBinary, comment="Seek index của encoded_stream")
+    timestamp_channel = Column(LargeBinary, comment="Timestamp thật của từng mẫu")
     time_range = Column(TSRANGE, comment="Phạm vi thời gian của dữ liệu", index=True)
     
     # Relationship
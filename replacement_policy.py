@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chính sách thay thế buffer của IDEALEM khi pool đầy và block mới là miss.
+
+    first_slot : luôn ghi đè buffer 0 (cách cũ, giữ nguyên stream của dữ liệu đã nén)
+    fifo       : round-robin, ghi đè buffer được đưa vào sớm nhất
+    lru        : ghi đè buffer lâu nhất không được dùng (hit hoặc vừa đưa vào)
+    lfu        : ghi đè buffer ít hit nhất (hòa thì buffer lâu nhất không được dùng)
+    aging      : như lfu nhưng số hit của mọi buffer bị chia đôi mỗi aging_interval block,
+                 buffer từng hit nhiều trong quá khứ không giữ chỗ mãi
+
+Mỗi buffer chỉ giữ vài số nguyên (lần dùng cuối, số hit) cập nhật O(1) mỗi block; chọn
+buffer bị ghi đè duyệt qua num_buffers phần tử (num_buffers nhỏ, mặc định 16).
+
+Chỉ số buffer bị ghi đè luôn được ghi vào stream (0xFF, idx) nên decoder không cần chạy
+lại chính sách: trạng thái buffer khi giải nén (kể cả từ điểm seek) giống hệt phía nén.
+Tên chính sách và tham số được lưu trong compression_metadata để biết stream được sinh
+thế nào và nén lại cho cùng kết quả.
+"""
+
+import numpy as np
+
+REPLACEMENT_POLICIES = ('first_slot', 'fifo', 'lru', 'lfu', 'aging')
+
+
+class ReplacementPolicy:
+    """Trạng thái của chính sách thay thế cho một buffer pool"""
+
+    def __init__(self, capacity: int, name: str = 'first_slot', aging_interval: int = 32):
+        """
+        Args:
+            capacity: Số buffer tối đa
+            name: Tên chính sách (xem REPLACEMENT_POLICIES)
+            aging_interval: Số block giữa hai lần chia đôi số hit (chính sách 'aging')
+        """
+        if name not in REPLACEMENT_POLICIES:
+            raise ValueError(f"Chính sách thay thế không hợp lệ: {name}")
+        self.capacity = capacity
+        self.name = name
+        self.aging_interval = max(1, aging_interval)
+        self.last_used = np.zeros(capacity, dtype=np.int64)
+        self.hits = np.zeros(capacity, dtype=np.int64)
+        self.clear()
+
+    def clear(self):
+        """Xóa trạng thái (dùng khi pool bị xóa, vd. đổi block size)"""
+        self.clock = 0  # Số block đã xử lý (mỗi block là một hit hoặc một lần đưa vào)
+        self.next_slot = 0  # Con trỏ round-robin của 'fifo'
+        self.last_used[:] = 0
+        self.hits[:] = 0
+
+    def _tick(self):
+        self.clock += 1
+        if self.name == 'aging' and self.clock % self.aging_interval == 0:
+            self.hits >>= 1
+
+    def on_hit(self, idx: int):
+        """Block hiện tại khớp buffer idx"""
+        self._tick()
+        self.last_used[idx] = self.clock
+        self.hits[idx] += 1
+
+    def on_insert(self, idx: int):
+        """Block miss được đưa vào buffer idx (thêm mới hoặc ghi đè)"""
+        self._tick()
+        self.last_used[idx] = self.clock
+        self.hits[idx] = 0
+
+    def victim(self) -> int:
+        """Buffer bị ghi đè khi pool đầy"""
+        if self.name == 'first_slot':
+            return 0
+        if self.name == 'fifo':
+            idx = self.next_slot
+            self.next_slot = (idx + 1) % self.capacity
+            return idx
+        if self.name == 'lru':
+            return int(np.argmin(self.last_used))
+        # lfu/aging: ít hit nhất, hòa thì lâu nhất không được dùng
+        candidates = np.flatnonzero(self.hits == self.hits.min())
+        return int(candidates[np.argmin(self.last_used[candidates])])
+
+    def describe(self) -> dict:
+        """Tên và tham số của chính sách (lưu vào compression_metadata)"""
+        info = {'replacement_policy': self.name}
+        if self.name == 'aging':
+            info['aging_interval'] = self.aging_interval
+        return info
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ring buffer NumPy cấp phát trước cho cửa sổ dữ liệu gần nhất (dùng khi sampling block size).
+
+Dữ liệu nằm trong một mảng gấp đôi dung lượng: giá trị mới được ghi nối tiếp, khi hết
+chỗ thì dời `capacity` giá trị cuối về đầu mảng (một lần copy cho mỗi `capacity` giá
+trị được thêm). Nhờ vậy cửa sổ hiện tại luôn là một đoạn liên tục và view() không
+cần copy.
+"""
+
+import numpy as np
+
+
+class RingBuffer:
+    """Cửa sổ `capacity` giá trị gần nhất với view liên tục không copy"""
+
+    def __init__(self, capacity: int, dtype=float):
+        """
+        Args:
+            capacity: Số giá trị tối đa giữ lại
+            dtype: Kiểu dữ liệu của mảng
+        """
+        self.capacity = capacity
+        self._data = np.empty(2 * capacity, dtype=dtype)
+        self._end = 0  # Vị trí sau giá trị cuối cùng trong _data
+        self._size = 0
+        self.total = 0  # Tổng số giá trị đã thêm (vị trí tuyệt đối của giá trị kế tiếp)
+
+    def __len__(self):
+        return self._size
+
+    def clear(self):
+        """Xóa toàn bộ dữ liệu"""
+        self._end = 0
+        self._size = 0
+        self.total = 0
+
+    def extend(self, values):
+        """
+        Thêm các giá trị mới, giá trị cũ nhất bị loại khi vượt quá capacity
+
+        Args:
+            values: Mảng hoặc list giá trị
+        """
+        values = np.asarray(values, dtype=self._data.dtype).ravel()
+        count = len(values)
+        self.total += count
+        if count >= self.capacity:
+            self._data[:self.capacity] = values[-self.capacity:]
+            self._end = self._size = self.capacity
+            return
+        if self._end + count > len(self._data):
+            # Dời phần còn giữ lại về đầu mảng để có chỗ ghi tiếp
+            keep = min(self._size, self.capacity - count)
+            self._data[:keep] = self._data[self._end - keep:self._end]
+            self._end = self._size = keep
+        self._data[self._end:self._end + count] = values
+        self._end += count
+        self._size = min(self._size + count, self.capacity)
+
+    def view(self) -> np.ndarray:
+        """
+        Cửa sổ hiện tại (cũ -> mới) dưới dạng view chỉ đọc, không copy.
+        View chỉ còn đúng đến lần extend() tiếp theo.
+        """
+        window = self._data[self._end - self._size:self._end]
+        window.setflags(write=False)
+        return window
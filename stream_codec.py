@@ -0,0 +1,500 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Định dạng nhị phân có phiên bản cho encoded_stream của IDEALEM.
+
+encoded_stream gốc là list trộn lẫn token số nguyên (marker 0xFD/0xFE/0xFF, chỉ số
+buffer, block size mới) và block giá trị thô (list float). Lưu dạng JSONB vừa lớn vừa
+chậm parse, nên container nhị phân tách thành ba mảng liên tục:
+
+    header   : magic b'IDLM', version, độ rộng token, codec giá trị, số chữ số thập phân,
+               số token, số block (struct '<4sBBBBII')
+    tokens   : toàn bộ token số nguyên theo thứ tự (uint8, hoặc uint16 khi có token >= 256)
+    lengths  : độ dài từng block thô (uint16), block luôn đứng ngay sau marker 0xFD
+    values   : giá trị của mọi block nối liền, theo codec:
+               float64 / float32 / int16 hoặc int32 đã nhân 10**decimals
+
+Dữ liệu gốc là NUMERIC(10,2) nên codec 'auto' chọn int16 (hoặc int32) nhân 100 khi
+việc nhân/chia giữ đúng từng giá trị float64, ngược lại giữ float64. float32 chỉ dùng
+khi chỉ định rõ vì làm tròn giá trị.
+
+Block thô còn có thể được compressor đóng gói sẵn (block_encoding='varint', xem
+pack_block): bytes gồm số chữ số thập phân rồi các varint zigzag của giá trị đầu và
+các hiệu liên tiếp sau khi nhân 10**decimals. Khi mọi block đều là bytes, container dùng
+codec 'varint' và lengths là số byte của từng block. Trong JSON, block bytes được ghi
+dạng chuỗi base64.
+
+Tầng nén thứ cấp (post stage) tùy chọn bọc container trong b'IDLP' + mã stage + độ dài
+container gốc (struct '<4sBI'):
+    zlib, lzma : nén toàn bộ container bằng thư viện chuẩn
+    range      : chỉ mảng token được mã hóa bằng range coder thích nghi bậc 1
+                 (entropy_coding.py), header và block thô giữ nguyên
+
+Kênh timestamp (encode_timestamps): b'IDLT', version, số mẫu, timestamp đầu tiên (µs từ
+epoch, struct '<4sBIq'), rồi các cặp varint zigzag (giá trị, số lần lặp) của delta-of-delta
+giữa các timestamp. Chuỗi đều 5 phút chỉ còn hai cặp (delta đầu, 1) và (0, n - 2).
+
+Seek index (encode_seek_index) lưu riêng cạnh stream: b'IDLS', version, số cột buffer,
+số điểm (struct '<4sBII'), rồi ma trận int32 nén zlib, mỗi hàng là vị trí token, vị trí
+mẫu, block_size và vị trí token của block trong từng buffer (-1 nếu buffer trống).
+"""
+
+import json
+import lzma
+import zlib
+import base64
+import struct
+import numpy as np
+
+from entropy_coding import range_encode, range_decode
+
+FORMAT_MAGIC = b'IDLM'
+FORMAT_VERSION = 1
+FORMAT_NAME = f'idealem-bin/{FORMAT_VERSION}'
+
+BLOCK_MARKER = 0xFD
+BLOCKSIZE_CHANGE_MARKER = 0xFE
+BUFFER_OVERWRITE_MARKER = 0xFF
+
+_HEADER = struct.Struct('<4sBBBBII')
+
+# Mã codec giá trị trong header
+VALUE_CODECS = {'float64': 0, 'float32': 1, 'int16': 2, 'int32': 3, 'varint': 4}
+_CODEC_NAMES = {code: name for name, code in VALUE_CODECS.items()}
+_CODEC_DTYPES = {'float64': '<f8', 'float32': '<f4', 'int16': '<i2', 'int32': '<i4'}
+
+POST_STAGE_MAGIC = b'IDLP'
+_POST_HEADER = struct.Struct('<4sBI')
+_RANGE_LENGTH = struct.Struct('<I')
+
+# Mã tầng nén thứ cấp ('none' không bọc container)
+POST_STAGES = {'none': 0, 'zlib': 1, 'lzma': 2, 'range': 3}
+_POST_STAGE_NAMES = {code: name for name, code in POST_STAGES.items()}
+
+
+def _zigzag_varints(ints) -> bytes:
+    """Mã hóa mảng int64 thành chuỗi varint (LEB128) của giá trị zigzag"""
+    ints = np.asarray(ints, dtype=np.int64)
+    z = ((ints << 1) ^ (ints >> 63)).view(np.uint64)
+    nbytes = np.ones(len(z), dtype=np.int64)
+    for k in range(1, 10):
+        nbytes += z >= np.uint64(1 << (7 * k))
+    starts = np.concatenate(([0], np.cumsum(nbytes)[:-1]))
+    out = np.zeros(int(nbytes.sum()), dtype=np.uint8)
+    for j in range(int(nbytes.max()) if len(z) else 0):
+        mask = nbytes > j
+        chunk = (z[mask] >> np.uint64(7 * j)) & np.uint64(0x7F)
+        more = np.where(nbytes[mask] - 1 > j, 0x80, 0).astype(np.uint64)
+        out[starts[mask] + j] = (chunk | more).astype(np.uint8)
+    return out.tobytes()
+
+
+def _unzigzag_varints(data) -> np.ndarray:
+    """Giải chuỗi varint zigzag về mảng int64"""
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if len(raw) == 0:
+        return np.empty(0, dtype=np.int64)
+    ends = raw < 0x80
+    if not ends[-1]:
+        raise ValueError("Varint bị cắt cụt")
+    starts = np.flatnonzero(np.concatenate(([True], ends[:-1])))
+    value_idx = np.cumsum(ends) - ends
+    shift = (np.arange(len(raw)) - starts[value_idx]) * 7
+    parts = (raw & 0x7F).astype(np.uint64) << shift.astype(np.uint64)
+    z = np.bitwise_or.reduceat(parts, starts)
+    return (z >> np.uint64(1)).astype(np.int64) ^ -(z & np.uint64(1)).astype(np.int64)
+
+
+def pack_block(values, decimals: int = 2):
+    """
+    Đóng gói block thô thành số nguyên cố định điểm: nhân 10**decimals, mã hóa delta
+    rồi varint zigzag
+
+    Args:
+        values: Giá trị của block
+        decimals: Số chữ số thập phân cần giữ (NUMERIC(10,2) -> 2)
+
+    Returns:
+        bytes của block, hoặc None nếu block không biểu diễn đúng được với decimals
+        (compressor khi đó giữ block float)
+    """
+    values = np.asarray(values, dtype=float).ravel()
+    scaled = _scaled_values(values, decimals, np.int64)
+    if scaled is None or np.abs(scaled).max(initial=0) >= 2 ** 52:
+        return None
+    deltas = np.diff(scaled, prepend=0)
+    return bytes((decimals,)) + _zigzag_varints(deltas)
+
+
+def unpack_block(packed) -> np.ndarray:
+    """
+    Giải block đã đóng gói bởi pack_block
+
+    Args:
+        packed: bytes/memoryview, hoặc chuỗi base64 (block đọc từ JSON)
+
+    Returns:
+        Mảng float64 giá trị của block
+    """
+    if isinstance(packed, str):
+        packed = base64.b64decode(packed)
+    packed = memoryview(packed)
+    if len(packed) == 0:
+        raise ValueError("Block đóng gói rỗng")
+    decimals = packed[0]
+    return np.cumsum(_unzigzag_varints(packed[1:])) / (10 ** decimals)
+
+
+def is_packed_block(block) -> bool:
+    """True nếu block thô đã được đóng gói bởi pack_block (bytes hoặc base64 trong JSON)"""
+    return isinstance(block, (bytes, bytearray, memoryview, str))
+
+
+def _split_stream(encoded_stream):
+    """
+    Tách encoded_stream thành token số nguyên và các block thô
+
+    Returns:
+        (tokens, blocks): list int và list mảng float64
+    """
+    tokens, blocks = [], []
+    for item in encoded_stream:
+        if isinstance(item, (list, tuple, np.ndarray)) or is_packed_block(item):
+            if not tokens or tokens[-1] != BLOCK_MARKER:
+                raise ValueError("Block thô phải đứng ngay sau marker 0xFD")
+            if isinstance(item, str):
+                item = base64.b64decode(item)
+            blocks.append(bytes(item) if is_packed_block(item) else np.asarray(item, dtype=float).ravel())
+        else:
+            tokens.append(int(item))
+    return tokens, blocks
+
+
+def _scaled_values(values, decimals, dtype):
+    """Giá trị nhân 10**decimals dạng số nguyên nếu giữ đúng từng giá trị, ngược lại None"""
+    if not np.all(np.isfinite(values)):
+        return None
+    scale = 10 ** decimals
+    scaled = np.round(values * scale)
+    info = np.iinfo(dtype)
+    if scaled.size and (scaled.min() < info.min or scaled.max() > info.max):
+        return None
+    if not np.array_equal(scaled / scale, values):
+        return None
+    return scaled.astype(dtype)
+
+
+def encode_stream(encoded_stream, value_codec: str = 'auto', decimals: int = 2) -> bytes:
+    """
+    Đóng gói encoded_stream thành container nhị phân
+
+    Args:
+        encoded_stream: Stream từ LosslessCompressor.compress (int và block list/ndarray/bytes)
+        value_codec: 'auto', 'float64', 'float32', 'int16', 'int32' hoặc 'varint'
+                     ('varint' chỉ khi mọi block đã được đóng gói bởi pack_block)
+        decimals: Số chữ số thập phân cho codec số nguyên (NUMERIC(10,2) -> 2)
+
+    Returns:
+        bytes của container
+    """
+    tokens, blocks = _split_stream(encoded_stream)
+    packed_blocks = sum(isinstance(b, bytes) for b in blocks)
+    if value_codec in ('auto', 'varint') and blocks and packed_blocks == len(blocks):
+        value_codec = 'varint'
+    elif value_codec == 'varint':
+        raise ValueError("Codec 'varint' cần mọi block đã được đóng gói bởi pack_block")
+    elif packed_blocks:
+        # Stream trộn block đóng gói và block float: giải về float rồi dùng codec thường
+        blocks = [unpack_block(b) if isinstance(b, bytes) else b for b in blocks]
+    if any(len(b) > np.iinfo(np.uint16).max for b in blocks):
+        raise ValueError("Block vượt quá 65535 giá trị")
+    lengths = np.array([len(b) for b in blocks], dtype='<u2')
+    values = np.concatenate(blocks) if blocks and value_codec != 'varint' else np.empty(0)
+
+    if value_codec == 'varint':
+        packed = np.frombuffer(b''.join(blocks), dtype=np.uint8)
+    elif value_codec == 'auto':
+        packed = None
+        for name in ('int16', 'int32'):
+            packed = _scaled_values(values, decimals, _CODEC_DTYPES[name])
+            if packed is not None:
+                value_codec = name
+                break
+        if packed is None:
+            value_codec, packed = 'float64', values.astype('<f8')
+    elif value_codec in ('int16', 'int32'):
+        packed = _scaled_values(values, decimals, _CODEC_DTYPES[value_codec])
+        if packed is None:
+            raise ValueError(f"Giá trị không biểu diễn đúng được bằng {value_codec} với {decimals} chữ số thập phân")
+    elif value_codec in ('float64', 'float32'):
+        packed = values.astype(_CODEC_DTYPES[value_codec])
+    else:
+        raise ValueError(f"Codec giá trị không hợp lệ: {value_codec}")
+
+    token_width = 1 if not tokens or max(tokens) < 256 else 2
+    if tokens and (min(tokens) < 0 or max(tokens) > np.iinfo(np.uint16).max):
+        raise ValueError("Token nằm ngoài khoảng uint16")
+    token_array = np.array(tokens, dtype='<u1' if token_width == 1 else '<u2')
+
+    header = _HEADER.pack(FORMAT_MAGIC, FORMAT_VERSION, token_width, VALUE_CODECS[value_codec],
+                          decimals, len(tokens), len(blocks))
+    return b''.join((header, token_array.tobytes(), lengths.tobytes(), packed.tobytes()))
+
+
+def decode_stream(payload) -> list:
+    """
+    Giải container nhị phân về encoded_stream
+
+    Args:
+        payload: bytes/bytearray/memoryview của container
+
+    Returns:
+        List token int xen kẽ block thô (ndarray float64, view của một mảng chung;
+        bytes của pack_block với codec 'varint')
+    """
+    buf = memoryview(payload)
+    if len(buf) < _HEADER.size:
+        raise ValueError("Container encoded_stream quá ngắn")
+    magic, version, token_width, codec, decimals, n_tokens, n_blocks = _HEADER.unpack_from(buf)
+    if magic != FORMAT_MAGIC:
+        raise ValueError("Không phải container encoded_stream nhị phân")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Phiên bản container không hỗ trợ: {version}")
+    if codec not in _CODEC_NAMES:
+        raise ValueError(f"Codec giá trị không hỗ trợ: {codec}")
+
+    offset = _HEADER.size
+    tokens = np.frombuffer(buf, dtype='<u1' if token_width == 1 else '<u2', count=n_tokens, offset=offset)
+    offset += tokens.nbytes
+    lengths = np.frombuffer(buf, dtype='<u2', count=n_blocks, offset=offset)
+    offset += lengths.nbytes
+    name = _CODEC_NAMES[codec]
+    if name == 'varint':
+        values = buf[offset:offset + int(lengths.sum())]
+    elif name in ('int16', 'int32'):
+        values = np.frombuffer(buf, dtype=_CODEC_DTYPES[name], count=int(lengths.sum()), offset=offset) / (10 ** decimals)
+    else:
+        values = np.frombuffer(buf, dtype=_CODEC_DTYPES[name], count=int(lengths.sum()), offset=offset).astype(float)
+    bounds = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+
+    stream = []
+    block = 0
+    expect_arg = False
+    for token in tokens.tolist():
+        stream.append(token)
+        if expect_arg:
+            # Token này là tham số (block size mới / chỉ số ghi đè), không phải marker
+            expect_arg = False
+            continue
+        if token == BLOCK_MARKER:
+            if block >= n_blocks:
+                raise ValueError("Container thiếu block thô")
+            chunk = values[bounds[block]:bounds[block + 1]]
+            stream.append(bytes(chunk) if name == 'varint' else chunk)
+            block += 1
+        elif token in (BLOCKSIZE_CHANGE_MARKER, BUFFER_OVERWRITE_MARKER):
+            expect_arg = True
+    if block != n_blocks:
+        raise ValueError("Số block thô không khớp với số marker 0xFD")
+    return stream
+
+
+TIMESTAMP_MAGIC = b'IDLT'
+_TIMESTAMP_HEADER = struct.Struct('<4sBIq')
+
+
+def encode_timestamps(timestamps) -> bytes:
+    """
+    Mã hóa timestamp thật của từng mẫu: delta-of-delta rồi run-length
+
+    Args:
+        timestamps: List datetime/pandas Timestamp hoặc mảng datetime64 (tăng dần)
+
+    Returns:
+        bytes của kênh timestamp
+    """
+    ts = np.asarray(timestamps, dtype='datetime64[us]').astype(np.int64)
+    start = int(ts[0]) if len(ts) else 0
+    dod = np.diff(np.diff(ts), prepend=0)
+    pairs = np.empty(0, dtype=np.int64)
+    if len(dod):
+        run_starts = np.flatnonzero(np.concatenate(([True], dod[1:] != dod[:-1])))
+        runs = np.diff(np.append(run_starts, len(dod)))
+        pairs = np.empty(2 * len(run_starts), dtype=np.int64)
+        pairs[0::2] = dod[run_starts]
+        pairs[1::2] = runs
+    header = _TIMESTAMP_HEADER.pack(TIMESTAMP_MAGIC, FORMAT_VERSION, len(ts), start)
+    return header + _zigzag_varints(pairs)
+
+
+def decode_timestamps(payload) -> np.ndarray:
+    """
+    Giải kênh timestamp của encode_timestamps
+
+    Args:
+        payload: bytes/memoryview
+
+    Returns:
+        Mảng datetime64[us]
+    """
+    payload = memoryview(payload)
+    magic, version, count, start = _TIMESTAMP_HEADER.unpack_from(payload)
+    if magic != TIMESTAMP_MAGIC or version != FORMAT_VERSION:
+        raise ValueError("Kênh timestamp không hợp lệ")
+    if count == 0:
+        return np.empty(0, dtype='datetime64[us]')
+    pairs = _unzigzag_varints(payload[_TIMESTAMP_HEADER.size:])
+    dod = np.repeat(pairs[0::2], pairs[1::2])
+    if len(dod) != count - 1:
+        raise ValueError("Kênh timestamp không khớp số mẫu")
+    ts = np.empty(count, dtype=np.int64)
+    ts[0] = start
+    np.cumsum(np.cumsum(dod), out=ts[1:])
+    ts[1:] += start
+    return ts.astype('datetime64[us]')
+
+
+SEEK_INDEX_MAGIC = b'IDLS'
+_SEEK_HEADER = struct.Struct('<4sBII')
+
+
+def encode_seek_index(seek_index, num_buffers: int) -> bytes:
+    """
+    Đóng gói seek index của compressor
+
+    Args:
+        seek_index: List dict {'token', 'sample', 'block_size', 'buffers'}
+        num_buffers: Số buffer tối đa (số cột buffer của ma trận)
+
+    Returns:
+        bytes của seek index
+    """
+    rows = np.full((len(seek_index), 3 + num_buffers), -1, dtype='<i4')
+    for row, entry in zip(rows, seek_index):
+        row[:3] = (entry['token'], entry['sample'], entry['block_size'])
+        row[3:3 + len(entry['buffers'])] = entry['buffers']
+    header = _SEEK_HEADER.pack(SEEK_INDEX_MAGIC, FORMAT_VERSION, num_buffers, len(seek_index))
+    return header + zlib.compress(rows.tobytes())
+
+
+def decode_seek_index(payload) -> list:
+    """
+    Giải seek index của encode_seek_index
+
+    Args:
+        payload: bytes/memoryview
+
+    Returns:
+        List dict {'token', 'sample', 'block_size', 'buffers'} theo thứ tự mẫu tăng dần
+    """
+    payload = bytes(payload)
+    magic, version, num_buffers, count = _SEEK_HEADER.unpack_from(payload)
+    if magic != SEEK_INDEX_MAGIC or version != FORMAT_VERSION:
+        raise ValueError("Seek index không hợp lệ")
+    rows = np.frombuffer(zlib.decompress(payload[_SEEK_HEADER.size:]), dtype='<i4').reshape(count, 3 + num_buffers)
+    return [{
+        'token': int(row[0]),
+        'sample': int(row[1]),
+        'block_size': int(row[2]),
+        'buffers': [int(t) for t in row[3:] if t >= 0]
+    } for row in rows]
+
+
+def _token_section(container):
+    """(vị trí bắt đầu, vị trí kết thúc) của mảng token trong container"""
+    _, _, token_width, _, _, n_tokens, _ = _HEADER.unpack_from(container)
+    return _HEADER.size, _HEADER.size + n_tokens * token_width
+
+
+def apply_post_stage(container: bytes, stage: str = 'none') -> bytes:
+    """
+    Áp tầng nén thứ cấp lên container của encode_stream
+
+    Args:
+        container: bytes từ encode_stream
+        stage: 'none', 'zlib', 'lzma' hoặc 'range'
+
+    Returns:
+        bytes đã bọc (container giữ nguyên khi stage='none')
+    """
+    if stage not in POST_STAGES:
+        raise ValueError(f"Post stage không hợp lệ: {stage}")
+    if stage == 'none':
+        return container
+    if stage == 'zlib':
+        payload = zlib.compress(container, 9)
+    elif stage == 'lzma':
+        payload = lzma.compress(container, preset=9)
+    else:
+        start, end = _token_section(container)
+        coded = range_encode(container[start:end])
+        payload = b''.join((container[:start], _RANGE_LENGTH.pack(len(coded)), coded, container[end:]))
+    return _POST_HEADER.pack(POST_STAGE_MAGIC, POST_STAGES[stage], len(container)) + payload
+
+
+def remove_post_stage(payload) -> bytes:
+    """
+    Gỡ tầng nén thứ cấp, trả về container của encode_stream
+
+    Args:
+        payload: bytes từ apply_post_stage (hoặc container chưa bọc)
+
+    Returns:
+        bytes của container
+    """
+    payload = bytes(payload)
+    if not payload.startswith(POST_STAGE_MAGIC):
+        return payload
+    _, code, length = _POST_HEADER.unpack_from(payload)
+    stage = _POST_STAGE_NAMES.get(code)
+    body = payload[_POST_HEADER.size:]
+    if stage == 'zlib':
+        container = zlib.decompress(body)
+    elif stage == 'lzma':
+        container = lzma.decompress(body)
+    elif stage == 'range':
+        header = body[:_HEADER.size]
+        start, end = _token_section(header)
+        (coded_length,) = _RANGE_LENGTH.unpack_from(body, start)
+        coded_start = start + _RANGE_LENGTH.size
+        tokens = range_decode(body[coded_start:coded_start + coded_length], end - start)
+        container = header + tokens + body[coded_start + coded_length:]
+    else:
+        raise ValueError(f"Post stage không hỗ trợ: {code}")
+    if len(container) != length:
+        raise ValueError("Độ dài container sau post stage không khớp")
+    return container
+
+
+def post_stage_of(raw) -> str:
+    """Tên tầng nén thứ cấp của dữ liệu bytea ('none' nếu không bọc)"""
+    if isinstance(raw, (bytes, bytearray, memoryview)) and bytes(raw[:len(POST_STAGE_MAGIC)]) == POST_STAGE_MAGIC:
+        return _POST_STAGE_NAMES.get(raw[len(POST_STAGE_MAGIC)], 'unknown')
+    return 'none'
+
+
+def is_binary_stream(raw) -> bool:
+    """True nếu raw là container nhị phân (bytes/memoryview bắt đầu bằng magic, có thể đã qua post stage)"""
+    return (isinstance(raw, (bytes, bytearray, memoryview))
+            and bytes(raw[:len(FORMAT_MAGIC)]) in (FORMAT_MAGIC, POST_STAGE_MAGIC))
+
+
+def load_encoded_stream(raw):
+    """
+    Đọc encoded_stream từ cột bytea (định dạng mới) hoặc JSONB (bản ghi cũ)
+
+    Args:
+        raw: bytes/memoryview (bytea, có thể đã qua post stage), str (JSON) hoặc list (JSONB đã parse)
+
+    Returns:
+        List token của encoded_stream
+    """
+    if raw is None:
+        return None
+    if is_binary_stream(raw):
+        return decode_stream(remove_post_stage(raw))
+    if isinstance(raw, (bytes, bytearray, memoryview)):
+        raw = bytes(raw).decode('utf-8')
+    if isinstance(raw, str):
+        return json.loads(raw)
+    return raw
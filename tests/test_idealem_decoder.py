@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Kiểm tra giải nén theo khoảng mẫu (decompress_samples, iter_samples) bằng seek index:
+mọi khoảng [start, stop) phải trùng với slice tương ứng của lần giải nén toàn bộ, kể cả
+khi khoảng bắt đầu đúng/ngay sau chỗ đổi block size hoặc ngay sau một lần ghi đè buffer.
+"""
+
+import numpy as np
+import pytest
+
+from idealem_decoder import decompress_idealem, decompress_samples, iter_samples
+from lossless_compression import LosslessCompressor
+from stream_codec import encode_stream, BLOCK_MARKER, BLOCKSIZE_CHANGE_MARKER, BUFFER_OVERWRITE_MARKER
+from test_ks_matching import make_series
+
+SEEK_INTERVAL = 4
+
+
+@pytest.fixture(scope='module')
+def compressed():
+    """Stream 7 ngày, pool 2 buffer (nhiều lần ghi đè), có sampling đổi block size và seek index dày"""
+    config = {'num_buffers': 2, 'seek_interval': SEEK_INTERVAL}
+    result = LosslessCompressor(config).compress(make_series(7, 0))
+    result['initial_block_size'] = LosslessCompressor(config).config['block_size']
+    result['full'] = decompress_idealem(result['encoded_stream'], result['initial_block_size'],
+                                        result['num_buffers'], result['original_length'])
+    return result
+
+
+def event_samples(result):
+    """Vị trí mẫu tại các chỗ đổi block size và ghi đè buffer của stream"""
+    stream = result['encoded_stream']
+    events = {'blocksize': [], 'overwrite': []}
+    block_size = result['initial_block_size']
+    pos, i = 0, 0
+    while i < len(stream):
+        code = stream[i]
+        if code == BLOCKSIZE_CHANGE_MARKER:
+            events['blocksize'].append(pos)
+            block_size = int(stream[i + 1])
+            i += 2
+        elif code == BUFFER_OVERWRITE_MARKER:
+            events['overwrite'].append(pos)
+            i += 2
+        elif code == BLOCK_MARKER:
+            pos += len(stream[i + 1])
+            i += 2
+        else:
+            # Hit: buffer bị xóa khi đổi block size nên block của buffer có block size hiện tại
+            pos += block_size
+            i += 1
+    return events
+
+
+def sample_ranges(result):
+    n = result['original_length']
+    events = event_samples(result)
+    assert events['blocksize'] and events['overwrite']
+    ranges = [(0, n), (0, 1), (1, 2), (n - 10, n), (n - 10, n + 5), (5, 5), (10, 3), (n + 1, n + 10)]
+    for p in events['blocksize'] + events['overwrite'][:20]:
+        ranges += [(p, p + 50), (p + 1, p + 30), (p - 1, p + 1), (p, p + 1), (p + 1, p + 300)]
+    # Ngay tại và ngay sau các điểm seek
+    for entry in result['seek_index'][::5]:
+        ranges += [(entry['sample'], entry['sample'] + 40), (entry['sample'] + 1, entry['sample'] + 7)]
+    return ranges
+
+
+def test_seek_index_is_written(compressed):
+    assert len(compressed['seek_index']) > 10
+    assert compressed['seek_interval'] == SEEK_INTERVAL
+
+
+def test_decompress_samples_matches_full_decode(compressed):
+    full = compressed['full']
+    stream = compressed['encoded_stream']
+    for start, stop in sample_ranges(compressed):
+        values = decompress_samples(stream, compressed['num_buffers'], compressed['seek_index'], start, stop,
+                                    compressed['original_length'])
+        np.testing.assert_array_equal(values, full[max(start, 0):stop], err_msg=f'[{start}, {stop})')
+
+
+def test_iter_samples_matches_full_decode(compressed):
+    full = compressed['full']
+    stream = compressed['encoded_stream']
+    for start, stop in sample_ranges(compressed):
+        chunks = list(iter_samples(stream, compressed['num_buffers'], compressed['seek_index'], start, stop,
+                                   compressed['original_length']))
+        values = np.concatenate(chunks) if chunks else np.empty(0)
+        np.testing.assert_array_equal(values, full[max(start, 0):stop], err_msg=f'[{start}, {stop})')
+
+
+def test_range_decode_without_seek_index_and_from_container(compressed):
+    full = compressed['full']
+    container = encode_stream(compressed['encoded_stream'])
+    for start, stop in sample_ranges(compressed)[:40]:
+        expected = full[max(start, 0):stop]
+        np.testing.assert_array_equal(
+            decompress_samples(compressed['encoded_stream'], compressed['num_buffers'], None, start, stop,
+                               compressed['original_length']), expected)
+        np.testing.assert_array_equal(
+            decompress_samples(container, compressed['num_buffers'], compressed['seek_index'], start, stop,
+                               compressed['original_length']), expected)
+
+
+def test_iter_samples_to_end_of_stream(compressed):
+    full = compressed['full']
+    start = compressed['seek_index'][-1]['sample'] + 3
+    chunks = list(iter_samples(compressed['encoded_stream'], compressed['num_buffers'], compressed['seek_index'],
+                               start, None, compressed['original_length']))
+    np.testing.assert_array_equal(np.concatenate(chunks), full[start:])
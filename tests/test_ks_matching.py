@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Kiểm tra engine so khớp KS của LosslessCompressor với vòng so khớp gốc.
+
+ReferenceCompressor giữ nguyên (đóng băng) vòng so khớp của bản gốc: gọi stats.ks_2samp
+cho từng cặp block/buffer đã chuẩn hóa, ghi đè buffer 0 khi pool đầy, và sampling block
+size bằng simulate_compress từng cặp trên dữ liệu thô. Khác bản gốc duy nhất ở chỗ các
+block nối tiếp nhau sau khi đổi block size (bản gốc bước theo block size ban đầu, xem
+feed()). LosslessCompressor.compress() phải cho encoded_stream giống hệt trên cùng dữ
+liệu, với cả engine vector hóa lẫn ks_vectorized=False, có và không có sampling.
+"""
+
+import numpy as np
+import pytest
+from scipy import stats
+
+from batch_compression import BatchCompressor
+from ks_matching import ks_2samp_equal
+from idealem_decoder import decompress_idealem
+from lossless_compression import LosslessCompressor
+
+# Không bao giờ tới chu kỳ sampling: block size giữ nguyên suốt stream
+NO_SAMPLING = {'sampling_interval': 10 ** 9}
+
+
+def make_series(days, seed):
+    """Chuỗi công suất theo ngày (288 điểm/ngày) có nhiễu, làm tròn 2 chữ số như cột NUMERIC(10,2)"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(days * 288)
+    daily = 40 + 25 * np.sin(2 * np.pi * t / 288) + 8 * np.sin(2 * np.pi * t / 96)
+    weekend = np.where((t // 288) % 7 >= 5, -10.0, 0.0)
+    values = daily + weekend + rng.normal(0, 2.5, len(t))
+    return np.round(values, 2)
+
+
+def stream_tokens(encoded_stream):
+    """encoded_stream dưới dạng list thuần Python để so sánh"""
+    return [x.tolist() if isinstance(x, np.ndarray) else int(x) for x in encoded_stream]
+
+
+def _znormalize(block):
+    std = np.std(block)
+    return (block - np.mean(block)) / (std if std > 0 else 1)
+
+
+class ReferenceCompressor:
+    """Vòng so khớp gốc: ks_2samp từng cặp, không cache, không vector hóa"""
+
+    def __init__(self, config=None):
+        self.config = dict(LosslessCompressor().config)
+        if config:
+            self.config.update(config)
+        self.block_size = self.config['block_size']
+        self.buffers = []
+        self.encoded_stream = []
+
+    def encode_block(self, block):
+        for idx, buf in enumerate(self.buffers):
+            stat, p_value = stats.ks_2samp(_znormalize(block), _znormalize(buf))
+            if p_value > self.config['similarity_threshold']:
+                self.encoded_stream.append(idx)
+                return True
+        if len(self.buffers) < self.config['num_buffers']:
+            self.buffers.append(block.copy())
+        else:
+            self.encoded_stream.append(LosslessCompressor.BUFFER_OVERWRITE_MARKER)
+            self.encoded_stream.append(0)
+            self.buffers[0] = block.copy()
+        self.encoded_stream.append(0xFD)
+        self.encoded_stream.append(block.copy())
+        return False
+
+    def simulate_compress(self, data, block_size):
+        buffers = []
+        stream_len = 0
+        hit_count = 0
+        for i in range(0, len(data), block_size):
+            block = data[i:i + block_size]
+            matched = False
+            for buf in buffers:
+                stat, p_value = stats.ks_2samp(block, buf)
+                if p_value > self.config['similarity_threshold']:
+                    stream_len += 1
+                    hit_count += 1
+                    matched = True
+                    break
+            if not matched:
+                if len(buffers) < self.config['num_buffers']:
+                    buffers.append(block.copy())
+                else:
+                    stream_len += 2
+                    buffers[0] = block.copy()
+                stream_len += 1
+        return len(data) / max(1, stream_len), hit_count
+
+    def multistage_blocksize_sampling(self, data):
+        min_n = self.config['min_block_size']
+        max_n = self.config['max_block_size']
+        window = self.config['sampling_window']
+        best_n = self.block_size
+        n_candidates = list(range(min_n, max_n + 1, max(1, (max_n - min_n) // window)))
+        for t in range(self.config['sampling_trials']):
+            hit_ratios = []
+            for n in n_candidates:
+                ratio, hit = self.simulate_compress(data, n)
+                num_blocks = len(data) // n
+                hit_ratios.append(hit / num_blocks if num_blocks > 0 else 0.0)
+            best_n = n_candidates[int(np.argmax(hit_ratios))]
+            n_candidates = list(range(max(min_n, best_n - window), min(max_n, best_n + window) + 1))
+        if abs(best_n - self.block_size) > self.config['denial_window']:
+            return int(best_n)
+        return self.block_size
+
+    def compress(self, data):
+        recent_data = []
+        hit_count = 0
+        total_blocks = 0
+        pos = 0
+        while pos < len(data):
+            block = data[pos:pos + self.block_size]
+            pos += len(block)
+            recent_data.extend(block.tolist())
+            recent_data = recent_data[-self.config['sampling_recent_size']:]
+            total_blocks += 1
+            if self.encode_block(block):
+                hit_count += 1
+            if total_blocks >= 3 and total_blocks % self.config['sampling_interval'] == 0:
+                n_opt = self.multistage_blocksize_sampling(np.array(recent_data))
+                if n_opt != self.block_size:
+                    self.encoded_stream.append(LosslessCompressor.BLOCKSIZE_CHANGE_MARKER)
+                    self.encoded_stream.append(n_opt)
+                    self.block_size = n_opt
+                    self.buffers = []
+        return {
+            'encoded_stream': self.encoded_stream,
+            'block_size': self.block_size,
+            'hit_ratio': hit_count / total_blocks if total_blocks > 0 else 0.0
+        }
+
+
+def assert_same_result(data, config):
+    expected = ReferenceCompressor(config).compress(data)
+    result = LosslessCompressor(config).compress(data)
+    assert stream_tokens(result['encoded_stream']) == stream_tokens(expected['encoded_stream'])
+    assert result['hit_ratio'] == expected['hit_ratio']
+    assert result['block_size'] == expected['block_size']
+    return expected
+
+
+@pytest.mark.parametrize('vectorized', [True, False])
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_matching_without_sampling(seed, vectorized):
+    data = make_series(7, seed)
+    expected = assert_same_result(data, {**NO_SAMPLING, 'ks_vectorized': vectorized})
+    assert 0 < expected['hit_ratio'] < 1
+
+
+@pytest.mark.parametrize('vectorized', [True, False])
+@pytest.mark.parametrize('seed', [0, 1])
+def test_matching_with_sampling(seed, vectorized):
+    data = make_series(3, seed)
+    expected = assert_same_result(data, {'ks_vectorized': vectorized})
+    # Dữ liệu phải thực sự đi qua sampling và đổi block size
+    assert LosslessCompressor.BLOCKSIZE_CHANGE_MARKER in stream_tokens(expected['encoded_stream'])
+
+
+def test_matching_with_full_pool():
+    # Ít buffer: pool đầy sớm, stream có nhiều lần ghi đè (0xFF, idx)
+    data = make_series(7, 3)
+    expected = assert_same_result(data, {**NO_SAMPLING, 'num_buffers': 3})
+    assert LosslessCompressor.BUFFER_OVERWRITE_MARKER in stream_tokens(expected['encoded_stream'])
+
+
+def test_blocks_stay_contiguous_after_blocksize_change():
+    # Không có hit (p-value không bao giờ > 1): mọi block được ghi thô, sampling chọn block
+    # size nhỏ nhất nên block size đổi giữa stream. Giải nén phải ra đúng dữ liệu gốc,
+    # không chồng lấn hay bỏ sót mẫu quanh chỗ đổi block size.
+    data = make_series(2, 4)
+    result = LosslessCompressor({'similarity_threshold': 1.01}).compress(data)
+    assert LosslessCompressor.BLOCKSIZE_CHANGE_MARKER in stream_tokens(result['encoded_stream'])
+    decoded = decompress_idealem(result['encoded_stream'], result['block_size'], result['num_buffers'],
+                                 result['original_length'])
+    np.testing.assert_array_equal(decoded, data)
+
+
+def test_feed_in_chunks_matches_compress():
+    data = make_series(3, 5)
+    expected = LosslessCompressor().compress(data)
+    compressor = LosslessCompressor()
+    rng = np.random.default_rng(5)
+    tokens = []
+    pos = 0
+    while pos < len(data):
+        size = int(rng.integers(1, 200))
+        tokens.extend(compressor.feed(data[pos:pos + size]))
+        pos += size
+    tokens.extend(compressor.flush())
+    assert stream_tokens(tokens) == stream_tokens(expected['encoded_stream'])
+    decoded = decompress_idealem(tokens, expected['block_size'], expected['num_buffers'], len(data))
+    assert len(decoded) == len(data)
+
+
+def test_decode_buffer_overwrite():
+    # 0xFF, idx, 0xFD, block: block sau marker 0xFD ghi đè buffer idx rồi được phát ra
+    b0, b1, b2 = np.arange(4.0), np.arange(4.0) + 10, np.arange(4.0) + 20
+    stream = [0xFD, b0, 0xFD, b1, 0xFF, 0, 0xFD, b2, 0, 1]
+    decoded = decompress_idealem(stream, 4, 2, 20)
+    np.testing.assert_array_equal(decoded, np.concatenate([b0, b1, b2, b2, b1]))
+
+
+def test_overwrite_stream_round_trip():
+    # Pool 2 buffer và không có hit: gần như mọi block đi qua nhánh ghi đè 0xFF
+    data = make_series(2, 6)
+    result = LosslessCompressor({**NO_SAMPLING, 'similarity_threshold': 1.01, 'num_buffers': 2}).compress(data)
+    assert stream_tokens(result['encoded_stream']).count(LosslessCompressor.BUFFER_OVERWRITE_MARKER) > 10
+    decoded = decompress_idealem(result['encoded_stream'], result['block_size'], result['num_buffers'],
+                                 result['original_length'])
+    np.testing.assert_array_equal(decoded, data)
+
+
+@pytest.mark.parametrize('vectorized', [True, False])
+def test_matching_with_prefilter(vectorized):
+    # Block size >= KSMatcher.PREFILTER_MIN_N để đường vector hóa cũng chạy bộ lọc cận dưới
+    data = make_series(7, 7)
+    assert_same_result(data, {**NO_SAMPLING, 'ks_vectorized': vectorized, 'ks_prefilter_points': 5, 'block_size': 64})
+
+
+def test_batch_compressor_matches_single_streams():
+    series = {seed: make_series(3, seed) for seed in range(4)}
+    series[4] = series[0][:-7]  # Độ dài khác: block cuối ngắn hơn
+    results = BatchCompressor().compress(series)
+    for key, data in series.items():
+        expected = LosslessCompressor().compress(data)
+        assert stream_tokens(results[key]['encoded_stream']) == stream_tokens(expected['encoded_stream'])
+        assert results[key]['seek_index'] == expected['seek_index']
+        assert results[key]['original_length'] == len(data)
+        for counter in ('lookups', 'ks_tests', 'ks_exact'):
+            assert results[key]['timings'][counter] == expected['timings'][counter]
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_parallel_sampling_pair_stats(executor):
+    data = make_series(4, 8)
+    expected = LosslessCompressor().compress(data)
+    result = LosslessCompressor({'sampling_workers': 3, 'sampling_parallel_min_size': 0,
+                                 'sampling_executor': executor}).compress(data)
+    assert stream_tokens(result['encoded_stream']) == stream_tokens(expected['encoded_stream'])
+    if executor == 'thread':
+        # Cùng cache PairwiseKS với chạy tuần tự: bộ đếm phải khớp chính xác
+        for counter in ('computed_pairs', 'reused_pairs'):
+            assert result['timings'][counter] == expected['timings'][counter]
+    else:
+        # Mỗi tiến trình worker có cache riêng, bộ đếm được trả về và cộng ở tiến trình chính
+        assert result['timings']['computed_pairs'] >= expected['timings']['computed_pairs'] > 0
+
+
+def ks_sample_pairs(n, rng):
+    """Các cặp mẫu cùng kích thước n cho kernel KS"""
+    a = rng.normal(size=n)
+    b = rng.normal(size=n) * rng.uniform(0.5, 2) + rng.uniform(-1, 1)
+    return {
+        'random': (a, b),
+        'ties': (np.round(a * 2) / 2, np.round(b * 2) / 2),
+        'heavy_ties': (rng.integers(0, 3, n).astype(float), rng.integers(0, 3, n).astype(float)),
+        'identical': (a, a.copy()),
+        'disjoint': (a, a + 10),
+        'normalized': (_znormalize(rng.exponential(size=n)), _znormalize(rng.normal(size=n)))
+    }
+
+
+# Với vài h, nhánh exact của SciPy chuyển sang asymp (cảnh báo); bảng p-value cũng lấy từ ks_2samp
+@pytest.mark.filterwarnings('ignore::RuntimeWarning')
+@pytest.mark.parametrize('n', range(12, 49))
+def test_ks_2samp_equal_matches_scipy(n):
+    rng = np.random.default_rng(n)
+    for trial in range(3):
+        for kind, (a, b) in ks_sample_pairs(n, rng).items():
+            expected = stats.ks_2samp(a, b)
+            statistic, pvalue = ks_2samp_equal(a, b)
+            assert statistic == expected.statistic, (kind, trial)
+            assert pvalue == expected.pvalue, (kind, trial)
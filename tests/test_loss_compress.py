@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Kiểm tra đọc dữ liệu gốc của loss_compress trên bảng original_samples (SQLite trong bộ
+nhớ thay cho PostgreSQL, truy vấn chỉ dùng SQL chung).
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, text
+
+pytest.importorskip('psycopg2')  # loss_compress import psycopg2 ở đầu module
+import loss_compress  # noqa: E402
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine('sqlite://')
+    start = datetime(2024, 1, 1)
+    rows = []
+    for i in range(20):
+        # Mẫu thứ 3, 7, 8 và 19 của dev là NULL (thiết bị không đo được)
+        value = None if i in (3, 7, 8, 19) else round(40 + i * 0.25, 2)
+        rows.append({'device_id': 'dev', 'value': value, 'timestamp': start + i * timedelta(minutes=5)})
+        rows.append({'device_id': 'other', 'value': None, 'timestamp': start + i * timedelta(minutes=5)})
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE original_samples (device_id TEXT, value NUMERIC(10, 2), timestamp TIMESTAMP)"))
+        conn.execute(text("INSERT INTO original_samples VALUES (:device_id, :value, :timestamp)"), rows)
+    return engine
+
+
+def expected_samples(limit=None):
+    start = np.datetime64('2024-01-01T00:00:00', 'us')
+    kept = [i for i in range(20) if i not in (3, 7, 8, 19)][:limit]
+    return (np.array([round(40 + i * 0.25, 2) for i in kept]),
+            start + np.array(kept) * np.timedelta64(5, 'm'))
+
+
+def test_null_values_are_skipped(engine):
+    values, timestamps = loss_compress.fetch_original_data(engine, device_id='dev')
+    expected_values, expected_timestamps = expected_samples()
+    np.testing.assert_array_equal(values, expected_values)
+    np.testing.assert_array_equal(timestamps, expected_timestamps)
+    assert not np.isnan(values).any()
+
+
+def test_null_values_do_not_count_towards_limit(engine):
+    values, timestamps = loss_compress.fetch_original_data(engine, device_id='dev', limit=10)
+    expected_values, expected_timestamps = expected_samples(limit=10)
+    np.testing.assert_array_equal(values, expected_values)
+    np.testing.assert_array_equal(timestamps, expected_timestamps)
+
+
+def test_chunks_skip_null_values(engine):
+    chunks = list(loss_compress.iter_original_chunks(engine, device_id='dev', chunk_size=4))
+    assert all(len(values) == len(timestamps) <= 4 for values, timestamps in chunks)
+    np.testing.assert_array_equal(np.concatenate([values for values, _ in chunks]), expected_samples()[0])
+
+
+def test_device_with_only_null_values(engine):
+    with pytest.raises(ValueError):
+        loss_compress.fetch_original_data(engine, device_id='other')
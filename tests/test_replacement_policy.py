@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Kiểm tra chính sách thay thế buffer (replacement_policy.ReplacementPolicy): buffer bị
+ghi đè của từng chính sách, và round trip nén/giải nén với mỗi chính sách.
+"""
+
+import numpy as np
+import pytest
+
+from idealem_decoder import emitted_blocks, decompress_idealem
+from ks_matching import ks_2samp_equal, znormalize
+from lossless_compression import LosslessCompressor
+from replacement_policy import ReplacementPolicy, REPLACEMENT_POLICIES
+from stream_codec import encode_stream, BLOCK_MARKER, BLOCKSIZE_CHANGE_MARKER, BUFFER_OVERWRITE_MARKER
+from test_ks_matching import make_series, stream_tokens
+
+
+def filled(name, capacity=3, aging_interval=32):
+    """Policy đã đưa block vào lần lượt các buffer 0..capacity-1"""
+    policy = ReplacementPolicy(capacity, name, aging_interval)
+    for idx in range(capacity):
+        policy.on_insert(idx)
+    return policy
+
+
+def test_first_slot_always_overwrites_buffer_0():
+    policy = filled('first_slot')
+    policy.on_hit(1)
+    assert [policy.victim() for _ in range(4)] == [0, 0, 0, 0]
+
+
+def test_fifo_round_robin_ignores_hits():
+    policy = filled('fifo')
+    victims = []
+    for _ in range(5):
+        # Hit buffer sắp bị ghi đè không cứu được nó
+        policy.on_hit(policy.next_slot)
+        idx = policy.victim()
+        policy.on_insert(idx)
+        victims.append(idx)
+    assert victims == [0, 1, 2, 0, 1]
+
+
+def test_lru_overwrites_least_recently_used():
+    policy = filled('lru')
+    assert policy.victim() == 0
+    policy.on_hit(0)
+    assert policy.victim() == 1
+    policy.on_hit(1)
+    policy.on_hit(2)
+    policy.on_hit(0)
+    assert policy.victim() == 1
+    policy.on_insert(1)
+    assert policy.victim() == 2
+
+
+def test_lru_tie_on_fresh_pool_picks_lowest_index():
+    # Sau clear (đổi block size) mọi buffer có last_used = 0
+    policy = filled('lru')
+    policy.clear()
+    assert policy.victim() == 0
+
+
+@pytest.mark.parametrize('name', ['lfu', 'aging'])
+def test_lfu_ties_break_on_least_recently_used(name):
+    policy = filled(name)
+    # Cùng 0 hit: buffer đưa vào sớm nhất
+    assert policy.victim() == 0
+    policy.on_hit(0)
+    # Buffer 1 và 2 cùng 0 hit, buffer 1 lâu không dùng hơn
+    assert policy.victim() == 1
+    policy.on_hit(1)
+    policy.on_hit(2)
+    # Cả ba cùng 1 hit: buffer 0 dùng lâu nhất
+    assert policy.victim() == 0
+    policy.on_hit(0)
+    policy.on_hit(0)
+    assert policy.victim() == 1
+    # Ghi đè đặt lại số hit: buffer vừa đưa vào lại là ứng viên (0 hit)
+    policy.on_insert(1)
+    assert policy.victim() == 1
+
+
+def test_aging_halves_hits_every_interval():
+    aging = filled('aging', capacity=2, aging_interval=4)
+    lfu = filled('lfu', capacity=2)
+    # clock 3..8: buffer 0 hit 6 lần; clock 4 và 8 chia đôi số hit trước khi cộng hit mới
+    expected_hits = [1, 1, 2, 3, 4, 3]
+    for clock, hits in zip(range(3, 9), expected_hits):
+        aging.on_hit(0)
+        lfu.on_hit(0)
+        assert aging.clock == clock
+        assert aging.hits.tolist() == [hits, 0]
+    assert lfu.hits.tolist() == [6, 0]
+    # clock 9..12: buffer 1 hit 4 lần gần đây
+    for _ in range(4):
+        aging.on_hit(1)
+        lfu.on_hit(1)
+    assert aging.hits.tolist() == [1, 2]
+    assert lfu.hits.tolist() == [6, 4]
+    # lfu giữ buffer 0 vì từng hit nhiều; aging ghi đè nó vì số hit cũ đã phân rã
+    assert lfu.victim() == 1
+    assert aging.victim() == 0
+
+
+def test_aging_decay_without_hits():
+    policy = filled('aging', capacity=2, aging_interval=2)
+    policy.hits[:] = [8, 5]
+    policy.on_insert(1)  # clock 3
+    assert policy.hits.tolist() == [8, 0]
+    policy.on_hit(1)     # clock 4: chia đôi rồi cộng hit
+    assert policy.hits.tolist() == [4, 1]
+    policy.on_hit(1)     # clock 5
+    policy.on_hit(1)     # clock 6
+    assert policy.hits.tolist() == [2, 2]
+
+
+def test_invalid_policy_and_describe():
+    with pytest.raises(ValueError):
+        ReplacementPolicy(3, 'random')
+    assert ReplacementPolicy(3, 'lru').describe() == {'replacement_policy': 'lru'}
+    assert ReplacementPolicy(3, 'aging', 16).describe() == {'replacement_policy': 'aging', 'aging_interval': 16}
+
+
+@pytest.mark.parametrize('name', REPLACEMENT_POLICIES)
+def test_policy_round_trip(name):
+    data = make_series(7, 1)
+    config = {'num_buffers': 2, 'replacement_policy': name, 'aging_interval': 8}
+    result = LosslessCompressor(config).compress(data)
+    assert result['replacement_policy'] == name
+    tokens = stream_tokens(result['encoded_stream'])
+    overwrites = []
+    i = 0
+    while i < len(tokens):
+        if tokens[i] == BUFFER_OVERWRITE_MARKER:
+            overwrites.append(tokens[i + 1])
+        # Marker có một tham số theo sau (block thô, chỉ số ghi đè hoặc block size mới)
+        i += 2 if tokens[i] in (BLOCK_MARKER, BLOCKSIZE_CHANGE_MARKER, BUFFER_OVERWRITE_MARKER) else 1
+    assert overwrites
+    if name == 'first_slot':
+        assert set(overwrites) == {0}
+    else:
+        assert set(overwrites) != {0}
+
+    # Decoder không chạy lại chính sách: mỗi block phát ra phải là block gốc (miss) hoặc
+    # một buffer mà block gốc khớp theo KS (hit), tức trạng thái buffer hai phía giống nhau
+    pos = 0
+    for block in emitted_blocks(result['encoded_stream'], result['num_buffers']):
+        original = data[pos:pos + len(block)]
+        if len(original) == len(block) and not np.array_equal(original, block):
+            _, p_value = ks_2samp_equal(znormalize(original), znormalize(block))
+            assert p_value > LosslessCompressor().config['similarity_threshold']
+        pos += len(block)
+    assert pos >= len(data)
+
+    decoded = decompress_idealem(result['encoded_stream'], result['block_size'], result['num_buffers'],
+                                 result['original_length'])
+    assert len(decoded) == len(data)
+    np.testing.assert_array_equal(
+        decompress_idealem(encode_stream(result['encoded_stream']), result['block_size'],
+                           result['num_buffers'], result['original_length']), decoded)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Kiểm tra phần chọn và giải bản ghi của admin_action.save_data.
+
+Các truy vấn dùng riêng cú pháp PostgreSQL (toán tử JSONB ?, tsrange) nên các hàm đọc
+bảng compressed_data_optimized được thay bằng bản giả đọc từ một list bản ghi nén thật;
+phần chọn chế độ và giải nén giữ nguyên.
+"""
+
+import io
+import json
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from admin_action import save_data
+from idealem_decoder import decompress_idealem
+from lossless_compression import LosslessCompressor
+from test_ks_matching import make_series
+
+STEP = timedelta(minutes=5)
+
+
+def make_record(record_id, data, start, segment=None):
+    """Bản ghi giống _record_from_row cho chuỗi data bắt đầu lúc start, mỗi mẫu cách nhau STEP"""
+    result = LosslessCompressor().compress(data)
+    timestamps = np.datetime64(start, 'us') + np.arange(len(data)) * np.timedelta64(STEP)
+    metadata = {
+        'block_size': LosslessCompressor().config['block_size'],
+        'num_buffers': result['num_buffers'],
+        'original_length': result['original_length']
+    }
+    if segment is not None:
+        metadata['segment'] = segment
+    return {
+        'id': record_id,
+        'device_id': 'dev',
+        'metadata': metadata,
+        'encoded_stream': result['encoded_stream'],
+        'seek_index': result['seek_index'],
+        'timestamps': timestamps,
+        'time_range': f"[{timestamps[0].astype(datetime).isoformat()}, {timestamps[-1].astype(datetime).isoformat()}]"
+    }
+
+
+def record_bounds(record):
+    """(lower, upper) của time_range dạng datetime"""
+    return tuple(datetime.fromisoformat(t) for t in save_data.parse_time_range(record['time_range']))
+
+
+@pytest.fixture
+def table(monkeypatch):
+    """List bản ghi thay cho bảng compressed_data_optimized (id tăng dần theo thứ tự ghi)"""
+    rows = []
+
+    def latest_compression_mode(engine, device_id):
+        if not rows:
+            return None
+        return 'segment' if 'segment' in max(rows, key=lambda r: r['id'])['metadata'] else 'full'
+
+    def get_latest_compression_by_device(engine, device_id):
+        return max(rows, key=lambda r: r['id']) if rows else None
+
+    def get_compression_segments(engine, device_id, start=None, end=None):
+        # Như time_range && tsrange(start, end, '[]'), giới hạn None là không chặn
+        start, end = save_data._naive_datetime(start), save_data._naive_datetime(end)
+        segments = [r for r in rows if 'segment' in r['metadata']
+                    and (start is None or record_bounds(r)[1] >= start)
+                    and (end is None or record_bounds(r)[0] <= end)]
+        return sorted(segments, key=lambda r: (record_bounds(r)[0], r['id']))
+
+    monkeypatch.setattr(save_data, 'setup_database', lambda: None)
+    monkeypatch.setattr(save_data, 'latest_compression_mode', latest_compression_mode)
+    monkeypatch.setattr(save_data, 'get_latest_compression_by_device', get_latest_compression_by_device)
+    monkeypatch.setattr(save_data, 'get_compression_segments', get_compression_segments)
+    return rows
+
+
+def decoded_values(data_with_time):
+    return np.array([row['value'] for row in data_with_time])
+
+
+def full_decode(record):
+    """Giá trị giải nén toàn bộ một bản ghi (IDEALEM không giữ nguyên dữ liệu gốc khi hit)"""
+    meta = record['metadata']
+    return decompress_idealem(record['encoded_stream'], meta['block_size'], meta['num_buffers'],
+                              meta['original_length'])
+
+
+def test_newer_full_row_wins_over_segments(table):
+    table.append(make_record(1, make_series(1, 0), datetime(2024, 1, 1), segment='day'))
+    table.append(make_record(2, make_series(1, 1), datetime(2024, 1, 2), segment='day'))
+    table.append(make_record(3, make_series(2, 2), datetime(2024, 1, 1)))
+    full = full_decode(table[-1])
+
+    data, error = save_data.decompress_device_data('dev')
+    assert error is None
+    np.testing.assert_array_equal(decoded_values(data), full)
+    records, error = save_data.select_records(None, 'dev')
+    assert error is None and [r['id'] for r in records] == [3]
+    data, error = save_data.decompress_range('dev', '2024-01-01T12:00:00', '2024-01-02T12:00:00')
+    assert error is None
+    np.testing.assert_array_equal(decoded_values(data), full[144:433])
+
+
+def test_newer_segments_win_over_full_row(table):
+    table.append(make_record(1, make_series(2, 2), datetime(2024, 1, 1)))
+    table.append(make_record(2, make_series(1, 0), datetime(2024, 1, 1), segment='day'))
+    table.append(make_record(3, make_series(1, 1), datetime(2024, 1, 2), segment='day'))
+
+    data, error = save_data.decompress_device_data('dev')
+    assert error is None
+    np.testing.assert_array_equal(decoded_values(data), np.concatenate([full_decode(r) for r in table[1:]]))
+    records, error = save_data.select_records(None, 'dev')
+    assert error is None and [r['id'] for r in records] == [2, 3]
+
+
+def test_no_rows(table):
+    assert save_data.decompress_device_data('dev') == (None, "Không tìm thấy bản ghi nén phù hợp")
+    assert save_data.select_records(None, 'dev') == (None, "Không tìm thấy bản ghi nén phù hợp")
+
+
+def test_aware_bounds_are_compared_in_utc():
+    assert save_data._naive_datetime('2024-01-01T07:00:00+07:00') == datetime(2024, 1, 1)
+    assert save_data._naive_datetime('2024-01-01T07:00:00') == datetime(2024, 1, 1, 7)
+    record = make_record(1, make_series(1, 0), datetime(2024, 1, 1))
+    # 08:00+07:00 = 01:00 UTC, mẫu thứ 12 của ngày
+    assert save_data.record_sample_range(record, '2024-01-01T08:00:00+07:00') == (12, 288)
+
+
+@pytest.fixture
+def segments(table):
+    """Ba segment ngày (nghỉ ngày 3/1), segment thứ hai là bản ghi cũ không có kênh timestamp"""
+    table.append(make_record(1, make_series(1, 0), datetime(2024, 1, 1), segment='day'))
+    table.append(make_record(2, make_series(1, 1), datetime(2024, 1, 2), segment='day'))
+    table.append(make_record(3, make_series(1, 2), datetime(2024, 1, 4), segment='day'))
+    table[1]['timestamps'] = None
+    return table
+
+
+def concatenated(records, start=None, end=None, offset=0, limit=None):
+    """(timestamps, values) mong đợi: giải toàn bộ, nối các bản ghi rồi lọc/cắt"""
+    timestamps = np.concatenate([np.datetime64(record_bounds(r)[0], 'us')
+                                 + np.arange(r['metadata']['original_length']) * np.timedelta64(STEP)
+                                 for r in records])
+    values = np.concatenate([full_decode(r) for r in records])
+    start, end = save_data._naive_datetime(start), save_data._naive_datetime(end)
+    mask = np.ones(len(values), dtype=bool)
+    if start is not None:
+        mask &= timestamps >= np.datetime64(start, 'us')
+    if end is not None:
+        mask &= timestamps <= np.datetime64(end, 'us')
+    stop = None if limit is None else offset + limit
+    return timestamps[mask][offset:stop], values[mask][offset:stop]
+
+
+TIME_RANGES = [
+    (None, None),
+    ('2024-01-01T20:00:00', '2024-01-02T04:00:00'),   # Qua ranh giới hai segment
+    ('2024-01-01T06:00:00', '2024-01-01T07:00:00'),   # Nằm trong một segment
+    ('2024-01-02T12:02:00', None),                     # Bắt đầu giữa hai mẫu, tới hết
+    ('2024-01-02T23:57:00', '2024-01-04T00:00:00'),   # Qua ngày trống, kết thúc đúng mẫu đầu segment 3
+    ('2024-01-03T01:00:00', '2024-01-03T05:00:00'),   # Trong ngày trống: không có mẫu
+    ('2023-12-01T00:00:00', '2023-12-02T00:00:00'),   # Trước mọi segment
+    ('2024-01-02T01:00:00+07:00', '2024-01-02T03:00:00+07:00'),
+]
+OFFSET_LIMITS = [(0, None), (10, None), (0, 5), (100, 300), (250, 100), (287, 2), (10000, None), (0, 0)]
+
+
+@pytest.mark.parametrize('start, end', TIME_RANGES)
+def test_record_slices_match_concatenated_decode(segments, start, end):
+    for offset, limit in OFFSET_LIMITS:
+        timestamps, values = concatenated(segments, start, end, offset, limit)
+        slices = list(save_data.record_slices(segments, start, end, offset, limit))
+        assert sum(last - first for _, first, last in slices) == len(values)
+        assert all(0 <= first < last <= r['metadata']['original_length'] for r, first, last in slices)
+        ts_ms, column = save_data.columnar_arrays(segments, start, end, offset, limit)
+        np.testing.assert_array_equal(column, values, err_msg=f'{offset}, {limit}')
+        np.testing.assert_array_equal(ts_ms, timestamps.astype('datetime64[ms]').astype(np.int64))
+        rows = list(save_data.iter_rows(segments, start, end, offset, limit))
+        np.testing.assert_array_equal(np.concatenate([v for _, v in rows] or [np.empty(0)]), values)
+        assert [t for ts, _ in rows for t in ts] == save_data.format_timestamps(timestamps)
+
+
+@pytest.mark.parametrize('start, end', TIME_RANGES)
+def test_decompress_range_matches_concatenated_decode(segments, start, end):
+    timestamps, values = concatenated(segments, start, end)
+    data, error = save_data.decompress_range('dev', start, end)
+    assert error is None
+    np.testing.assert_array_equal(decoded_values(data), values)
+    assert [row['timestamp'] for row in data] == save_data.format_timestamps(timestamps)
+
+
+def test_stream_export_offset_limit(segments):
+    start, end = '2024-01-01T20:00:00', '2024-01-04T02:00:00'
+    timestamps, values = concatenated(segments, start, end, 30, 300)
+    chunks, error = save_data.stream_device_data('dev', 'ndjson', start, end, offset=30, limit=300)
+    assert error is None
+    rows = [json.loads(line) for line in ''.join(chunks).splitlines()]
+    assert [row['value'] for row in rows] == values.tolist()
+    chunks, error = save_data.export_device_columns('dev', 'npy', start, end, offset=30, limit=300)
+    assert error is None
+    buffer = io.BytesIO(b''.join(chunks))
+    np.testing.assert_array_equal(np.load(buffer), timestamps.astype('datetime64[ms]').astype(np.int64))
+    np.testing.assert_array_equal(np.load(buffer), values)
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Kiểm tra round trip của định dạng nhị phân trong stream_codec: container encoded_stream
+với từng codec giá trị, block đóng gói varint zigzag (pack_block), tầng nén thứ cấp,
+range coder của entropy_coding và kênh timestamp.
+"""
+
+import base64
+import struct
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from entropy_coding import range_encode, range_decode
+from idealem_decoder import decompress_idealem
+from lossless_compression import LosslessCompressor
+from stream_codec import (encode_stream, decode_stream, pack_block, unpack_block, apply_post_stage,
+                          remove_post_stage, post_stage_of, load_encoded_stream, encode_timestamps,
+                          decode_timestamps, VALUE_CODECS, POST_STAGES, FORMAT_MAGIC, POST_STAGE_MAGIC,
+                          BLOCK_MARKER, BLOCKSIZE_CHANGE_MARKER, BUFFER_OVERWRITE_MARKER)
+from test_ks_matching import make_series, stream_tokens
+
+HEADER = struct.Struct('<4sBBBBII')
+
+
+def compressed_stream(seed):
+    """Stream thật có cả ghi đè buffer (pool 2 buffer) và đổi block size (sampling)"""
+    result = LosslessCompressor({'num_buffers': 2}).compress(make_series(7, seed))
+    tokens = stream_tokens(result['encoded_stream'])
+    assert BUFFER_OVERWRITE_MARKER in tokens and BLOCKSIZE_CHANGE_MARKER in tokens
+    return result
+
+
+def header_of(payload):
+    magic, version, token_width, codec, decimals, n_tokens, n_blocks = HEADER.unpack_from(payload)
+    assert magic == FORMAT_MAGIC
+    return {'token_width': token_width, 'codec': codec, 'decimals': decimals}
+
+
+@pytest.mark.parametrize('codec', ['int16', 'int32', 'float64'])
+@pytest.mark.parametrize('seed', [0, 1])
+def test_stream_round_trip(codec, seed):
+    result = compressed_stream(seed)
+    payload = encode_stream(result['encoded_stream'], value_codec=codec)
+    assert header_of(payload)['codec'] == VALUE_CODECS[codec]
+    decoded = decode_stream(payload)
+    assert stream_tokens(decoded) == stream_tokens(result['encoded_stream'])
+    np.testing.assert_array_equal(
+        decompress_idealem(decoded, result['block_size'], result['num_buffers'], result['original_length']),
+        decompress_idealem(result['encoded_stream'], result['block_size'], result['num_buffers'],
+                           result['original_length']))
+
+
+def test_auto_codec_choice():
+    small = [BLOCK_MARKER, np.array([1.25, -3.5, 327.67])]
+    large = [BLOCK_MARKER, np.array([1.25, 50000.01])]
+    fractional = [BLOCK_MARKER, np.array([1 / 3, 2.0])]
+    assert header_of(encode_stream(small))['codec'] == VALUE_CODECS['int16']
+    assert header_of(encode_stream(large))['codec'] == VALUE_CODECS['int32']
+    assert header_of(encode_stream(fractional))['codec'] == VALUE_CODECS['float64']
+    for stream in (small, large, fractional):
+        assert stream_tokens(decode_stream(encode_stream(stream))) == stream_tokens(stream)
+
+
+def test_integer_codec_rejects_unrepresentable_values():
+    with pytest.raises(ValueError):
+        encode_stream([BLOCK_MARKER, [400.0]], value_codec='int16')
+    with pytest.raises(ValueError):
+        encode_stream([BLOCK_MARKER, [1 / 3]], value_codec='int32')
+
+
+@pytest.mark.parametrize('codec', ['int16', 'int32', 'float64'])
+def test_two_byte_tokens(codec):
+    # Đổi block size sang 300 (>= 256): mảng token phải dùng uint16
+    rng = np.random.default_rng(0)
+    first = np.round(rng.normal(40, 5, 24), 2)
+    second = np.round(rng.normal(40, 5, 300), 2)
+    third = np.round(rng.normal(40, 5, 300), 2)
+    stream = [BLOCK_MARKER, first, 0, BLOCKSIZE_CHANGE_MARKER, 300, BLOCK_MARKER, second, 0,
+              BUFFER_OVERWRITE_MARKER, 0, BLOCK_MARKER, third, 0]
+    payload = encode_stream(stream, value_codec=codec)
+    assert header_of(payload)['token_width'] == 2
+    decoded = decode_stream(payload)
+    assert stream_tokens(decoded) == stream_tokens(stream)
+    expected = np.concatenate([first, first, second, second, third, third])
+    np.testing.assert_array_equal(decompress_idealem(decoded, 24, 1, len(expected)), expected)
+
+
+def test_one_byte_tokens_when_all_below_256():
+    stream = [BLOCK_MARKER, np.array([1.0, 2.0]), 0, BLOCKSIZE_CHANGE_MARKER, 255, BLOCK_MARKER, np.array([3.0])]
+    payload = encode_stream(stream)
+    assert header_of(payload)['token_width'] == 1
+    assert stream_tokens(decode_stream(payload)) == stream_tokens(stream)
+
+
+@pytest.mark.parametrize('decimals', [0, 1, 2, 3, 4])
+def test_pack_block_round_trip(decimals):
+    rng = np.random.default_rng(decimals)
+    # Giá trị âm/dương, hiệu lớn giữa các mẫu và giá trị 0 để có varint nhiều byte
+    values = np.round(np.concatenate([rng.normal(0, 1000, 50), [0.0, -99999.0, 99999.0, 0.0]]), decimals)
+    packed = pack_block(values, decimals)
+    assert packed is not None and packed[0] == decimals
+    np.testing.assert_array_equal(unpack_block(packed), values)
+    # Block trong JSON được ghi dạng base64
+    np.testing.assert_array_equal(unpack_block(base64.b64encode(packed).decode('ascii')), values)
+
+
+def test_pack_block_zigzag_varint_sizes():
+    # Hiệu -1, 0, 1 sau zigzag là 1, 0, 2: mỗi giá trị một byte; hiệu 64 cần hai byte
+    assert pack_block([0.01, 0.0, 0.01, 0.01]) == bytes((2, 2, 1, 2, 0))
+    assert len(pack_block([0.0, 0.64])) == 1 + 1 + 2
+    assert len(unpack_block(pack_block([]))) == 0
+
+
+@pytest.mark.parametrize('values, decimals', [
+    ([1.234], 2),             # Nhiều chữ số thập phân hơn decimals
+    ([0.5], 0),
+    ([1e14], 2),              # |giá trị| * 10**decimals >= 2**52
+    ([-1e14], 2),
+    ([1.0, float('nan')], 2),
+    ([float('inf')], 2),
+])
+def test_pack_block_fallback(values, decimals):
+    assert pack_block(values, decimals) is None
+
+
+@pytest.mark.parametrize('decimals', [2, 3])
+def test_varint_block_encoding_round_trip(decimals):
+    data = make_series(3, 0)
+    # Vài giá trị có 3 chữ số thập phân: với decimals=2 block chứa chúng giữ dạng float
+    data[::500] = np.round(data[::500] + 0.005, 3)
+    expected = LosslessCompressor({'num_buffers': 2}).compress(data)
+    result = LosslessCompressor({'num_buffers': 2, 'block_encoding': 'varint',
+                                 'block_decimals': decimals}).compress(data)
+    blocks = [x for x in result['encoded_stream'] if isinstance(x, (bytes, np.ndarray))]
+    assert any(isinstance(b, bytes) for b in blocks)
+    assert all(isinstance(b, bytes) for b in blocks) == (decimals == 3)
+    decoded = decode_stream(encode_stream(result['encoded_stream']))
+    np.testing.assert_array_equal(
+        decompress_idealem(decoded, result['block_size'], result['num_buffers'], result['original_length']),
+        decompress_idealem(expected['encoded_stream'], expected['block_size'], expected['num_buffers'],
+                           expected['original_length']))
+
+
+RANGE_PAYLOADS = {
+    'empty': b'',
+    'zero': b'\x00',
+    'single': b'\xff',
+    'run': bytes(20000),                      # Một ký hiệu lặp lại: tần suất bị chia đôi nhiều lần
+    'alphabet': bytes(range(256)) * 3,
+    'random': np.random.default_rng(0).integers(0, 256, 5000, dtype=np.uint8).tobytes(),
+    'tokens': np.random.default_rng(1).choice([0, 1, 2, BLOCK_MARKER], 5000, p=[0.6, 0.2, 0.1, 0.1])
+                .astype(np.uint8).tobytes(),
+}
+
+
+@pytest.mark.parametrize('name', list(RANGE_PAYLOADS))
+def test_range_coder_round_trip(name):
+    symbols = RANGE_PAYLOADS[name]
+    coded = range_encode(symbols)
+    assert range_decode(coded, len(symbols)) == symbols
+    # Giải ít ký hiệu hơn cho đúng phần đầu
+    assert range_decode(coded, len(symbols) // 2) == symbols[:len(symbols) // 2]
+
+
+def test_range_coder_compresses_skewed_tokens():
+    assert len(range_encode(RANGE_PAYLOADS['tokens'])) < len(RANGE_PAYLOADS['tokens']) // 2
+
+
+def post_stage_containers():
+    rng = np.random.default_rng(0)
+    return {
+        'empty': encode_stream([]),
+        'single_token': encode_stream([0]),
+        'single_value': encode_stream([BLOCK_MARKER, np.array([1.5])]),
+        'stream': encode_stream(compressed_stream(0)['encoded_stream']),
+        'two_byte_tokens': encode_stream([BLOCK_MARKER, np.round(rng.normal(40, 5, 24), 2), 0,
+                                          BLOCKSIZE_CHANGE_MARKER, 300, BLOCK_MARKER,
+                                          np.round(rng.normal(40, 5, 300), 2), 0]),
+    }
+
+
+@pytest.mark.parametrize('stage', list(POST_STAGES))
+def test_post_stage_round_trip(stage):
+    for name, container in post_stage_containers().items():
+        payload = apply_post_stage(container, stage)
+        assert post_stage_of(payload) == stage, name
+        assert remove_post_stage(payload) == container, name
+        assert remove_post_stage(memoryview(payload)) == container, name
+        assert stream_tokens(load_encoded_stream(payload)) == stream_tokens(decode_stream(container)), name
+        if stage == 'none':
+            assert payload == container
+
+
+def test_post_stage_rejects_unknown_stage():
+    container = encode_stream([0])
+    with pytest.raises(ValueError):
+        apply_post_stage(container, 'brotli')
+    payload = bytearray(apply_post_stage(container, 'zlib'))
+    payload[len(POST_STAGE_MAGIC)] = 99
+    with pytest.raises(ValueError):
+        remove_post_stage(payload)
+
+
+def five_minute_series(count, start='2024-01-01T00:00:00'):
+    return np.datetime64(start, 'us') + np.arange(count) * np.timedelta64(5, 'm')
+
+
+def irregular_series():
+    rng = np.random.default_rng(0)
+    regular = five_minute_series(2000)
+    # Mất mẫu (khoảng trống vài giờ), lệch vài giây/micro giây và trùng timestamp
+    kept = np.sort(rng.choice(len(regular), 1500, replace=False))
+    jitter = rng.integers(-30_000_000, 30_000_000, len(kept)).astype('timedelta64[us]')
+    series = np.sort(regular[kept] + jitter)
+    return np.concatenate([series[:10], series[9:10], series[10:]])
+
+
+TIMESTAMP_SERIES = {
+    'empty': np.empty(0, dtype='datetime64[us]'),
+    'single': five_minute_series(1),
+    'two': five_minute_series(2),
+    'regular': five_minute_series(288 * 7),
+    'gap': np.concatenate([five_minute_series(100), five_minute_series(100, '2024-01-03T00:00:00')]),
+    'irregular': irregular_series(),
+    'before_epoch': five_minute_series(10, '1969-12-31T23:40:00.000001'),
+}
+
+
+@pytest.mark.parametrize('name', list(TIMESTAMP_SERIES))
+def test_timestamp_round_trip(name):
+    timestamps = TIMESTAMP_SERIES[name]
+    decoded = decode_timestamps(encode_timestamps(timestamps))
+    assert decoded.dtype == np.dtype('datetime64[us]')
+    np.testing.assert_array_equal(decoded, timestamps)
+
+
+def test_timestamp_channel_accepts_datetimes():
+    timestamps = [datetime(2024, 1, 1, 0, 0), datetime(2024, 1, 1, 0, 5, 0, 250), datetime(2024, 1, 1, 0, 11)]
+    np.testing.assert_array_equal(decode_timestamps(encode_timestamps(timestamps)),
+                                  np.array(timestamps, dtype='datetime64[us]'))
+
+
+def test_regular_timestamps_are_two_runs():
+    # (delta đầu, 1) và (0, n - 2): chỉ độ dài varint của n - 2 đổi theo số mẫu
+    assert len(encode_timestamps(five_minute_series(288 * 7))) == len(encode_timestamps(five_minute_series(288)))
+    assert len(encode_timestamps(five_minute_series(288 * 7))) < 32
+
+
+def test_timestamp_channel_rejects_bad_payload():
+    payload = encode_timestamps(five_minute_series(10))
+    with pytest.raises(ValueError):
+        decode_timestamps(b'XXXX' + payload[4:])
+    with pytest.raises(ValueError):
+        decode_timestamps(payload[:-1])